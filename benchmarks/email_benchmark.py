@@ -0,0 +1,87 @@
+# benchmarks/email_benchmark.py
+#
+# Sends a synthetic campaign through EmailService to a local aiosmtpd sink and reports throughput.
+# Requires `pip install aiosmtpd`. Run from the repository root:
+#
+#     python -m benchmarks.email_benchmark --recipients 5000 --pool-size 8 --rate 0
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+
+class CountingHandler:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self._lock:
+            self.received += 1
+        return "250 Message accepted for delivery"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bulk email engine against a local SMTP sink.")
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="Fraction of rows that repeat an address.")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second; 0 disables rate limiting.")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Artificial delay per message in the sink.")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        sys.exit("This benchmark needs the aiosmtpd package: pip install aiosmtpd")
+
+    # The service reads its configuration from the environment, so the sink settings go in first.
+    os.environ.update({
+        "EMAIL_HOST": "127.0.0.1",
+        "EMAIL_PORT": str(args.port),
+        "EMAIL_HOST_USER": "bench@example.com",
+        "EMAIL_HOST_PASSWORD": "unused",
+        "EMAIL_SENDER_NAME": "Benchmark",
+        "EMAIL_USE_TLS": "false",
+        "EMAIL_USE_AUTH": "false",
+        "EMAIL_POOL_SIZE": str(args.pool_size),
+        "EMAIL_RATE_PER_SECOND": str(args.rate),
+    })
+    from services.email_service import EmailService
+
+    handler = CountingHandler(args.latency_ms / 1000)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        service = EmailService()
+        unique = max(1, int(args.recipients * (1 - args.duplicates)))
+        rows = [
+            {"email": f"user{i % unique}@example.com", "name": f"User {i}", "plan": "pro" if i % 3 else "free"}
+            for i in range(args.recipients)
+        ]
+        template = "<p>Hello {{name}},</p><p>Your {{plan}} plan renews soon.</p>"
+
+        started = time.perf_counter()
+        job = service.submit_job([], "Benchmark", template, rows)
+        job.wait()
+        elapsed = time.perf_counter() - started
+        result = job.to_dict()
+    finally:
+        controller.stop()
+
+    print(f"recipients:     {args.recipients} ({result['duplicates']} duplicates skipped)")
+    print(f"sent / failed:  {result['sent']} / {result['failed']} (sink received {handler.received})")
+    print(f"pool size:      {args.pool_size}, rate limit: {args.rate or 'off'}")
+    print(f"elapsed:        {elapsed:.2f}s")
+    print(f"throughput:     {result['sent'] / elapsed:.1f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
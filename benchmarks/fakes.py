@@ -0,0 +1,190 @@
+# benchmarks/fakes.py
+#
+# Offline stand-ins used by the benchmarks: a deterministic replacement for the Gemini chat model,
+# generators for synthetic SQL and MongoDB databases, and an in-memory MongoDB via mongomock.
+
+import asyncio
+import datetime
+import json
+import os
+import time
+from prompts import prompt_templates
+
+FACTS_TABLE = "bench_facts"
+CATEGORIES = ("books", "games", "garden", "music", "office", "sports", "toys")
+_BASE_TIME = datetime.datetime(2024, 1, 1)
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeChatModel:
+    # Same call surface as ChatGoogleGenerativeAI (call, ainvoke, astream). The answer is picked by
+    # the prompt template the prompt was formatted from, and every call waits `latency` seconds.
+    def __init__(self, answers: dict, latency: float = 0.0, stream_chunks: int = 20):
+        self.answers = answers
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.calls = {}
+        # The literal text before a template's first placeholder identifies it in a formatted prompt.
+        self._prefixes = sorted(
+            ((value.split("{", 1)[0], name.removesuffix("_PROMPT").lower())
+             for name, value in vars(prompt_templates).items() if name.endswith("_PROMPT") and isinstance(value, str)),
+            key=lambda item: -len(item[0])
+        )
+
+    def template_of(self, prompt: str) -> str:
+        return next((name for prefix, name in self._prefixes if prompt.startswith(prefix)), "other")
+
+    def answer(self, prompt: str) -> str:
+        name = self.template_of(prompt)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        answer = self.answers.get(name)
+        if answer is None:
+            raise RuntimeError(f"The fake model has no answer for the '{name}' prompt.")
+        return answer(prompt) if callable(answer) else answer
+
+    def __call__(self, messages):
+        time.sleep(self.latency)
+        return _Message(self.answer(messages[-1].content))
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        return _Message(self.answer(messages[-1].content))
+
+    async def astream(self, messages):
+        # The latency is the time to the first chunk; the rest follows immediately.
+        text = self.answer(messages[-1].content)
+        await asyncio.sleep(self.latency)
+        size = max(1, len(text) // self.stream_chunks)
+        for start in range(0, len(text), size):
+            yield _Message(text[start:start + size])
+
+
+def default_answers(db_type: str) -> dict:
+    # Canned answers for a question about the facts table or collection of the generated databases.
+    report = "# Report\n\n" + "\n".join(
+        f"* The {category} category accounts for a steady share of the total amount." for category in CATEGORIES
+    )
+    return {
+        "initial_analysis": json.dumps({
+            "database_type": "SQL" if db_type == "sql" else "NoSQL",
+            "database_name": "sqlite" if db_type == "sql" else "mongodb",
+            "isEmailRequired": False,
+            "isReportGenerationRequired": True,
+            "isVisualizationRequired": True,
+        }),
+        "sql_generation": f"SELECT * FROM {FACTS_TABLE}",
+        "sql_regeneration": f"SELECT * FROM {FACTS_TABLE}",
+        "nosql_generation": json.dumps({"collection": FACTS_TABLE, "query": {}}),
+        "nosql_regeneration": json.dumps({"collection": FACTS_TABLE, "query": {}}),
+        "report_generation": report,
+        "visualization_spec": json.dumps({
+            "chart_type": "bar", "x_field": "category", "y_fields": ["amount"], "aggregation": "sum",
+            "title": "Amount by category",
+        }),
+        "email_generation": json.dumps({
+            "subject": "Your {{category}} summary",
+            "body": "<p>Hello {{name}},</p><p>Your latest {{category}} order came to {{amount}}.</p>",
+        }),
+    }
+
+
+def install_fake_model(model: FakeChatModel):
+    # Only the model of the shared service is replaced, so prompt formatting, the response cache
+    # and the telemetry around each call still run.
+    from services.llm_service import get_llm_service
+    get_llm_service().model = model
+
+
+def fact_row(i: int) -> dict:
+    return {
+        "id": i + 1,
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "amount": round((i * 37 % 1000) / 10, 2),
+        "created_at": _BASE_TIME + datetime.timedelta(minutes=i),
+    }
+
+
+def build_sql_database(db_url: str, tables: int, rows: int, batch_size: int = 50_000):
+    # One facts table with `rows` rows plus `tables - 1` small tables that reference it. Every
+    # table is named bench_*; existing ones are dropped first.
+    from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, create_engine
+
+    engine = create_engine(db_url)
+    metadata = MetaData()
+    facts = Table(
+        FACTS_TABLE, metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String(64)),
+        Column("email", String(128)),
+        Column("category", String(32), index=True),
+        Column("amount", Float),
+        Column("created_at", DateTime),
+    )
+    for n in range(1, tables):
+        Table(
+            f"bench_t{n:04d}", metadata,
+            Column("id", Integer, primary_key=True),
+            Column("fact_id", Integer, ForeignKey(f"{FACTS_TABLE}.id")),
+            Column("label", String(64)),
+            Column("value", Float),
+        )
+    try:
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        with engine.begin() as connection:
+            for start in range(0, rows, batch_size):
+                connection.execute(facts.insert(), [fact_row(i) for i in range(start, min(rows, start + batch_size))])
+    finally:
+        engine.dispose()
+
+
+def sqlite_database(data_dir: str, tables: int, rows: int) -> str:
+    # Generated SQLite files are kept in data_dir and reused; large ones take a while to build.
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"bench_{tables}t_{rows}r.db")
+    if not os.path.exists(path):
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        build_sql_database(f"sqlite:///{partial}", tables, rows)
+        os.replace(partial, path)
+    return f"sqlite:///{path}"
+
+
+def use_mongomock(db_url: str):
+    # Every MongoClient the connection registry opens becomes one shared in-memory mongomock client.
+    import mongomock
+    from services import connection_registry as registry_module
+
+    # mongomock rejects the `comment` that tags each find() for cancellation; it has no server-side
+    # operations to kill anyway.
+    find = mongomock.collection.Collection.find
+    if not getattr(find, "_drops_comment", False):
+        def find_without_comment(self, *args, comment=None, **kwargs):
+            return find(self, *args, **kwargs)
+        find_without_comment._drops_comment = True
+        mongomock.collection.Collection.find = find_without_comment
+
+    client = mongomock.MongoClient(db_url)
+    registry_module.MongoClient = lambda *args, **kwargs: client
+    return client
+
+
+def build_mongo_database(database, collections: int, rows: int, batch_size: int = 50_000):
+    for name in database.list_collection_names():
+        if name.startswith("bench_"):
+            database.drop_collection(name)
+    facts = database[FACTS_TABLE]
+    for start in range(0, rows, batch_size):
+        facts.insert_many([fact_row(i) for i in range(start, min(rows, start + batch_size))])
+    facts.create_index("category")
+    for n in range(1, collections):
+        database[f"bench_t{n:04d}"].insert_many(
+            [{"fact_id": i + 1, "label": f"label {i}", "value": float(i)} for i in range(5)]
+        )
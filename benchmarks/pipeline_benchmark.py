@@ -0,0 +1,521 @@
+# benchmarks/pipeline_benchmark.py
+#
+# Offline end-to-end benchmark. Drives the /api/query handler and the database and email services
+# with a fake Gemini model (see benchmarks/fakes.py), generated SQLite databases, mongomock and a
+# local aiosmtpd sink, so no API key or database server is needed. Reports throughput, p50/p99
+# latency and peak RSS per stage, and compares them against a saved baseline. Run from the
+# repository root:
+#
+#     python -m benchmarks.pipeline_benchmark --profile quick --save-baseline benchmarks/baselines/quick.json
+#     python -m benchmarks.pipeline_benchmark --profile quick --baseline benchmarks/baselines/quick.json
+#
+# --sql-url and --mongo-url run the suites against scratch PostgreSQL/MySQL and MongoDB servers
+# instead. Every table and collection the benchmark creates there is named bench_* and is dropped
+# and recreated. Baselines are only comparable on the machine that recorded them.
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = {
+    # Schema sizes are measured on a 1,000-row facts table, result sizes on a 10-table schema.
+    "quick": {"schema_tables": [10, 200], "result_rows": [10, 10_000], "requests": 20, "repeat": 3,
+              "email_recipients": 500},
+    "full": {"schema_tables": [10, 200, 2000], "result_rows": [10, 10_000, 1_000_000, 10_000_000], "requests": 100,
+             "repeat": 5, "email_recipients": 5000},
+}
+BASE_ROWS = 1_000
+BASE_TABLES = 10
+SUITES = ("pipeline", "db", "email")
+TOOL_PHRASES = {
+    "report": "and generate a report",
+    "visualization": "with a bar chart",
+    "email": "and send an email to each of them",
+}
+
+
+# --- Measurement ---------------------------------------------------------------------------
+
+def current_rss() -> int | None:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Only the peak so far is available here: kilobytes on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    # Samples the resident set size on a background thread, so the peak during any time window
+    # (e.g. one stage) can be looked up afterwards.
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            if rss is not None:
+                self.samples.append((time.perf_counter(), rss))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def peak(self, start: float, end: float) -> int | None:
+        # The last sample before the window counts too: a short stage may fall between two samples.
+        inside = [rss for at, rss in self.samples if start <= at <= end]
+        before = [rss for at, rss in self.samples if at < start][-1:]
+        return max(inside + before, default=None)
+
+
+class StageCollector:
+    # Span processor that keeps the finished stage and LLM spans of the current scenario.
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, span):
+        if span.stage is not None or span.name == "llm":
+            self.spans.append((span.stage or span.name, span.trace_id, span.started, span.duration))
+
+    def drain(self) -> list:
+        spans, self.spans = self.spans, []
+        return spans
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    # Nearest-rank percentile.
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def _mb(value: int | None) -> float | None:
+    return round(value / 1024 / 1024, 1) if value is not None else None
+
+
+def latency_summary(seconds: list[float]) -> dict:
+    return {
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 2) if seconds else None,
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 2) if seconds else None,
+    }
+
+
+def stage_summary(spans: list, sampler: RssSampler) -> dict:
+    # A stage that runs twice in one request (a regenerated query, two LLM calls) counts as its total.
+    per_request, windows = {}, {}
+    for stage, trace_id, started, duration in spans:
+        key = (stage, trace_id)
+        per_request[key] = per_request.get(key, 0.0) + duration
+        windows.setdefault(stage, []).append((started, started + duration))
+    stages = {}
+    for stage in sorted(windows):
+        durations = [total for (name, _), total in per_request.items() if name == stage]
+        peaks = [sampler.peak(start, end) for start, end in windows[stage]]
+        stages[stage] = {
+            **latency_summary(durations),
+            "peak_rss_mb": _mb(max((peak for peak in peaks if peak is not None), default=None)),
+        }
+    return stages
+
+
+def measure(fn, repeat: int, sampler: RssSampler) -> dict:
+    # Runs a blocking call `repeat` times; `fn` returns the number of rows or items it handled.
+    durations, handled = [], 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        handled = fn()
+        durations.append(time.perf_counter() - call_started)
+    summary = latency_summary(durations)
+    summary["peak_rss_mb"] = _mb(sampler.peak(started, time.perf_counter()))
+    if handled:
+        summary["rows_per_second"] = round(handled / percentile(durations, 0.50), 1)
+    return summary
+
+
+# --- Suites --------------------------------------------------------------------------------
+
+def pipeline_prompt(tools: list[str]) -> str:
+    return " ".join(["show all rows of bench_facts"] + [TOOL_PHRASES[tool] for tool in tools])
+
+
+async def run_pipeline_scenario(db_url: str, prompt: str, requests: int, concurrency: int,
+                                collector: StageCollector, sampler: RssSampler) -> dict:
+    from fastapi import HTTPException
+    from routes.query_router import handle_query
+    from utils.models import QueryRequest
+    from utils.telemetry import span
+
+    error_keys = ("database_connection_error", "schema_fetching_error", "query_execution_error")
+    latencies, errors = [], []
+
+    async def one() -> float:
+        with span("benchmark_request"):
+            started = time.perf_counter()
+            try:
+                response = await handle_query(QueryRequest(database_url=db_url, prompt=prompt))
+                body = json.loads(response.body)
+                errors.extend(body[key] for key in error_keys if key in body)
+                errors.extend(value for key, value in body.items() if key.endswith("_error") and key not in error_keys)
+            except HTTPException as e:
+                errors.append(e.detail)
+            return time.perf_counter() - started
+
+    # The first request reflects the schema; it is reported as the cold latency.
+    cold = await one()
+    collector.drain()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def bounded():
+        async with limit:
+            latencies.append(await one())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": requests,
+        "errors": len(errors),
+        "throughput_rps": round(requests / elapsed, 2),
+        "cold_ms": round(cold * 1000, 2),
+        "latency": latency_summary(latencies),
+        "peak_rss_mb": _mb(sampler.peak(started, time.perf_counter())),
+        "stages": stage_summary(collector.drain(), sampler),
+    }
+    if errors:
+        result["first_error"] = str(errors[0])[:300]
+    return result
+
+
+def pipeline_suite(args, databases: dict, collector: StageCollector, sampler: RssSampler) -> dict:
+    from benchmarks.fakes import FakeChatModel, default_answers, install_fake_model
+
+    prompt = pipeline_prompt(args.tools)
+    results = {}
+    for db_type, scenarios in databases.items():
+        install_fake_model(FakeChatModel(default_answers(db_type), latency=args.llm_latency_ms / 1000))
+        for label, db_url in scenarios:
+            print(f"  pipeline {db_type} {label} ...", flush=True)
+            results[f"{db_type}/{label}"] = asyncio.run(run_pipeline_scenario(
+                db_url, prompt, args.requests, args.concurrency, collector, sampler
+            ))
+    return results
+
+
+def db_suite(args, databases: dict, sampler: RssSampler) -> dict:
+    from benchmarks.fakes import FACTS_TABLE
+    from services import db_service
+
+    def consume(batches) -> int:
+        return sum(len(batch) for batch in batches)
+
+    results = {}
+    for db_type, scenarios in databases.items():
+        for label, db_url in scenarios:
+            print(f"  db {db_type} {label} ...", flush=True)
+            if db_type == "sql":
+                query = f"SELECT * FROM {FACTS_TABLE}"
+                results[f"{db_type}/{label}"] = {
+                    "reflect_schema": measure(lambda: len(db_service.reflect_sql_schema(db_url)), args.repeat, sampler),
+                    "execute_page": measure(
+                        lambda: len(db_service.execute_sql_query(db_url, query)["rows"]), args.repeat, sampler
+                    ),
+                    "stream_all": measure(lambda: consume(db_service.iter_sql_query(db_url, query)), args.repeat, sampler),
+                }
+            else:
+                query = {"collection": FACTS_TABLE, "query": {}}
+                results[f"{db_type}/{label}"] = {
+                    "reflect_schema": measure(lambda: len(db_service.reflect_nosql_schema(db_url)), args.repeat, sampler),
+                    "execute_page": measure(
+                        lambda: len(db_service.execute_nosql_query(db_url, query)["rows"]), args.repeat, sampler
+                    ),
+                    "stream_all": measure(lambda: consume(db_service.iter_nosql_query(db_url, query)), args.repeat, sampler),
+                }
+    return results
+
+
+def email_suite(args, sampler: RssSampler) -> dict:
+    from benchmarks.fakes import fact_row
+    from services.email_service import EmailService
+
+    print(f"  email {args.email_recipients} recipients ...", flush=True)
+    service = EmailService()
+    rows = [fact_row(i) for i in range(args.email_recipients)]
+    template = "<p>Hello {{name}},</p><p>Your latest {{category}} order came to {{amount}}.</p>"
+    started = time.perf_counter()
+    job = service.submit_job([], "Benchmark", template, rows)
+    job.wait()
+    elapsed = time.perf_counter() - started
+    outcome = job.to_dict()
+    return {
+        "recipients": args.email_recipients,
+        "sent": outcome["sent"],
+        "failed": outcome["failed"],
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "throughput_per_second": round(outcome["sent"] / elapsed, 1),
+        "peak_rss_mb": _mb(sampler.peak(started, time.perf_counter())),
+    }
+
+
+# --- Databases -----------------------------------------------------------------------------
+
+def _forget(db_url: str) -> str:
+    # A rebuilt server database must not be answered from the previous scenario's caches.
+    from services.result_cache import result_cache
+    from services.schema_cache import schema_cache
+    schema_cache.invalidate(db_url)
+    result_cache.invalidate(db_url)
+    return db_url
+
+
+def sql_scenarios(args) -> list:
+    from benchmarks.fakes import build_sql_database, sqlite_database
+
+    def prepare(tables, rows):
+        build_sql_database(args.sql_url, tables, rows)
+        return _forget(args.sql_url)
+
+    sizes = [(tables, BASE_ROWS) for tables in args.schema_tables]
+    sizes += [(BASE_TABLES, rows) for rows in args.result_rows if (BASE_TABLES, rows) not in sizes]
+    scenarios = []
+    for tables, rows in sizes:
+        label = f"{tables}t_{rows}r"
+        if args.sql_url:
+            # A server database holds one generated schema at a time, so each scenario rebuilds it.
+            scenarios.append((label, lambda tables=tables, rows=rows: prepare(tables, rows)))
+        else:
+            print(f"  preparing SQLite database {label} ...", flush=True)
+            scenarios.append((label, sqlite_database(args.data_dir, tables, rows)))
+    return scenarios
+
+
+def mongo_scenarios(args) -> list:
+    from benchmarks.fakes import build_mongo_database
+    from services.connection_registry import connection_registry
+
+    db_url = args.mongo_url or "mongodb://localhost:27017/bench"
+    if not args.mongo_url:
+        from benchmarks.fakes import use_mongomock
+        use_mongomock(db_url)
+    sizes = [(tables, BASE_ROWS) for tables in args.schema_tables]
+    sizes += [(BASE_TABLES, rows) for rows in args.mongo_rows if (BASE_TABLES, rows) not in sizes]
+
+    def prepare(tables, rows):
+        with connection_registry.lease_mongo_client(db_url) as client:
+            build_mongo_database(client.get_default_database(), tables, rows)
+        return _forget(db_url)
+
+    return [(f"{tables}t_{rows}r", lambda tables=tables, rows=rows: prepare(tables, rows)) for tables, rows in sizes]
+
+
+def run_lazily(scenarios: list) -> list:
+    # Scenarios that share one server database are built right before they run.
+    for label, target in scenarios:
+        yield label, target() if callable(target) else target
+
+
+class _LazyDatabases(dict):
+    def items(self):
+        return ((db_type, run_lazily(scenarios)) for db_type, scenarios in super().items())
+
+
+# --- Baselines -----------------------------------------------------------------------------
+
+_HIGHER_IS_BETTER = ("throughput_rps", "throughput_per_second", "rows_per_second")
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    print(f"\n{'metric':<70} {'baseline':>12} {'current':>12} {'change':>9}")
+    for path in sorted(current.keys() & previous.keys()):
+        metric = path.rsplit("/", 1)[-1]
+        if not (metric.endswith("_ms") or metric.endswith("_mb") or metric in _HIGHER_IS_BETTER):
+            continue
+        before, after = previous[path], current[path]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if metric in _HIGHER_IS_BETTER else change
+        marker = "  REGRESSION" if worse > tolerance else ""
+        if marker:
+            regressions.append(path)
+        print(f"{path:<70} {before:>12} {after:>12} {change:>+8.0%}{marker}")
+    return regressions
+
+
+# --- Entry point ---------------------------------------------------------------------------
+
+def _sizes(value: str) -> list[int]:
+    return [int(float(size)) for size in value.split(",") if size]
+
+
+def configure_environment(args):
+    # The services read their settings when first imported, so this runs before any of them is.
+    os.environ.update({
+        "GEMINI_API_KEY": "offline-benchmark",
+        "EMAIL_HOST": "127.0.0.1",
+        "EMAIL_PORT": str(args.smtp_port),
+        "EMAIL_HOST_USER": "bench@example.com",
+        "EMAIL_HOST_PASSWORD": "unused",
+        "EMAIL_SENDER_NAME": "Benchmark",
+        "EMAIL_USE_TLS": "false",
+        "EMAIL_USE_AUTH": "false",
+        "EMAIL_RATE_PER_SECOND": "0",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.with_caches:
+        # Measure the work itself rather than cache hits on the repeated prompt.
+        os.environ.update({"LLM_CACHE_ENABLED": "false", "RESULT_CACHE_ENABLED": "false"})
+    if not args.with_rate_limits:
+        # The fake model has no quota; with the default Gemini limits the runs would measure the
+        # request bucket instead of the pipeline.
+        os.environ.update({"LLM_REQUESTS_PER_MINUTE": "0", "LLM_TOKENS_PER_MINUTE": "0"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the query pipeline, database and email services.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated subset of {', '.join(SUITES)}.")
+    parser.add_argument("--schema-tables", type=_sizes, help="Comma-separated table counts, e.g. 10,200,2000.")
+    parser.add_argument("--result-rows", type=_sizes, help="Comma-separated facts table sizes, e.g. 10,1e4,1e7.")
+    parser.add_argument("--mongo-rows", type=_sizes, help="Facts collection sizes (default: --result-rows).")
+    parser.add_argument("--requests", type=int, help="Measured /api/query requests per pipeline scenario.")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, help="Repetitions of each database call.")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="Delay of every fake Gemini call.")
+    parser.add_argument("--tools", default="report,visualization",
+                        help="Post-query tools the benchmark prompt asks for (report, visualization, email).")
+    parser.add_argument("--sql-url", help="Scratch PostgreSQL/MySQL database instead of generated SQLite files.")
+    parser.add_argument("--mongo-url", help="Scratch MongoDB database instead of mongomock.")
+    parser.add_argument("--no-mongo", action="store_true", help="Skip the MongoDB scenarios.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "db_automation_benchmark"),
+                        help="Where generated SQLite databases are kept between runs.")
+    parser.add_argument("--email-recipients", type=int)
+    parser.add_argument("--smtp-port", type=int, default=8025)
+    parser.add_argument("--with-caches", action="store_true", help="Keep the LLM and result caches enabled.")
+    parser.add_argument("--with-rate-limits", action="store_true",
+                        help="Keep the LLM_REQUESTS_PER_MINUTE and LLM_TOKENS_PER_MINUTE limits.")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    args.schema_tables = args.schema_tables or profile["schema_tables"]
+    args.result_rows = args.result_rows or profile["result_rows"]
+    args.mongo_rows = args.mongo_rows or args.result_rows
+    args.requests = args.requests or profile["requests"]
+    args.repeat = args.repeat or profile["repeat"]
+    args.email_recipients = args.email_recipients or profile["email_recipients"]
+    args.tools = [tool for tool in args.tools.split(",") if tool]
+    suites = [suite for suite in args.suites.split(",") if suite]
+    unknown = set(suites) - set(SUITES) | set(args.tools) - set(TOOL_PHRASES)
+    if unknown:
+        sys.exit(f"Unknown suite or tool: {', '.join(sorted(unknown))}")
+    if not args.no_mongo and not args.mongo_url and importlib.util.find_spec("mongomock") is None:
+        sys.exit("The MongoDB scenarios need mongomock (pip install mongomock), --mongo-url or --no-mongo.")
+
+    needs_smtp = "email" in suites or "email" in args.tools
+    controller = None
+    if needs_smtp:
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            sys.exit("The email benchmarks need the aiosmtpd package: pip install aiosmtpd")
+
+    configure_environment(args)
+    from benchmarks.email_benchmark import CountingHandler
+    from services.connection_registry import connection_registry
+    from utils.concurrency import shutdown_blocking_pool
+    from utils.telemetry import add_span_processor
+
+    collector = StageCollector()
+    add_span_processor(collector)
+    sampler = RssSampler()
+    sampler.start()
+    if needs_smtp:
+        controller = Controller(CountingHandler(0), hostname="127.0.0.1", port=args.smtp_port)
+        controller.start()
+
+    results = {}
+    try:
+        if "pipeline" in suites or "db" in suites:
+            databases = _LazyDatabases(sql=sql_scenarios(args))
+            if not args.no_mongo:
+                databases["nosql"] = mongo_scenarios(args)
+            if "pipeline" in suites:
+                results["pipeline"] = pipeline_suite(args, databases, collector, sampler)
+            if "db" in suites:
+                results["db"] = db_suite(args, databases, sampler)
+        if "email" in suites:
+            results["email"] = email_suite(args, sampler)
+    finally:
+        if controller is not None:
+            controller.stop()
+        sampler.stop()
+        connection_registry.dispose_all()
+        shutdown_blocking_pool()
+
+    report = {
+        "meta": {
+            "profile": args.profile,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "llm_latency_ms": args.llm_latency_ms,
+            "concurrency": args.concurrency,
+            "tools": args.tools,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# benchmarks/startup_benchmark.py
+#
+# Measures how long a fresh worker takes to start: the time to import the app, the slowest
+# imports, which heavy libraries are loaded before the first request, and how long a uvicorn
+# process takes to answer its first request and to finish warm-up (/api/ready). Each run is a new
+# interpreter, so nothing is cached between runs. Run from the repository root:
+#
+#     python -m benchmarks.startup_benchmark --runs 5
+#     python -m benchmarks.startup_benchmark --bare --env WARMUP_DATABASE_URLS=sqlite:////tmp/app.db
+#
+# --bare removes GEMINI_API_KEY and the EMAIL_* settings, which startup must not need. A .env file
+# in the checkout still provides them, so move it aside to test that.
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from benchmarks.pipeline_benchmark import compare, latency_summary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Libraries that should only load on first use.
+HEAVY_MODULES = ("langchain", "langchain_google_genai", "pandas", "numpy")
+
+_IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - started\n"
+    f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+)
+
+
+def _environment(args) -> dict:
+    env = dict(os.environ)
+    if args.bare:
+        for key in list(env):
+            if key == "GEMINI_API_KEY" or key.startswith("EMAIL_"):
+                del env[key]
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    return env
+
+
+def _parse_importtime(stderr: str, top: int) -> list[dict]:
+    # -X importtime lines: "import time: self_us | cumulative_us | <indent>module". The modules
+    # imported directly by main sit one level below it.
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1000))
+    main_depth = next((depth for depth, name, _ in entries if name == "main"), None)
+    if main_depth is None:
+        return []
+    children = [(name, ms) for depth, name, ms in entries if depth == main_depth + 2]
+    children.sort(key=lambda item: -item[1])
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for name, ms in children[:top]]
+
+
+def import_suite(args, env: dict) -> dict:
+    seconds, loaded = [], set()
+    for _ in range(args.runs):
+        probe = subprocess.run(
+            [sys.executable, "-c", _IMPORT_PROBE], cwd=ROOT, env=env, capture_output=True, text=True
+        )
+        if probe.returncode != 0:
+            sys.exit(f"Importing the app failed:\n{probe.stderr}")
+        outcome = json.loads(probe.stdout.strip().splitlines()[-1])
+        seconds.append(outcome["seconds"])
+        loaded.update(outcome["loaded"])
+    profile = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    return {
+        "runs": args.runs,
+        "import": latency_summary(seconds),
+        "heavy_modules_loaded": sorted(loaded),
+        "slowest_imports": _parse_importtime(profile.stderr, args.top),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _get_status(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def _start_server(env: dict, timeout: float) -> dict:
+    port = _free_port()
+    ready_url = f"http://127.0.0.1:{port}/api/ready"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    first_response = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                sys.exit(f"The server exited during startup:\n{server.stderr.read()}")
+            status = _get_status(ready_url)
+            elapsed = time.perf_counter() - started
+            if status is not None and first_response is None:
+                first_response = elapsed
+            if status == 200:
+                ready = elapsed
+                break
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    if first_response is None:
+        sys.exit(f"The server did not answer within {timeout} seconds.")
+    return {"first_response": first_response, "ready": ready}
+
+
+def server_suite(args, env: dict) -> dict:
+    first_response, ready = [], []
+    for _ in range(args.runs):
+        run = _start_server(env, args.timeout)
+        first_response.append(run["first_response"])
+        if run["ready"] is not None:
+            ready.append(run["ready"])
+    return {
+        "runs": args.runs,
+        "first_response": latency_summary(first_response),
+        "ready": latency_summary(ready) if ready else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start of the API.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--suites", default="import,server", help="Comma-separated subset of import, server.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest direct imports of main to list.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a server to be ready.")
+    parser.add_argument("--bare", action="store_true", help="Start without the Gemini and email settings.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the started processes, e.g. WARMUP_WAIT=true.")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    env = _environment(args)
+    suites = {suite.strip() for suite in args.suites.split(",") if suite.strip()}
+    results = {}
+    if "import" in suites:
+        results["import"] = import_suite(args, env)
+    if "server" in suites:
+        results["server"] = server_suite(args, env)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "bare": args.bare,
+            "env": args.env,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
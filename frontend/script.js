@@ -18,59 +18,116 @@ document.addEventListener('DOMContentLoaded', () => {
         responseContainer.innerHTML = '';
 
         try {
-            const response = await fetch('/api/query', {
+            const response = await fetch('/api/query/stream', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': 'application/x-ndjson' },
                 body: JSON.stringify({ database_url: dbUrl, prompt: prompt }),
             });
 
-            const data = await response.json();
-
             if (!response.ok) {
+                const data = await response.json();
                 throw new Error(data.detail || 'An unknown error occurred.');
             }
 
-            renderResponse(data);
+            await readEvents(response, createRenderer());
 
         } catch (error) {
-            responseContainer.innerHTML = `<div class="response-section"><h2>Error</h2><pre>${error.message}</pre></div>`;
+            responseContainer.appendChild(createSection('Error', `<pre>${error.message}</pre>`));
         } finally {
             loader.style.display = 'none';
         }
     });
 
-    function renderResponse(data) {
-        responseContainer.innerHTML = ''; // Clear previous results
-
-        if (data.email_status) {
-            const emailSection = createSection('📧 Email Status', `<div class="status-message">${data.email_status}</div>`);
-            responseContainer.appendChild(emailSection);
+    // The server sends one JSON event per line; a chunk can end in the middle of a line.
+    async function readEvents(response, renderer) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => renderer.handle(JSON.parse(line)));
         }
-
-        if (data.report) {
-            const reportHtml = marked.parse(data.report);
-            const reportSection = createSection('📊 Report', reportHtml);
-            responseContainer.appendChild(reportSection);
+        if (buffer.trim()) {
+            renderer.handle(JSON.parse(buffer));
         }
+    }
 
-        if (data.visual) {
-            const visualSection = createSection('📈 Visualization', '<canvas id="myChart"></canvas>');
-            responseContainer.appendChild(visualSection);
-            const ctx = document.getElementById('myChart').getContext('2d');
-            new Chart(ctx, data.visual);
+    // Sections are created when their first event arrives and always kept in the same order.
+    function createRenderer() {
+        const order = ['notice', 'email', 'report', 'visualization', 'result', 'query'];
+        const sections = {};
+        let table = null;
+        let reportText = '';
+
+        function section(key, title) {
+            if (!sections[key]) {
+                sections[key] = createSection(title, '');
+                const next = order.slice(order.indexOf(key) + 1).map(k => sections[k]).find(Boolean);
+                responseContainer.insertBefore(sections[key], next || null);
+            }
+            return sections[key];
         }
 
-        if (data.query_result) {
-            const tableHtml = createTable(data.query_result);
-            const resultSection = createSection('🔍 Query Result', tableHtml);
-            responseContainer.appendChild(resultSection);
+        function body(key, title) {
+            const target = section(key, title);
+            let content = target.querySelector('.section-body');
+            if (!content) {
+                content = document.createElement('div');
+                content.className = 'section-body';
+                target.appendChild(content);
+            }
+            return content;
         }
 
-        if (data.generated_query) {
-            const querySyntax = typeof data.generated_query === 'object' ? JSON.stringify(data.generated_query, null, 2) : data.generated_query;
-            const querySection = createSection('Generated Query', `<pre><code>${querySyntax}</code></pre>`);
-            responseContainer.appendChild(querySection);
-        }
+        return {
+            handle(event) {
+                const data = event.data;
+                switch (event.event) {
+                    case 'generated_query': {
+                        const querySyntax = typeof data.generated_query === 'object' ? JSON.stringify(data.generated_query, null, 2) : data.generated_query;
+                        body('query', 'Generated Query').innerHTML = `<pre><code>${querySyntax}</code></pre>`;
+                        break;
+                    }
+                    case 'rows':
+                        if (!table) {
+                            table = createTable(Object.keys(data.rows[0] || {}));
+                            body('result', '🔍 Query Result').appendChild(table);
+                        }
+                        appendRows(table, data.rows);
+                        break;
+                    case 'query_complete':
+                        if (data.row_count === 0) {
+                            body('result', '🔍 Query Result').innerHTML = '<p>No data returned from query.</p>';
+                        }
+                        break;
+                    case 'report_token':
+                        reportText += data.text;
+                        body('report', '📊 Report').innerHTML = marked.parse(reportText);
+                        break;
+                    case 'visualization': {
+                        const content = body('visualization', '📈 Visualization');
+                        content.innerHTML = '<canvas></canvas>';
+                        new Chart(content.querySelector('canvas').getContext('2d'), data.visual);
+                        break;
+                    }
+                    case 'email':
+                        body('email', '📧 Email Status').innerHTML = `<div class="status-message">${data.email_status}</div>`;
+                        break;
+                    case 'notice':
+                        Object.values(data).forEach(message => {
+                            body('notice', 'Notice').insertAdjacentHTML('beforeend', `<div class="status-message">${message}</div>`);
+                        });
+                        break;
+                    case 'error':
+                        throw new Error(data.detail);
+                }
+            }
+        };
     }
 
     function createSection(title, content) {
@@ -80,26 +137,31 @@ document.addEventListener('DOMContentLoaded', () => {
         return section;
     }
 
-    function createTable(data) {
-        if (!data || data.length === 0) {
-            return '<p>No data returned from query.</p>';
-        }
-
-        const headers = Object.keys(data[0]);
-        let table = '<table><thead><tr>';
-        headers.forEach(header => table += `<th>${header}</th>`);
-        table += '</tr></thead><tbody>';
+    function createTable(headers) {
+        const table = document.createElement('table');
+        table.innerHTML = '<thead><tr></tr></thead><tbody></tbody>';
+        const headerRow = table.querySelector('thead tr');
+        headers.forEach(header => {
+            const th = document.createElement('th');
+            th.textContent = header;
+            headerRow.appendChild(th);
+        });
+        table.dataset.headers = JSON.stringify(headers);
+        return table;
+    }
 
-        data.forEach(row => {
-            table += '<tr>';
+    function appendRows(table, rows) {
+        const headers = JSON.parse(table.dataset.headers);
+        const fragment = document.createDocumentFragment();
+        rows.forEach(row => {
+            const tr = document.createElement('tr');
             headers.forEach(header => {
-                const cellData = row[header] === null ? 'NULL' : row[header];
-                table += `<td>${cellData}</td>`;
+                const td = document.createElement('td');
+                td.textContent = row[header] === null ? 'NULL' : row[header];
+                tr.appendChild(td);
             });
-            table += '</tr>';
+            fragment.appendChild(tr);
         });
-
-        table += '</tbody></table>';
-        return table;
+        table.tBodies[0].appendChild(fragment);
     }
-});
\ No newline at end of file
+});
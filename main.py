@@ -1,15 +1,48 @@
 # main.py
 
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from routes.query_router import router as query_router
+from routes.system_router import router as system_router
+from routes.email_router import router as email_router
+from routes.job_router import router as job_router
+from routes.metrics_router import router as metrics_router
+from services.connection_registry import connection_registry
+from services.job_service import job_service
+from services.result_cache import result_cache
+from services.warmup import warm_up
+from utils.concurrency import shutdown_blocking_pool
+from utils.responses import FastJSONResponse
 from utils.error_handlers import add_exception_handlers
+from utils.telemetry import span, HTTP_REQUEST_DURATION
 import uvicorn
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs in the background by default, so the worker accepts requests at once;
+    # WARMUP_WAIT holds startup until it is done instead.
+    warming = asyncio.create_task(warm_up.run())
+    if warm_up.wait:
+        await warming
+    yield
+    warming.cancel()
+    # Stop running jobs and drop spilled cache files, then release every pooled engine and
+    # MongoClient so workers exit without dangling sockets.
+    job_service.shutdown()
+    result_cache.shutdown()
+    connection_registry.dispose_all()
+    shutdown_blocking_pool()
+
+
 app = FastAPI(
     title="Advanced Database Querying System",
     description="An AI-powered system for querying databases, generating reports, and more.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS Middleware to allow frontend communication
@@ -24,8 +57,30 @@ app.add_middleware(
 # Add global exception handling
 add_exception_handlers(app)
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Root span of every request; pipeline stages, LLM calls and serialization nest under it and
+    # share its trace id, which is also returned to the client. For streamed responses the
+    # duration ends when the headers are sent.
+    with span("http_request", method=request.method, path=request.url.path) as current:
+        response = await call_next(request)
+        current.set(status_code=response.status_code)
+    route = request.scope.get("route")
+    HTTP_REQUEST_DURATION.observe(
+        current.duration, method=request.method, route=route.path if route else "unmatched", status=response.status_code
+    )
+    response.headers["X-Trace-Id"] = current.trace_id
+    return response
+
+
 # Include API routers
 app.include_router(query_router, prefix="/api", tags=["Query"])
+app.include_router(system_router, prefix="/api", tags=["System"])
+app.include_router(email_router, prefix="/api", tags=["Email"])
+app.include_router(job_router, prefix="/api", tags=["Jobs"])
+app.include_router(metrics_router, tags=["Metrics"])
+
 
 @app.get("/", tags=["Root"])
 async def read_root():
@@ -41,16 +41,123 @@ You are an expert NoSQL database engineer specializing in MongoDB. Your task is
 DO NOT generate any text, explanation, or markdown formatting around the JSON. Only output a single, raw JSON object in the specified format.
 
 IMPORTANT: Based on the user's prompt (e.g., 'find all users'), you MUST infer the most likely collection name from the provided schema (e.g., 'users', 'customers'). If the user requests "everything", "all documents", or "all users", the "query" filter should be an empty dictionary: {{}}.
+Let the database do the work: only return the fields the user asked about with "projection", and use "sort" and "limit" for "top N" or "latest" questions.
+For counting, grouping, totals, averages or joins, output an aggregation "pipeline" instead of "query". Allowed stages: $match, $group, $project, $addFields, $set, $unset, $sort, $limit, $skip, $count, $unwind, $lookup, $bucket, $bucketAuto, $facet, $sortByCount, $replaceRoot, $replaceWith, $sample, $unionWith. Never use $where, $function or $accumulator.
+Write dates as {{"$date": "2025-01-31T00:00:00Z"}} and ObjectIds as {{"$oid": "..."}}.
 
 Database Collections and Sample Documents (Schema):
 {schema}
 
 User's Request: "{prompt}"
 
+JSON Output Format for a find ("projection", "sort" and "limit" are optional):
+{{
+  "collection": "target_collection_name",
+  "query": {{ "your_pymongo_query_filter": "value" }},
+  "projection": {{ "field": 1 }},
+  "sort": {{ "field": -1 }},
+  "limit": 10
+}}
+
+JSON Output Format for an aggregation:
+{{
+  "collection": "target_collection_name",
+  "pipeline": [{{ "$match": {{ "field": "value" }} }}, {{ "$group": {{ "_id": "$other_field", "count": {{ "$sum": 1 }} }} }}]
+}}
+"""
+
+SQL_BATCH_GENERATION_PROMPT = """
+You are an expert SQL engineer. Generate one single, highly efficient, and 100% syntactically correct SQL query for EACH of the numbered user requests below. The requests are independent of each other.
+
+DO NOT generate any text, explanation, or markdown formatting around the JSON. Only output a single, raw JSON object in the specified format, with exactly one query per request, in the same order as the requests.
+IMPORTANT: If a request asks for "everything", "all data", or "all users" from a table, generate a `SELECT * FROM your_table_name;` query for it.
+
+Database Dialect: {dialect}
+Database Schema:
+{schema}
+
+User's Requests:
+{requests}
+
 JSON Output Format:
+{{
+  "queries": ["SQL query for request 1", "SQL query for request 2"]
+}}
+"""
+
+NOSQL_BATCH_GENERATION_PROMPT = """
+You are an expert NoSQL database engineer specializing in MongoDB. Generate one valid PyMongo query for EACH of the numbered user requests below, inferring the target collection of each from the schema. The requests are independent of each other.
+
+DO NOT generate any text, explanation, or markdown formatting around the JSON. Only output a single, raw JSON object in the specified format, with exactly one query per request, in the same order as the requests.
+Each query is either a find ({{"collection", "query", and optionally "projection", "sort", "limit"}}) or, for counting, grouping, totals, averages or joins, an aggregation ({{"collection", "pipeline"}}). Allowed pipeline stages: $match, $group, $project, $addFields, $set, $unset, $sort, $limit, $skip, $count, $unwind, $lookup, $bucket, $bucketAuto, $facet, $sortByCount, $replaceRoot, $replaceWith, $sample, $unionWith. Never use $where, $function or $accumulator.
+Write dates as {{"$date": "2025-01-31T00:00:00Z"}} and ObjectIds as {{"$oid": "..."}}.
+
+Database Collections and Sample Documents (Schema):
+{schema}
+
+User's Requests:
+{requests}
+
+JSON Output Format:
+{{
+  "queries": [
+    {{ "collection": "target_collection_name", "query": {{ "your_pymongo_query_filter": "value" }} }},
+    {{ "collection": "target_collection_name", "pipeline": [{{ "$group": {{ "_id": "$field", "count": {{ "$sum": 1 }} }} }}] }}
+  ]
+}}
+"""
+
+SQL_REGENERATION_PROMPT = """
+You are an expert SQL engineer. A query you generated for the user's request was rejected before execution because its execution plan is too expensive. Generate a cheaper query that still answers the request.
+
+DO NOT generate any text, explanation, or markdown formatting around the query. Only output the raw SQL query.
+Prefer filters and joins on indexed columns, make sure every join has a join condition, and avoid functions on filtered columns.
+
+Database Dialect: {dialect}
+Database Schema:
+{schema}
+
+User's Request: "{prompt}"
+
+Rejected Query:
+{previous_query}
+
+Why It Was Rejected:
+{feedback}
+
+Generated SQL Query:
+"""
+
+NOSQL_REGENERATION_PROMPT = """
+You are an expert NoSQL database engineer specializing in MongoDB. A query you generated for the user's request was rejected before execution because its execution plan is too expensive. Generate a cheaper query that still answers the request.
+
+DO NOT generate any text, explanation, or markdown formatting around the JSON. Only output a single, raw JSON object in the specified format.
+Prefer filters on indexed fields so the query does not scan the whole collection. Keep the same output format as the rejected query: a find with "query" (and optional "projection", "sort", "limit") or an aggregation "pipeline" using only the stages it already uses plus $match, $project, $sort and $limit.
+
+Database Collections and Sample Documents (Schema):
+{schema}
+
+User's Request: "{prompt}"
+
+Rejected Query:
+{previous_query}
+
+Why It Was Rejected:
+{feedback}
+
+JSON Output Format for a find ("projection", "sort" and "limit" are optional):
+{{
+  "collection": "target_collection_name",
+  "query": {{ "your_pymongo_query_filter": "value" }},
+  "projection": {{ "field": 1 }},
+  "sort": {{ "field": -1 }},
+  "limit": 10
+}}
+
+JSON Output Format for an aggregation:
 {{
   "collection": "target_collection_name",
-  "query": {{ "your_pymongo_query_filter": "value" }}
+  "pipeline": [{{ "$match": {{ "field": "value" }} }}]
 }}
 """
 
@@ -78,24 +185,33 @@ You are a professional data analyst. Your task is to generate a comprehensive an
 
 The output should be in Markdown format. The report must be easy to read, professional, and provide clear insights. Include a title, summary, key findings, and detailed sections as appropriate.
 
+The data is given as a statistical digest of the query result rather than the raw rows: the row count, per-column types, null rates, min/max/mean/quantiles, most frequent values, group-by aggregates, a time series when the result has a date column, and a small representative sample of rows. Base every figure in the report on the digest; do not extrapolate totals from the sample.
+
 User's Request: "{prompt}"
-Query Result Data:
-{query_result}
+Result Scope: {result_scope}
+Query Result Digest:
+{result_digest}
 
 Generated Markdown Report:
 """
 
-VISUALIZATION_GENERATION_PROMPT = """
-You are a data visualization expert. Your task is to suggest the best way to visualize the given data to answer the user's request.
-You must generate a configuration for a chart using the Chart.js library format.
+VISUALIZATION_SPEC_PROMPT = """
+You are a data visualization expert. Your task is to choose the best chart to answer the user's request.
+You only choose the chart; the data points are computed by the server from the full query result.
 
-The output must be a single, valid JSON object representing the Chart.js configuration, with no surrounding text or explanations.
-Choose the most appropriate chart type (bar, line, pie, doughnut, etc.).
-The JSON should have 'type', 'data', and 'options' keys.
+The output must be a single, valid JSON object with no surrounding text or explanations, using these keys:
+- "chart_type": one of "bar", "line", "pie", "doughnut", "scatter", "histogram".
+- "x_field": the column for the x axis (or the slices of a pie chart).
+- "y_fields": a list of numeric columns to plot. Use an empty list with "count" to count rows.
+- "aggregation": one of "sum", "mean", "count", "min", "max", or "none" to plot the values as they are.
+- "time_bucket": one of "day", "week", "month", "quarter", "year" when x_field is a date column, otherwise null.
+- "bins": the number of bins for a histogram of x_field, otherwise null.
+- "top_n": how many categories to show before the rest are grouped as "Other", otherwise null.
+- "title": a short chart title.
 
 User's Request: "{prompt}"
-Query Result Data:
-{query_result}
+Query Result Columns:
+{columns}
 
-Generated Chart.js JSON:
-"""
\ No newline at end of file
+Generated Chart Spec JSON:
+"""
@@ -0,0 +1,27 @@
+# routes/email_router.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from services.email_service import EmailService, get_email_service
+
+router = APIRouter()
+
+
+def email_service_dependency() -> EmailService:
+    try:
+        return get_email_service()
+    except ValueError as e:
+        # Missing email settings only disable email; the rest of the API keeps working.
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/email/jobs/{job_id}")
+async def get_email_job(job_id: str, email_service: EmailService = Depends(email_service_dependency)):
+    job = email_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Email job '{job_id}' was not found or has expired.")
+    return job.to_dict()
+
+
+@router.get("/email/stats")
+async def get_email_stats(email_service: EmailService = Depends(email_service_dependency)):
+    return email_service.stats()
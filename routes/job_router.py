@@ -0,0 +1,60 @@
+# routes/job_router.py
+
+from fastapi import APIRouter, HTTPException, Response
+from services.job_service import job_service, JobQueueFullError
+from utils.concurrency import run_blocking
+from utils.models import QueryRequest
+
+router = APIRouter()
+
+
+def _get_job(job_id: str):
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' was not found or has expired.")
+    return job
+
+
+@router.post("/jobs/query", status_code=202)
+async def submit_query_job(request: QueryRequest):
+    # Runs the same pipeline as /api/query, detached from this HTTP request.
+    try:
+        job = job_service.submit(request)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {
+        **job.to_dict(),
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result",
+    }
+
+
+@router.get("/jobs/stats")
+async def get_job_stats():
+    return job_service.stats()
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _get_job(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = _get_job(job_id)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail={"status": job.status, "error": job.error})
+    try:
+        payload = await run_blocking(job_service.result, job)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    # The result was encoded once when the job finished; it is returned as stored.
+    return Response(content=payload, media_type="application/json")
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_service.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' was not found or has expired.")
+    return job.to_dict()
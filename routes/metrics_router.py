@@ -0,0 +1,13 @@
+# routes/metrics_router.py
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils.telemetry import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    # Prometheus text format. Served outside /api, where scrapers look by default.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
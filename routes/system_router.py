@@ -0,0 +1,70 @@
+# routes/system_router.py
+
+from fastapi import APIRouter, Response
+from services.connection_registry import connection_registry
+from services.schema_cache import schema_cache
+from services.analysis_service import analysis_service
+from services.llm_cache import llm_cache
+from services.llm_scheduler import llm_scheduler
+from services.result_cache import result_cache
+from services.warmup import warm_up
+from utils.models import SchemaCacheInvalidateRequest, ResultCacheInvalidateRequest
+
+router = APIRouter()
+
+
+@router.get("/connections/stats")
+async def get_connection_stats():
+    return connection_registry.stats()
+
+
+@router.get("/schema-cache/stats")
+async def get_schema_cache_stats():
+    return schema_cache.stats()
+
+
+@router.post("/schema-cache/invalidate")
+async def invalidate_schema_cache(request: SchemaCacheInvalidateRequest):
+    # Omitting database_url clears every cached schema.
+    invalidated = schema_cache.invalidate(request.database_url)
+    return {"invalidated": invalidated}
+
+
+@router.get("/analysis/stats")
+async def get_analysis_stats():
+    return analysis_service.stats()
+
+
+@router.get("/llm-cache/stats")
+async def get_llm_cache_stats():
+    return llm_cache.stats()
+
+
+@router.get("/llm-scheduler/stats")
+async def get_llm_scheduler_stats():
+    return llm_scheduler.stats()
+
+
+@router.get("/result-cache/stats")
+async def get_result_cache_stats():
+    return result_cache.stats()
+
+
+@router.post("/result-cache/invalidate")
+async def invalidate_result_cache(request: ResultCacheInvalidateRequest):
+    # Call this after writing to a database outside this service; omit database_url to clear everything.
+    invalidated = result_cache.invalidate(request.database_url)
+    return {"invalidated": invalidated}
+
+
+@router.get("/warmup/stats")
+async def get_warmup_stats():
+    return warm_up.stats()
+
+
+@router.get("/ready")
+async def get_readiness(response: Response):
+    # For readiness probes: 503 until warm-up has finished, even if some of its steps failed.
+    if not warm_up.ready:
+        response.status_code = 503
+    return {"ready": warm_up.ready, "warmup": warm_up.status}
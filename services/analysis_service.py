@@ -0,0 +1,147 @@
+# services/analysis_service.py
+
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+from services import db_service
+from services.llm_service import get_llm_service
+from prompts import prompt_templates
+from utils.models import InitialAnalysisResponse
+
+load_dotenv()
+
+# Each intent has "strong" patterns that settle the flag on their own and "weak" ones that
+# only hint at it (e.g. "email" may just be a column the user wants to see). A weak hit
+# without a strong one makes the local result ambiguous and defers to the LLM.
+_INTENT_PATTERNS = {
+    "isEmailRequired": {
+        "strong": [
+            r"\b(send|shoot|dispatch|deliver)\b.{0,40}\b(e-?mails?|mails?|newsletters?|messages?)\b",
+            r"\be-?mail\s+(all|every|each|them|these|those|the|to)\b",
+            r"\b(notify|mail\s+merge)\b",
+        ],
+        "weak": [r"\be-?mails?\b", r"\bmail\b"],
+    },
+    "isReportGenerationRequired": {
+        "strong": [
+            r"\b(generate|create|write|prepare|produce|make|build|give)\b.{0,30}\b(report|summary|analysis)\b",
+            r"\bsummari[sz]e\b",
+        ],
+        "weak": [r"\breports?\b", r"\bsummary\b", r"\binsights?\b", r"\banaly[sz](e|is)\b"],
+    },
+    "isVisualizationRequired": {
+        "strong": [
+            r"\bvisuali[sz](e|ation)\b",
+            r"\b(charts?|graphs?|plots?|histograms?|diagrams?)\b",
+            r"\b(pie|bar|line|scatter|doughnut)\s+(chart|graph|plot)\b",
+        ],
+        "weak": [r"\btrends?\b", r"\bdistribution\b", r"\bover\s+time\b"],
+    },
+}
+
+_COMPILED_PATTERNS = {
+    flag: {
+        strength: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        for strength, patterns in levels.items()
+    }
+    for flag, levels in _INTENT_PATTERNS.items()
+}
+
+
+def analyze_locally(user_prompt: str, db_url: str) -> tuple[InitialAnalysisResponse | None, float]:
+    try:
+        database_type, database_name = db_service.get_db_details(db_url)
+    except ValueError:
+        return None, 0.0
+
+    confidence = 1.0
+    flags = {}
+    for flag, levels in _COMPILED_PATTERNS.items():
+        if any(pattern.search(user_prompt) for pattern in levels["strong"]):
+            flags[flag] = True
+        elif any(pattern.search(user_prompt) for pattern in levels["weak"]):
+            flags[flag] = False
+            confidence = min(confidence, 0.5)
+        else:
+            flags[flag] = False
+
+    analysis = InitialAnalysisResponse(
+        database_type='SQL' if database_type == 'sql' else 'NoSQL',
+        database_name=database_name,
+        **flags
+    )
+    return analysis, confidence
+
+
+class AnalysisService:
+    def __init__(self):
+        # "auto" answers locally and only asks Gemini when unsure, "local" never asks, "llm" always asks.
+        self.mode = os.getenv("ANALYSIS_MODE", "auto").lower()
+        self.confidence_threshold = float(os.getenv("ANALYSIS_CONFIDENCE_THRESHOLD", 0.75))
+
+        self._lock = threading.Lock()
+        self._counters = {"local": 0, "llm_fallback": 0, "llm_forced": 0}
+        self._local_seconds_total = 0.0
+
+    def _analyze_locally(self, user_prompt: str, db_url: str) -> tuple[InitialAnalysisResponse | None, dict]:
+        if self.mode == "llm":
+            return None, {"source": "llm", "confidence": None}
+
+        started = time.perf_counter()
+        analysis, confidence = analyze_locally(user_prompt, db_url)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._local_seconds_total += elapsed
+
+        if analysis is not None and (confidence >= self.confidence_threshold or self.mode == "local"):
+            self._count("local")
+            return analysis, {"source": "local", "confidence": confidence}
+        return None, {"source": "llm", "confidence": confidence}
+
+    def analyze(self, user_prompt: str, db_url: str) -> tuple[InitialAnalysisResponse, dict]:
+        analysis, meta = self._analyze_locally(user_prompt, db_url)
+        if analysis is not None:
+            return analysis, meta
+
+        analysis = get_llm_service().get_initial_analysis(
+            prompt_templates.INITIAL_ANALYSIS_PROMPT,
+            user_prompt=user_prompt,
+            db_url=db_url
+        )
+        self._count("llm_forced" if self.mode == "llm" else "llm_fallback")
+        return analysis, meta
+
+    async def aanalyze(self, user_prompt: str, db_url: str) -> tuple[InitialAnalysisResponse, dict]:
+        analysis, meta = self._analyze_locally(user_prompt, db_url)
+        if analysis is not None:
+            return analysis, meta
+
+        analysis = await get_llm_service().aget_initial_analysis(
+            prompt_templates.INITIAL_ANALYSIS_PROMPT,
+            user_prompt=user_prompt,
+            db_url=db_url
+        )
+        self._count("llm_forced" if self.mode == "llm" else "llm_fallback")
+        return analysis, meta
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            local_seconds_total = self._local_seconds_total
+        local_attempts = counters["local"] + counters["llm_fallback"]
+        return {
+            "mode": self.mode,
+            "confidence_threshold": self.confidence_threshold,
+            **counters,
+            "fallback_rate": round(counters["llm_fallback"] / local_attempts, 3) if local_attempts else 0.0,
+            "avg_local_analysis_us": round(local_seconds_total / local_attempts * 1e6, 1) if local_attempts else 0.0,
+        }
+
+
+analysis_service = AnalysisService()
@@ -0,0 +1,152 @@
+# services/batch_service.py
+
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from services.llm_service import LLMService, get_llm_service
+from services.llm_scheduler import llm_priority, BACKGROUND
+from services.query_pipeline import QueryPipeline, STAGE_TIMEOUTS
+from services.schema_index import prune_schema_for_prompts
+from prompts import prompt_templates
+from utils.concurrency import run_blocking, with_timeout
+from utils.models import QueryRequest, BatchQueryRequest
+from utils.telemetry import get_logger, span
+
+load_dotenv()
+
+log = get_logger("batch_service")
+
+# Response keys that mean an item did not produce a result.
+_ERROR_KEYS = ('database_connection_error', 'schema_fetching_error', 'query_execution_error')
+
+
+class BatchService:
+    def __init__(self):
+        self.max_prompts = int(os.getenv("BATCH_MAX_PROMPTS", 500))
+        self.max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+        # Prompts sent to Gemini in one query-generation call; 1 generates every query separately.
+        self.generation_size = int(os.getenv("BATCH_GENERATION_SIZE", 10))
+
+    async def run(self, request: BatchQueryRequest) -> dict:
+        # Batch items queue behind interactive queries for Gemini capacity.
+        with llm_priority(BACKGROUND):
+            return await self._run(request)
+
+    async def _run(self, request: BatchQueryRequest) -> dict:
+        if not request.prompts:
+            raise ValueError("The batch contains no prompts.")
+        if len(request.prompts) > self.max_prompts:
+            raise ValueError(f"A batch may contain at most {self.max_prompts} prompts.")
+
+        started = time.perf_counter()
+        limit = asyncio.Semaphore(self.max_concurrency)
+        pipelines = [
+            QueryPipeline(QueryRequest(
+                database_url=request.database_url,
+                prompt=prompt,
+                max_rows=request.max_rows,
+                result_format=request.result_format,
+                use_cache=request.use_cache,
+            ))
+            for prompt in request.prompts
+        ]
+        errors = {}
+
+        async def bounded(index, stage):
+            async with limit:
+                try:
+                    return await stage()
+                except Exception as e:
+                    errors[index] = e
+                    return False
+
+        # Every item shares the schema cache entry and the pooled connections of the database:
+        # the first item reflects the schema, the others wait for it and hit the cache.
+        prepared = await asyncio.gather(*(bounded(i, pipeline.prepare) for i, pipeline in enumerate(pipelines)))
+        ready = [pipeline for pipeline, ok in zip(pipelines, prepared) if ok]
+
+        generation = {"llm_calls": 0, "batched_items": 0}
+        groups = {}
+        for pipeline in ready:
+            groups.setdefault((pipeline.db_type, pipeline.analysis.database_name), []).append(pipeline)
+        chunks = [
+            group[start:start + self.generation_size]
+            for group in groups.values() if self.generation_size > 1
+            for start in range(0, len(group), self.generation_size)
+        ]
+        await asyncio.gather(*(self._generate_chunk(chunk, limit, generation) for chunk in chunks if len(chunk) > 1))
+        # Items without a batched query (batching disabled, failed or mismatched) generate their own.
+        generation["individual_items"] = sum(pipeline.preset_query is None for pipeline in ready)
+        generation["llm_calls"] += generation["individual_items"]
+
+        await asyncio.gather(*(
+            bounded(i, pipeline.complete) for i, (pipeline, ok) in enumerate(zip(pipelines, prepared)) if ok
+        ))
+
+        items = [self._item(i, pipeline, errors.get(i)) for i, pipeline in enumerate(pipelines)]
+        elapsed = time.perf_counter() - started
+        succeeded = sum(item["status"] == "ok" for item in items)
+        return {
+            "items": items,
+            "summary": {
+                "items": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "elapsed_seconds": round(elapsed, 3),
+                "items_per_second": round(len(items) / elapsed, 2) if elapsed else None,
+                "generation": generation,
+                "max_concurrency": self.max_concurrency,
+            },
+        }
+
+    async def _generate_chunk(self, chunk: list[QueryPipeline], limit: asyncio.Semaphore, generation: dict):
+        # One Gemini call for several prompts. Any failure leaves the items to generate their own query.
+        first = chunk[0]
+        prompts = [pipeline.request.prompt for pipeline in chunk]
+        arguments = {"requests": "\n".join(f"{n}. {prompt}" for n, prompt in enumerate(prompts, 1))}
+        if first.db_type == 'sql':
+            template = prompt_templates.SQL_BATCH_GENERATION_PROMPT
+            arguments["dialect"] = first.analysis.database_name
+        else:
+            template = prompt_templates.NOSQL_BATCH_GENERATION_PROMPT
+        async with limit:
+            try:
+                with span("batch_generation", stage="generation", items=len(chunk)):
+                    schema = await run_blocking(prune_schema_for_prompts, first.schema_entry, prompts)
+                    generation["llm_calls"] += 1
+                    generated = await with_timeout(
+                        get_llm_service().agenerate_json_response(
+                            template, use_cache=first.request.use_cache, schema=schema, **arguments
+                        ),
+                        STAGE_TIMEOUTS["generation"], "generation"
+                    )
+            except Exception as e:
+                log.warning("Batched query generation failed; generating one by one", error=str(e), items=len(chunk))
+                return
+        queries = generated.get("queries") if isinstance(generated, dict) else None
+        if not isinstance(queries, list) or len(queries) != len(chunk):
+            log.warning("Batched query generation returned the wrong number of queries", items=len(chunk))
+            return
+        expected = str if first.db_type == 'sql' else dict
+        for pipeline, query in zip(chunk, queries):
+            if isinstance(query, expected) and query:
+                pipeline.preset_query = LLMService.clean_text(query) if expected is str else query
+                generation["batched_items"] += 1
+
+    @staticmethod
+    def _item(index: int, pipeline: QueryPipeline, error: Exception | None) -> dict:
+        item = {"index": index, "prompt": pipeline.request.prompt}
+        if error is not None:
+            item.update(status="error", error=str(error))
+            if pipeline.generated_query:
+                item["generated_query_that_failed"] = pipeline.generated_query
+            return item
+        failure = next((pipeline.response[key] for key in _ERROR_KEYS if key in pipeline.response), None)
+        item.update(status="error" if failure else "ok", response=pipeline.response)
+        if failure:
+            item["error"] = failure
+        return item
+
+
+batch_service = BatchService()
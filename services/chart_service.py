@@ -0,0 +1,343 @@
+# services/chart_service.py
+
+import math
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from services.result_profiler import prepare_frame
+
+load_dotenv()
+
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 500))
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", 20))
+CHART_HISTOGRAM_BINS = int(os.getenv("CHART_HISTOGRAM_BINS", 20))
+# Upper bound on groups returned by a database-side aggregation.
+CHART_MAX_GROUPS = int(os.getenv("CHART_MAX_GROUPS", 1000))
+
+CHART_TYPES = ("bar", "line", "pie", "doughnut", "scatter", "histogram")
+AGGREGATIONS = ("sum", "mean", "count", "min", "max", "none")
+TIME_BUCKETS = ("day", "week", "month", "quarter", "year")
+
+_PERIODS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+_LABEL_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+_PANDAS_AGGREGATES = {"sum": "sum", "mean": "mean", "min": "min", "max": "max"}
+_PALETTE = [
+    "#4e79a7", "#f28e2b", "#e15759", "#76b7b2", "#59a14f",
+    "#edc948", "#b07aa1", "#ff9da7", "#9c755f", "#bab0ac",
+]
+
+
+def describe_columns(digest: dict) -> dict:
+    # The spec prompt only needs names and kinds, not the statistics the report uses.
+    columns = {}
+    for name, info in digest.get("columns", {}).items():
+        column = {"type": info["type"], "distinct": info.get("distinct")}
+        if info["type"] in ("numeric", "datetime"):
+            column.update({"min": info.get("min"), "max": info.get("max")})
+        columns[name] = column
+    return {"row_count": digest.get("row_count"), "columns": columns}
+
+
+def _positive_int(value, default: int | None) -> int | None:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+def _auto_bucket(info: dict) -> str:
+    try:
+        span_days = (pd.Timestamp(info["max"]) - pd.Timestamp(info["min"])).days
+    except (KeyError, TypeError, ValueError):
+        return "month"
+    return "year" if span_days > 3 * 365 else "month" if span_days > 60 else "day"
+
+
+def normalize_spec(spec: dict, columns: dict) -> dict:
+    # The model only chooses; anything it gets wrong is corrected against the real columns
+    # instead of failing the visualization.
+    spec = spec if isinstance(spec, dict) else {}
+    kinds = {name: info["type"] for name, info in columns.items()}
+    numeric = [name for name, kind in kinds.items() if kind == "numeric"]
+
+    chart_type = str(spec.get("chart_type") or spec.get("type") or "bar").lower()
+    if chart_type not in CHART_TYPES:
+        chart_type = "bar"
+
+    x_field = spec.get("x_field")
+    if x_field not in kinds:
+        x_field = next(
+            (name for kind in ("datetime", "categorical", "boolean") for name, k in kinds.items() if k == kind),
+            next(iter(kinds), None)
+        )
+    y_fields = spec.get("y_fields") or []
+    if isinstance(y_fields, str):
+        y_fields = [y_fields]
+    y_fields = [field for field in y_fields if field in numeric and field != x_field][:5]
+
+    aggregation = str(spec.get("aggregation") or "").lower()
+    if aggregation not in AGGREGATIONS:
+        aggregation = "sum" if y_fields else "count"
+    if not y_fields and aggregation != "count":
+        y_fields = [field for field in numeric if field != x_field][:1]
+        if not y_fields:
+            aggregation = "count"
+
+    if chart_type == "histogram" and kinds.get(x_field) != "numeric":
+        chart_type, aggregation = "bar", "count"
+    if chart_type == "scatter":
+        if kinds.get(x_field) == "numeric" and y_fields:
+            aggregation = "none"
+        else:
+            chart_type = "line" if kinds.get(x_field) == "datetime" else "bar"
+    if aggregation == "count":
+        y_fields = []
+
+    time_bucket = None
+    if kinds.get(x_field) == "datetime" and aggregation != "none" and chart_type != "histogram":
+        time_bucket = spec.get("time_bucket")
+        if time_bucket not in TIME_BUCKETS:
+            time_bucket = _auto_bucket(columns[x_field])
+
+    return {
+        "chart_type": chart_type,
+        "x_field": x_field,
+        "y_fields": y_fields,
+        "aggregation": aggregation,
+        "time_bucket": time_bucket,
+        "bins": _positive_int(spec.get("bins"), CHART_HISTOGRAM_BINS),
+        "top_n": min(_positive_int(spec.get("top_n"), CHART_MAX_CATEGORIES), CHART_MAX_POINTS),
+        "title": str(spec.get("title") or ""),
+        "ordered": kinds.get(x_field) in ("numeric", "datetime"),
+    }
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: keeps the points that preserve the visual shape of a
+    # series. Returns the indices of the kept points.
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = anchor = 0
+    for i in range(threshold - 2):
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        next_start, next_end = end, min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[anchor] - avg_x) * (y[start:end] - y[anchor])
+            - (x[anchor] - x[start:end]) * (avg_y - y[anchor])
+        )
+        anchor = start + int(np.argmax(area))
+        kept[i + 1] = anchor
+    kept[-1] = n - 1
+    return kept
+
+
+def _value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return None if math.isnan(value) else round(value, 4)
+    return value
+
+
+def _axis_values(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("int64").to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    # Buckets returned by the database arrive as text; they are already sorted and evenly spaced.
+    return np.arange(len(series), dtype=float)
+
+
+def _format_labels(values: pd.Series, time_bucket: str | None) -> list:
+    if time_bucket or pd.api.types.is_datetime64_any_dtype(values):
+        try:
+            stamps = [pd.Timestamp(value) for value in values]
+        except (TypeError, ValueError):
+            return [str(value) for value in values]
+        label_format = _LABEL_FORMATS.get(time_bucket, "%Y-%m-%d %H:%M")
+        return [
+            "(null)" if pd.isna(stamp)
+            else f"{stamp.year}-Q{stamp.quarter}" if time_bucket == "quarter"
+            else stamp.strftime(label_format)
+            for stamp in stamps
+        ]
+    return ["(null)" if pd.isna(value) else str(_value(value)) for value in values]
+
+
+def _numeric(frame: pd.DataFrame, fields: list[str]) -> pd.DataFrame:
+    for field in fields:
+        frame[field] = pd.to_numeric(frame[field], errors="coerce")
+    return frame
+
+
+def _measures(spec: dict) -> list[str]:
+    return spec["y_fields"] or ["count"]
+
+
+def aggregate_frame(frame: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    # Same shape as the database-side aggregation: {x_field, *measures, "_rows"}.
+    x_field = spec["x_field"]
+    keys = frame[x_field]
+    if spec["time_bucket"]:
+        keys = pd.to_datetime(keys, errors="coerce")
+        if keys.dt.tz is not None:
+            keys = keys.dt.tz_localize(None)
+        keys = keys.dt.to_period(_PERIODS[spec["time_bucket"]]).dt.start_time
+    frame = _numeric(frame.assign(_key=keys), spec["y_fields"])
+    # Unbucketed keys keep their null group; rows whose date could not be parsed are dropped.
+    grouped = frame.groupby("_key", dropna=spec["time_bucket"] is not None, sort=False)
+    if spec["aggregation"] == "count":
+        table = grouped.size().rename("count").to_frame()
+    else:
+        table = grouped[spec["y_fields"]].agg(_PANDAS_AGGREGATES[spec["aggregation"]])
+    table["_rows"] = grouped.size()
+    table = table.reset_index().rename(columns={"_key": x_field})
+    if spec["time_bucket"]:
+        return table.sort_values(x_field)
+    return table.sort_values(_measures(spec)[0], ascending=False)
+
+
+def _top_n(table: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    # Keeps the largest groups and folds the rest into one "Other" group that is aggregated the
+    # same way, so pie slices still add up to the whole.
+    top_n = spec["top_n"]
+    if len(table) <= top_n:
+        return table
+    head, rest = table.iloc[:top_n], table.iloc[top_n:]
+    other = {spec["x_field"]: "Other", "_rows": rest["_rows"].sum()}
+    for field in _measures(spec):
+        if spec["aggregation"] == "mean":
+            weights = rest["_rows"].where(rest[field].notna(), 0)
+            other[field] = (rest[field].fillna(0) * weights).sum() / weights.sum() if weights.sum() else None
+        elif spec["aggregation"] in ("min", "max"):
+            other[field] = getattr(rest[field], spec["aggregation"])()
+        else:
+            other[field] = rest[field].sum()
+    return pd.concat([head, pd.DataFrame([other])], ignore_index=True)
+
+
+def _series(table: pd.DataFrame, spec: dict, fields: list[str]) -> tuple[list, list[dict]]:
+    x_field = spec["x_field"]
+    if spec["ordered"] and len(table) > CHART_MAX_POINTS:
+        # Downsample on the first measure; every dataset keeps the same points so they line up.
+        table = table.dropna(subset=[x_field])
+        kept = lttb(_axis_values(table[x_field]), table[fields[0]].fillna(0).to_numpy(dtype=float), CHART_MAX_POINTS)
+        table = table.iloc[kept]
+    elif not spec["ordered"] and len(table) > CHART_MAX_POINTS:
+        table = table.head(CHART_MAX_POINTS)
+    labels = _format_labels(table[x_field], spec["time_bucket"])
+    datasets = [{"label": field, "data": [_value(value) for value in table[field]]} for field in fields]
+    return labels, datasets
+
+
+def _histogram(frame: pd.DataFrame, spec: dict) -> tuple[list, list[dict]]:
+    values = pd.to_numeric(frame[spec["x_field"]], errors="coerce").dropna().to_numpy(dtype=float)
+    if not len(values):
+        return [], [{"label": "count", "data": []}]
+    counts, edges = np.histogram(values, bins=min(spec["bins"], max(1, len(np.unique(values)))))
+    labels = [f"{_value(float(low))} – {_value(float(high))}" for low, high in zip(edges[:-1], edges[1:])]
+    return labels, [{"label": "count", "data": counts.tolist()}]
+
+
+def _scatter(frame: pd.DataFrame, spec: dict) -> list[dict]:
+    frame = _numeric(frame.copy(), [spec["x_field"], *spec["y_fields"]])
+    frame = frame.dropna(subset=[spec["x_field"]])
+    if len(frame) > CHART_MAX_POINTS:
+        frame = frame.iloc[np.unique(np.linspace(0, len(frame) - 1, CHART_MAX_POINTS).astype(int))]
+    return [
+        {
+            "label": field,
+            "data": [
+                {"x": _value(x), "y": _value(y)}
+                for x, y in zip(frame[spec["x_field"]], frame[field]) if not pd.isna(y)
+            ],
+        }
+        for field in spec["y_fields"]
+    ]
+
+
+def _chart_config(spec: dict, labels: list, datasets: list[dict]) -> dict:
+    chart_type = "bar" if spec["chart_type"] == "histogram" else spec["chart_type"]
+    radial = chart_type in ("pie", "doughnut")
+    for i, dataset in enumerate(datasets):
+        color = _PALETTE[i % len(_PALETTE)]
+        if radial:
+            dataset["backgroundColor"] = [_PALETTE[j % len(_PALETTE)] for j in range(len(labels))]
+        else:
+            dataset["backgroundColor"] = color
+            dataset["borderColor"] = color
+        if chart_type == "line" and len(labels) > 100:
+            dataset["pointRadius"] = 0
+        if spec["chart_type"] == "histogram":
+            dataset.update({"barPercentage": 1.0, "categoryPercentage": 1.0})
+
+    options = {
+        "responsive": True,
+        "plugins": {
+            "title": {"display": bool(spec["title"]), "text": spec["title"]},
+            "legend": {"display": radial or len(datasets) > 1},
+        },
+    }
+    if not radial:
+        y_title = ", ".join(_measures(spec))
+        if spec["y_fields"] and spec["aggregation"] != "none":
+            y_title = f"{spec['aggregation']} of {y_title}"
+        options["scales"] = {
+            "x": {"type": "linear" if chart_type == "scatter" else "category",
+                  "title": {"display": True, "text": spec["x_field"]}},
+            "y": {"beginAtZero": True, "title": {"display": True, "text": y_title}},
+        }
+    config = {"type": chart_type, "data": {"datasets": datasets}, "options": options}
+    if chart_type != "scatter":
+        config["data"]["labels"] = labels
+    return config
+
+
+def build_chart(spec: dict, rows: list[dict], columns: dict, aggregate=None) -> tuple[dict, dict]:
+    # `aggregate(x_field, y_fields, aggregation, time_bucket, limit)` groups the full result in
+    # the database. It is only passed when `rows` is an incomplete prefix of the result.
+    spec = normalize_spec(spec, columns)
+    if spec["x_field"] is None:
+        raise ValueError("The query result has no columns to chart.")
+    metadata = {"spec": {key: value for key, value in spec.items() if key != "ordered"}, "source": "result"}
+    frame = prepare_frame(rows)
+
+    if spec["chart_type"] == "histogram":
+        labels, datasets = _histogram(frame, spec)
+    elif spec["chart_type"] == "scatter":
+        labels, datasets = [], _scatter(frame, spec)
+    elif spec["aggregation"] == "none":
+        table = _numeric(frame.copy(), spec["y_fields"])
+        if spec["ordered"]:
+            table = table.sort_values(spec["x_field"])
+        labels, datasets = _series(table, spec, spec["y_fields"])
+    else:
+        table = None
+        if aggregate is not None:
+            try:
+                grouped = aggregate(spec["x_field"], spec["y_fields"], spec["aggregation"],
+                                    spec["time_bucket"], CHART_MAX_GROUPS)
+                table = pd.DataFrame.from_records(grouped, columns=[spec["x_field"], *_measures(spec), "_rows"])
+                metadata["source"] = "database"
+                metadata["groups_truncated"] = len(grouped) >= CHART_MAX_GROUPS
+            except (NotImplementedError, RuntimeError) as e:
+                # Fall back to the rows at hand rather than losing the chart.
+                metadata["pushdown_error"] = str(e)
+        if table is None:
+            table = aggregate_frame(frame, spec)
+        if not spec["ordered"]:
+            table = _top_n(table, spec)
+        elif not spec["time_bucket"]:
+            table = table.sort_values(spec["x_field"])
+        labels, datasets = _series(table, spec, _measures(spec))
+
+    metadata["points"] = max((len(dataset["data"]) for dataset in datasets), default=0)
+    return _chart_config(spec, labels, datasets), metadata
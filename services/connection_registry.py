@@ -0,0 +1,224 @@
+# services/connection_registry.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from pymongo import MongoClient
+from utils.telemetry import get_logger
+
+load_dotenv()
+
+log = get_logger("connection_registry")
+
+
+def normalize_db_url(db_url: str) -> str:
+    parsed = urlparse(db_url.strip())
+    # Scheme and host are case-insensitive; credentials, path and query values are not.
+    netloc = parsed.netloc
+    if '@' in netloc:
+        credentials, hosts = netloc.rsplit('@', 1)
+        netloc = f"{credentials}@{hosts.lower()}"
+    else:
+        netloc = netloc.lower()
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    path = parsed.path.rstrip('/') if parsed.path != '/' else parsed.path
+    normalized = f"{parsed.scheme.lower()}://{netloc}{path}"
+    return f"{normalized}?{query}" if query else normalized
+
+
+def redact_db_url(db_url: str) -> str:
+    parsed = urlparse(db_url)
+    if parsed.password:
+        netloc = parsed.netloc.replace(f":{parsed.password}@", ":***@", 1)
+        return urlunparse(parsed._replace(netloc=netloc))
+    return db_url
+
+
+class _PoolEntry:
+    def __init__(self, key: str, kind: str, resource):
+        self.key = key
+        self.kind = kind
+        self.resource = resource
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.last_ping = self.created_at
+        self.checkouts = 0
+        # Leases not yet released. An evicted entry is closed when the last one ends.
+        self.in_use = 0
+        self.evicted = False
+
+
+class ConnectionRegistry:
+    def __init__(self):
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", 5))
+        self.max_overflow = int(os.getenv("DB_POOL_MAX_OVERFLOW", 10))
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+        self.idle_timeout = int(os.getenv("DB_POOL_IDLE_TIMEOUT_SECONDS", 600))
+        self.max_urls = int(os.getenv("DB_POOL_MAX_URLS", 16))
+        self.mongo_ping_interval = int(os.getenv("MONGO_PING_INTERVAL_SECONDS", 30))
+
+        self._entries: OrderedDict[str, _PoolEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    # The engine or client is only guaranteed to stay open while the lease is held: a pool that
+    # is evicted meanwhile is closed when its last lease ends, never under a running query.
+    @contextmanager
+    def lease_engine(self, db_url: str):
+        entry = self._checkout(db_url, 'sql')
+        try:
+            yield entry.resource
+        finally:
+            self._release(entry)
+
+    @contextmanager
+    def lease_mongo_client(self, db_url: str):
+        entry = self._checkout(db_url, 'nosql')
+        try:
+            now = time.time()
+            # pymongo has no pool_pre_ping equivalent, so ping clients that have sat idle for a while.
+            if now - entry.last_ping > self.mongo_ping_interval:
+                try:
+                    entry.resource.admin.command('ping')
+                    entry.last_ping = now
+                except Exception:
+                    self._discard(entry)
+                    self._release(entry)
+                    entry = None
+                    entry = self._checkout(db_url, 'nosql')
+            yield entry.resource
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def _checkout(self, db_url: str, kind: str) -> _PoolEntry:
+        key = normalize_db_url(db_url)
+        stale = []
+        with self._lock:
+            stale.extend(self._pop_idle_locked())
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry(key, kind, self._create_resource(db_url, kind))
+                self._entries[key] = entry
+                while len(self._entries) > self.max_urls:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._evictions += 1
+                    if self._retire_locked(evicted):
+                        stale.append(evicted)
+            else:
+                self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.checkouts += 1
+            entry.in_use += 1
+        for evicted in stale:
+            self._close(evicted)
+        return entry
+
+    def _release(self, entry: _PoolEntry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.time()
+            close = entry.evicted and entry.in_use == 0
+        if close:
+            self._close(entry)
+
+    @staticmethod
+    def _retire_locked(entry: _PoolEntry) -> bool:
+        # Marks a removed entry for closing; True when nobody holds it and it can close right away.
+        entry.evicted = True
+        return entry.in_use == 0
+
+    def _discard(self, entry: _PoolEntry):
+        with self._lock:
+            if self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+            close = not entry.evicted and self._retire_locked(entry)
+        if close:
+            self._close(entry)
+
+    def _create_resource(self, db_url: str, kind: str):
+        if kind == 'sql':
+            return create_engine(
+                db_url,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_recycle=self.pool_recycle,
+                pool_pre_ping=True,
+            )
+        return MongoClient(
+            db_url,
+            maxPoolSize=self.pool_size + self.max_overflow,
+            maxIdleTimeMS=self.idle_timeout * 1000,
+        )
+
+    def _pop_idle_locked(self) -> list[_PoolEntry]:
+        # Returns the idle entries that can be closed now; a pool with an open lease is not idle.
+        cutoff = time.time() - self.idle_timeout
+        idle_keys = [key for key, entry in self._entries.items() if entry.in_use == 0 and entry.last_used < cutoff]
+        self._evictions += len(idle_keys)
+        return [entry for entry in (self._entries.pop(key) for key in idle_keys) if self._retire_locked(entry)]
+
+    @staticmethod
+    def _close(entry: _PoolEntry):
+        try:
+            if entry.kind == 'sql':
+                entry.resource.dispose()
+            else:
+                entry.resource.close()
+        except Exception as e:
+            log.warning("Failed to close pooled connection", error=str(e))
+
+    def dispose(self, db_url: str):
+        with self._lock:
+            entry = self._entries.pop(normalize_db_url(db_url), None)
+            close = entry is not None and self._retire_locked(entry)
+        if close:
+            self._close(entry)
+
+    def dispose_all(self):
+        # Shutdown: every pool is closed, leased or not.
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = list(self._entries.items())
+            evictions = self._evictions
+        pools = []
+        for key, entry in items:
+            info = {
+                "database_url": redact_db_url(key),
+                "kind": entry.kind,
+                "checkouts": entry.checkouts,
+                "in_use": entry.in_use,
+                "age_seconds": round(time.time() - entry.created_at, 1),
+                "idle_seconds": round(time.time() - entry.last_used, 1),
+            }
+            if entry.kind == 'sql' and hasattr(entry.resource.pool, 'checkedout'):
+                pool = entry.resource.pool
+                info.update({
+                    "pool_size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "checked_in": pool.checkedin(),
+                    "overflow": pool.overflow(),
+                })
+            elif entry.kind == 'nosql':
+                info["max_pool_size"] = entry.resource.options.pool_options.max_pool_size
+            pools.append(info)
+        return {
+            "max_urls": self.max_urls,
+            "idle_timeout_seconds": self.idle_timeout,
+            "evictions": evictions,
+            "pools": pools,
+        }
+
+
+connection_registry = ConnectionRegistry()
@@ -1,10 +1,40 @@
 # services/db_service.py
 
-from sqlalchemy import create_engine, inspect, text
-from pymongo import MongoClient
+from sqlalchemy import inspect, text
 from urllib.parse import urlparse
+from bson import json_util
+from contextlib import ExitStack, contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from services.connection_registry import connection_registry
+from utils.serialization import RowConverter, convert_sql_rows, serialize_document
+from utils.telemetry import get_logger
+import hashlib
 import json
-import datetime  # Import the datetime module
+import os
+import re
+import threading
+import time
+import uuid
+
+load_dotenv()
+
+log = get_logger("db_service")
+
+# Upper bound on rows returned by one query or page; the limit is pushed into the query itself.
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", 1000))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", 1000))
+
+_ROW_RETURNING_RE = re.compile(r"^(select|with)\b", re.IGNORECASE)
+_LEADING_COMMENTS_RE = re.compile(r"^(\s*(--[^\n]*\n|/\*.*?\*/))*\s*", re.DOTALL)
+_QUOTED_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`")
+_ORDER_BY_RE = re.compile(r"\border\s+by\b", re.IGNORECASE)
+# Anything that can change data or take locks, including SELECT ... INTO and data-modifying CTEs.
+_WRITE_KEYWORDS_RE = re.compile(
+    r"\b(insert|update|delete|merge|upsert|replace|create|drop|alter|truncate|grant|revoke|call|copy|lock|"
+    r"vacuum|refresh|into|nextval|setval|for\s+share)\b",
+    re.IGNORECASE
+)
 
 
 def get_db_details(db_url: str):
@@ -16,80 +46,994 @@ def get_db_details(db_url: str):
         return 'sql', 'mysql'
     elif 'mongodb' in scheme:
         return 'nosql', 'mongodb'
+    elif 'sqlite' in scheme:
+        return 'sql', 'sqlite'
     raise ValueError(f"Unsupported database scheme: {scheme}")
 
 
-def get_sql_schema(db_url: str) -> str:
+_PG_COLUMNS_QUERY = """
+SELECT c.table_name, c.column_name, c.data_type,
+       col_description(pc.oid, c.ordinal_position), obj_description(pc.oid, 'pg_class')
+FROM information_schema.columns c
+JOIN information_schema.tables t ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+JOIN pg_catalog.pg_namespace pn ON pn.nspname = c.table_schema
+JOIN pg_catalog.pg_class pc ON pc.relnamespace = pn.oid AND pc.relname = c.table_name
+WHERE c.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+_PG_FOREIGN_KEYS_QUERY = """
+SELECT kcu.table_name, kcu.column_name, ccu.table_name, ccu.column_name
+FROM information_schema.table_constraints tc
+JOIN information_schema.key_column_usage kcu
+  ON kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema
+JOIN information_schema.constraint_column_usage ccu
+  ON ccu.constraint_name = tc.constraint_name AND ccu.table_schema = tc.table_schema
+WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = current_schema()
+"""
+
+_PG_FINGERPRINT_QUERY = """
+SELECT md5(string_agg(table_name || '.' || column_name || ':' || data_type, ',' ORDER BY table_name, ordinal_position))
+FROM information_schema.columns
+WHERE table_schema = current_schema()
+"""
+
+_MYSQL_COLUMNS_QUERY = """
+SELECT c.table_name, c.column_name, c.column_type, c.column_comment, t.table_comment
+FROM information_schema.columns c
+JOIN information_schema.tables t ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE c.table_schema = DATABASE() AND t.table_type = 'BASE TABLE'
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+_MYSQL_FOREIGN_KEYS_QUERY = """
+SELECT table_name, column_name, referenced_table_name, referenced_column_name
+FROM information_schema.key_column_usage
+WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL
+"""
+
+_MYSQL_FINGERPRINT_QUERY = """
+SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS('.', table_name, column_name, column_type))), 0)
+FROM information_schema.columns
+WHERE table_schema = DATABASE()
+"""
+
+
+def _tables_from_catalog_rows(column_rows, foreign_key_rows) -> list[dict]:
+    tables = {}
+    for table_name, column_name, column_type, column_comment, table_comment in column_rows:
+        table = tables.setdefault(table_name, {
+            "name": table_name,
+            "comment": table_comment or None,
+            "columns": [],
+            "foreign_keys": [],
+        })
+        table["columns"].append({"name": column_name, "type": str(column_type), "comment": column_comment or None})
+    for table_name, column_name, referred_table, referred_column in foreign_key_rows:
+        if table_name in tables:
+            tables[table_name]["foreign_keys"].append({
+                "columns": [column_name],
+                "referred_table": referred_table,
+                "referred_columns": [referred_column],
+            })
+    return list(tables.values())
+
+
+def _tables_from_inspector(engine) -> list[dict]:
+    # Generic path for dialects without a hand-written catalog query; the multi-table
+    # reflection API still avoids one round-trip per table.
+    inspector = inspect(engine)
+    columns_by_table = inspector.get_multi_columns()
+    foreign_keys_by_table = inspector.get_multi_foreign_keys()
+    try:
+        comments_by_table = inspector.get_multi_table_comment()
+    except NotImplementedError:
+        comments_by_table = {}
+    tables = []
+    for (_, table_name), columns in sorted(columns_by_table.items(), key=lambda item: item[0][1]):
+        tables.append({
+            "name": table_name,
+            "comment": (comments_by_table.get((None, table_name)) or {}).get('text'),
+            "columns": [
+                {"name": col['name'], "type": str(col['type']), "comment": col.get('comment')}
+                for col in columns
+            ],
+            "foreign_keys": [
+                {
+                    "columns": fk['constrained_columns'],
+                    "referred_table": fk['referred_table'],
+                    "referred_columns": fk['referred_columns'],
+                }
+                for fk in foreign_keys_by_table.get((None, table_name), [])
+            ],
+        })
+    return tables
+
+
+def reflect_sql_schema(db_url: str) -> list[dict]:
     try:
-        engine = create_engine(db_url)
-        inspector = inspect(engine)
-        schema_info = []
-        for table_name in inspector.get_table_names():
-            columns = inspector.get_columns(table_name)
-            column_details = [f"{col['name']} ({col['type']})" for col in columns]
-            schema_info.append(f"Table: {table_name}\nColumns: {', '.join(column_details)}")
-        return "\n\n".join(schema_info)
+        with connection_registry.lease_engine(db_url) as engine:
+            dialect = engine.dialect.name
+            if dialect == 'postgresql':
+                queries = (_PG_COLUMNS_QUERY, _PG_FOREIGN_KEYS_QUERY)
+            elif dialect == 'mysql':
+                queries = (_MYSQL_COLUMNS_QUERY, _MYSQL_FOREIGN_KEYS_QUERY)
+            else:
+                return _tables_from_inspector(engine)
+            with engine.connect() as connection:
+                column_rows = connection.execute(text(queries[0])).all()
+                foreign_key_rows = connection.execute(text(queries[1])).all()
+        return _tables_from_catalog_rows(column_rows, foreign_key_rows)
     except Exception as e:
         raise ConnectionError(f"Failed to connect to SQL database or inspect schema: {e}")
 
 
-def get_nosql_schema(db_url: str) -> str:
+def get_sql_schema_fingerprint(db_url: str) -> str | None:
     try:
-        client = MongoClient(db_url)
-        db_name = urlparse(db_url).path.lstrip('/')
-        db = client[db_name]
-        schema_info = []
-        for collection_name in db.list_collection_names():
-            collection = db[collection_name]
-            first_doc = collection.find_one()
-            if first_doc:
-                first_doc.pop('_id', None)
-                schema_info.append(
-                    f"Collection: {collection_name}\nSample Document: {json.dumps(first_doc, indent=2, default=str)}")
-        client.close()
-        return "\n\n".join(schema_info)
+        with connection_registry.lease_engine(db_url) as engine:
+            dialect = engine.dialect.name
+            if dialect == 'postgresql':
+                query = _PG_FINGERPRINT_QUERY
+            elif dialect == 'mysql':
+                query = _MYSQL_FINGERPRINT_QUERY
+            else:
+                return None
+            with engine.connect() as connection:
+                row = connection.execute(text(query)).one()
+        return ":".join(str(value) for value in row)
+    except Exception as e:
+        raise ConnectionError(f"Failed to connect to SQL database or inspect schema: {e}")
+
+
+def format_sql_schema(tables: list[dict]) -> str:
+    schema_info = []
+    for table in tables:
+        column_details = [f"{col['name']} ({col['type']})" for col in table['columns']]
+        lines = [f"Table: {table['name']}"]
+        if table.get('comment'):
+            lines.append(f"Description: {table['comment']}")
+        lines.append(f"Columns: {', '.join(column_details)}")
+        if table.get('foreign_keys'):
+            references = [
+                f"{', '.join(fk['columns'])} -> {fk['referred_table']}({', '.join(fk['referred_columns'])})"
+                for fk in table['foreign_keys']
+            ]
+            lines.append(f"Foreign Keys: {'; '.join(references)}")
+        schema_info.append("\n".join(lines))
+    return "\n\n".join(schema_info)
+
+
+def get_sql_schema(db_url: str) -> str:
+    return format_sql_schema(reflect_sql_schema(db_url))
+
+
+@contextmanager
+def _mongo_database(db_url: str):
+    with connection_registry.lease_mongo_client(db_url) as client:
+        yield client[urlparse(db_url).path.lstrip('/')]
+
+
+# Collections are described from a random sample rather than their first document, so fields
+# that only some documents carry still reach the prompt.
+MONGO_SCHEMA_SAMPLE_SIZE = int(os.getenv("MONGO_SCHEMA_SAMPLE_SIZE", 100))
+MONGO_SCHEMA_MAX_FIELDS = int(os.getenv("MONGO_SCHEMA_MAX_FIELDS", 60))
+MONGO_SCHEMA_WORKERS = int(os.getenv("MONGO_SCHEMA_WORKERS", 8))
+MONGO_SCHEMA_TIME_BUDGET_SECONDS = float(os.getenv("MONGO_SCHEMA_TIME_BUDGET_SECONDS", 10))
+_MONGO_SCHEMA_MAX_DEPTH = 4
+
+_BSON_TYPE_NAMES = {
+    "str": "string", "int": "int", "Int64": "long", "float": "double", "bool": "bool", "datetime": "date",
+    "ObjectId": "objectId", "dict": "object", "SON": "object", "list": "array", "NoneType": "null",
+    "Decimal128": "decimal", "bytes": "binData", "Binary": "binData", "UUID": "uuid", "Regex": "regex",
+}
+
+
+def _bson_type(value) -> str:
+    name = type(value).__name__
+    return _BSON_TYPE_NAMES.get(name, name)
+
+
+def _collect_paths(document: dict, fields: dict, seen: set, prefix: str = "", depth: int = 0):
+    for key, value in document.items():
+        path = f"{prefix}{key}"
+        field = fields.setdefault(path, {"types": {}, "documents": 0, "example": None})
+        if path not in seen:
+            seen.add(path)
+            field["documents"] += 1
+        type_name = _bson_type(value)
+        if type_name == "array" and value:
+            type_name = f"array<{_bson_type(value[0])}>"
+        field["types"][type_name] = field["types"].get(type_name, 0) + 1
+        if field["example"] is None and value is not None and not isinstance(value, (dict, list)):
+            example = serialize_document(value)
+            field["example"] = example[:40] if isinstance(example, str) else example
+        if depth + 1 < _MONGO_SCHEMA_MAX_DEPTH:
+            # Dotted paths reach into sub-documents and into documents inside arrays alike.
+            nested = [value] if isinstance(value, dict) else [item for item in value if isinstance(item, dict)] \
+                if isinstance(value, list) else []
+            for item in nested:
+                _collect_paths(item, fields, seen, f"{path}.", depth + 1)
+
+
+def _infer_collection(db, collection_name: str, sample_size: int, deadline: float) -> dict | None:
+    collection = db[collection_name]
+    document_count = collection.estimated_document_count()
+    if not document_count:
+        return None
+    max_time_ms = max(1, int((deadline - time.monotonic()) * 1000))
+    documents = list(collection.aggregate([{"$sample": {"size": sample_size}}], maxTimeMS=max_time_ms))
+    fields = {}
+    for document in documents:
+        _collect_paths(document, fields, set())
+    sampled = len(documents) or 1
+    columns = [
+        {
+            "name": path,
+            "type": "|".join(sorted(field["types"], key=field["types"].get, reverse=True)),
+            "types": {name: round(count / sampled, 2) for name, count in field["types"].items()},
+            "frequency": round(field["documents"] / sampled, 2),
+            "example": field["example"],
+        }
+        for path, field in fields.items()
+    ]
+    if len(columns) > MONGO_SCHEMA_MAX_FIELDS:
+        keep = {column["name"] for column in sorted(columns, key=lambda c: -c["frequency"])[:MONGO_SCHEMA_MAX_FIELDS]}
+        columns = [column for column in columns if column["name"] in keep]
+    indexes = [
+        {"keys": [key for key, _ in index["key"]], "unique": bool(index.get("unique"))}
+        for index in collection.index_information().values()
+    ]
+    return {
+        "name": collection_name,
+        "document_count": document_count,
+        "sampled": len(documents),
+        "columns": columns,
+        "indexes": indexes,
+    }
+
+
+def reflect_nosql_schema(db_url: str, sample_size: int = MONGO_SCHEMA_SAMPLE_SIZE,
+                         time_budget: float = MONGO_SCHEMA_TIME_BUDGET_SECONDS) -> list[dict]:
+    # The lease keeps the client open until sampling is over.
+    with ExitStack() as lease:
+        try:
+            db = lease.enter_context(_mongo_database(db_url))
+            names = sorted(db.list_collection_names())
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to NoSQL database or inspect schema: {e}")
+        if not names:
+            return []
+
+        # Collections are sampled concurrently; whatever is not done when the budget runs out is
+        # listed by name only instead of holding up the request.
+        deadline = time.monotonic() + time_budget
+        executor = ThreadPoolExecutor(max_workers=min(MONGO_SCHEMA_WORKERS, len(names)), thread_name_prefix="mongo-schema")
+        try:
+            futures = {executor.submit(_infer_collection, db, name, sample_size, deadline): name for name in names}
+            done, _ = wait(futures, timeout=time_budget)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        collections, errors = [], []
+        for future, name in futures.items():
+            if future not in done:
+                collections.append({"name": name, "columns": [], "indexes": [], "inferred": False})
+                continue
+            try:
+                collection = future.result()
+            except Exception as e:
+                errors.append(e)
+                collections.append({"name": name, "columns": [], "indexes": [], "inferred": False})
+                continue
+            if collection is not None:
+                collections.append(collection)
+        if errors and len(errors) == len(names):
+            raise ConnectionError(f"Failed to connect to NoSQL database or inspect schema: {errors[0]}")
+        return sorted(collections, key=lambda collection: collection["name"])
+
+
+def get_nosql_schema_fingerprint(db_url: str) -> str:
+    # Collections, their indexes and the order of magnitude of their size: documents being
+    # inserted do not force a new sample, a new collection or index does.
+    try:
+        parts = []
+        with _mongo_database(db_url) as db:
+            for name in sorted(db.list_collection_names()):
+                collection = db[name]
+                indexes = sorted(str(index["key"]) for index in collection.index_information().values())
+                parts.append(f"{name}:{int(collection.estimated_document_count()).bit_length()}:{indexes}")
+        return hashlib.md5(",".join(parts).encode()).hexdigest()
     except Exception as e:
         raise ConnectionError(f"Failed to connect to NoSQL database or inspect schema: {e}")
 
 
-def execute_sql_query(db_url: str, query: str) -> list[dict]:
+def _format_field(column: dict) -> str:
+    types = sorted(column["types"].items(), key=lambda item: -item[1])
+    if len(types) == 1 and column["frequency"] == 1:
+        description = types[0][0]
+    else:
+        description = ", ".join(f"{name} {share:.0%}" for name, share in types)
+    example = f" e.g. {json.dumps(column['example'], default=str)}" if column["example"] is not None else ""
+    return f"  - {column['name']}: {description}{example}"
+
+
+def format_nosql_schema(collections: list[dict]) -> str:
+    blocks = []
+    for collection in collections:
+        if not collection.get("inferred", True):
+            blocks.append(f"Collection: {collection['name']} (fields not inspected)")
+            continue
+        lines = [f"Collection: {collection['name']} (~{collection['document_count']} documents, "
+                 f"{collection['sampled']} sampled)"]
+        indexes = [
+            "+".join(index["keys"]) + (" (unique)" if index["unique"] else "")
+            for index in collection["indexes"]
+        ]
+        if indexes:
+            lines.append(f"Indexes: {', '.join(indexes)}")
+        lines.append("Fields (type and share of sampled documents):")
+        lines.extend(_format_field(column) for column in collection["columns"])
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def get_nosql_schema(db_url: str) -> str:
+    return format_nosql_schema(reflect_nosql_schema(db_url))
+
+
+def _clean_statement(query: str) -> str:
+    return _LEADING_COMMENTS_RE.sub("", query).strip().rstrip(";").strip()
+
+
+def is_read_only_sql(query: str) -> bool:
+    statement = _clean_statement(query)
+    return bool(_ROW_RETURNING_RE.match(statement)) and not _WRITE_KEYWORDS_RE.search(_QUOTED_RE.sub("''", statement))
+
+
+def _top_level(statement: str) -> str:
+    # The statement with literals and quoted identifiers reduced to x's and everything nested in
+    # parentheses blanked. The length is kept, so match positions index the original statement.
+    masked = _QUOTED_RE.sub(lambda m: m.group()[0] + "x" * (len(m.group()) - 2) + m.group()[-1], statement)
+    depth = 0
+    top_level = []
+    for char in masked:
+        if char == ')':
+            depth -= 1
+        top_level.append(char if depth <= 0 or char in "()" else " ")
+        if char == '(':
+            depth += 1
+    return "".join(top_level)
+
+
+def _has_top_level_order_by(statement: str) -> bool:
+    return bool(_ORDER_BY_RE.search(_top_level(statement)))
+
+
+_SINGLE_TABLE_RE = re.compile(
+    r"^select\s+(?P<columns>.+?)\s+from\s+(?P<table>[^\s,()]+)"
+    r"(?:\s+(?:as\s+)?(?!(?:where|join|inner|left|right|full|cross|natural|group|order|limit|offset|fetch|union|"
+    r"intersect|except|having|window|for)\b)\w+)?\s*(?:\bwhere\b(?P<where>.*))?$",
+    re.IGNORECASE | re.DOTALL
+)
+_KEYSET_BLOCKERS_RE = re.compile(
+    r"\b(distinct|group\s+by|having|order\s+by|limit|offset|fetch|union|intersect|except|window|for)\b", re.IGNORECASE
+)
+_LIMIT_BLOCKERS_RE = re.compile(r"\b(limit|offset|fetch|for)\b", re.IGNORECASE)
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.strip().strip('"`[]')
+
+
+def _select_item_name(item: str) -> str | None:
+    # Output name of one select-list item: its alias, or the column of a (qualified) column reference.
+    match = re.search(r"(?:\bas\s+|\s)([\w$]+|\"[^\"]+\"|`[^`]+`)$", item, re.IGNORECASE)
+    if match:
+        return _unquote(match.group(1)).lower()
+    return _unquote(item.rsplit(".", 1)[-1]).lower()
+
+
+def _keyset_plan(connection, statement: str) -> dict | None:
+    # Keyset paging is only correct on a key that is unique and never NULL, so it is used for a
+    # plain SELECT from one table whose single-column primary key is returned exactly once. Joins,
+    # grouping and set operations can repeat a key and page by offset instead.
+    top_level = _top_level(statement)
+    match = _SINGLE_TABLE_RE.match(top_level)
+    if not match or _KEYSET_BLOCKERS_RE.search(match.group("columns") + " " + (match.group("where") or "")):
+        return None
+    table = [_unquote(part) for part in statement[match.start("table"):match.end("table")].split(".")]
+    schema, table_name = (table[0], table[1]) if len(table) == 2 else (None, table[-1])
     try:
-        engine = create_engine(db_url)
-        with engine.connect() as connection:
-            result_proxy = connection.execute(text(query))
-
-            results = []
-            for row in result_proxy:
-                row_dict = dict(row._mapping)
-                for key, value in row_dict.items():
-                    # Handle datetime objects
-                    if isinstance(value, (datetime.datetime, datetime.date)):
-                        row_dict[key] = value.isoformat()
-                    # --- THE FIX IS HERE ---
-                    # Handle bytes objects
-                    elif isinstance(value, bytes):
-                        try:
-                            # Try to decode bytes into a UTF-8 string
-                            row_dict[key] = value.decode('utf-8')
-                        except UnicodeDecodeError:
-                            # If it's not text (e.g., an image), use a safe placeholder
-                            row_dict[key] = '<Binary Data>'
-                    # --- END OF FIX ---
-                results.append(row_dict)
-
-            return results
+        inspector = inspect(connection)
+        key_columns = inspector.get_pk_constraint(table_name, schema=schema)["constrained_columns"]
+        if len(key_columns) != 1:
+            return None
+        key = key_columns[0]
+        column = next(column for column in inspector.get_columns(table_name, schema=schema) if column["name"] == key)
+    except Exception:
+        return None
+    # SQLite lets a primary key other than INTEGER PRIMARY KEY hold NULLs.
+    if connection.dialect.name == 'sqlite' and column["nullable"] and str(column["type"]).upper() != "INTEGER":
+        return None
+
+    columns_start = match.start("columns")
+    items, start = [], columns_start
+    for index in [i for i, char in enumerate(top_level[:match.end("columns")]) if char == ","] + [match.end("columns")]:
+        if index >= columns_start:
+            items.append(statement[start:index].strip())
+            start = index + 1
+    stars = [item for item in items if item == "*" or item.endswith(".*")]
+    named = [item for item in items if item not in stars and _select_item_name(item) == key.lower()]
+    if stars and named or not stars and (len(named) != 1 or _unquote(named[0].rsplit(".", 1)[-1]).lower() != key.lower()):
+        return None
+    if match.group("where") is not None:
+        where_keyword = match.start("where") - len("where")
+        return {"key": key, "select": statement[:where_keyword].rstrip(), "where": statement[match.start("where"):].strip()}
+    return {"key": key, "select": statement, "where": None}
+
+
+def limit_statement(statement: str, limit: int, offset: int = 0) -> str | None:
+    # Appends LIMIT/OFFSET to a row-returning statement without wrapping it in a derived table,
+    # which would reject or misread duplicate column names from joins. None when the statement
+    # already ends in its own LIMIT, FETCH or locking clause.
+    if _LIMIT_BLOCKERS_RE.search(_top_level(statement)):
+        return None
+    # The clause goes on its own line so a trailing -- comment cannot swallow it.
+    return f"{statement}\nLIMIT {int(limit)}" + (f" OFFSET {int(offset)}" if offset else "")
+
+
+class CancelScope:
+    # Tracks the database sessions working for one request. Cancelling the asyncio task only
+    # abandons a blocking driver call, so cancel() stops the statement in the database itself:
+    # pg_cancel_backend / KILL QUERY for SQL and killOp (found by comment) for MongoDB, whose
+    # operations also carry maxTimeMS. SQL sessions get the same deadline as a statement timeout,
+    # so the database gives up on its own even if nobody calls cancel().
+    def __init__(self, max_time_seconds: float | None = None):
+        self.tag = uuid.uuid4().hex
+        self.max_time_ms = int(max_time_seconds * 1000) if max_time_seconds else None
+        self.cancelled = False
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _track(self, session: tuple):
+        key = object()
+        with self._lock:
+            if self.cancelled:
+                raise RuntimeError("The query was cancelled.")
+            self._sessions[key] = session
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sessions.pop(key, None)
+
+    @contextmanager
+    def track_sql(self, db_url: str, connection):
+        # The session id identifies the statement for pg_cancel_backend / KILL QUERY.
+        dialect = connection.dialect.name
+        backend = None
+        if dialect == 'postgresql':
+            if self.max_time_ms:
+                # set_config(..., true) is SET LOCAL: the timeout ends with the transaction and
+                # never leaks into the pooled connection.
+                backend = connection.execute(
+                    text("SELECT pg_backend_pid(), set_config('statement_timeout', :timeout, true)"),
+                    {"timeout": str(self.max_time_ms)}
+                ).scalar()
+            else:
+                backend = connection.execute(text("SELECT pg_backend_pid()")).scalar()
+        elif dialect == 'mysql':
+            backend = connection.execute(text("SELECT CONNECTION_ID()")).scalar()
+            if self.max_time_ms:
+                connection.execute(text(f"SET SESSION max_execution_time = {int(self.max_time_ms)}"))
+        with self._track(("sql", db_url, dialect, backend)):
+            try:
+                yield
+            finally:
+                if dialect == 'mysql' and self.max_time_ms:
+                    # Session variables outlive the checkout; put the pooled connection back as it was.
+                    try:
+                        connection.execute(text("SET SESSION max_execution_time = 0"))
+                    except Exception:
+                        pass
+
+    def track_mongo(self, db_url: str):
+        return self._track(("nosql", db_url, None, None))
+
+    def mongo_options(self) -> dict:
+        options = {"comment": self.tag}
+        if self.max_time_ms:
+            options["max_time_ms"] = self.max_time_ms
+        return options
+
+    def cancel(self) -> int:
+        with self._lock:
+            self.cancelled = True
+            sessions = list(self._sessions.values())
+        interrupted = 0
+        for kind, db_url, dialect, backend in sessions:
+            try:
+                if kind == "sql" and backend is not None:
+                    with connection_registry.lease_engine(db_url) as engine, engine.connect() as connection:
+                        if dialect == 'postgresql':
+                            connection.execute(text("SELECT pg_cancel_backend(:backend)"), {"backend": backend})
+                        else:
+                            connection.execute(text(f"KILL QUERY {int(backend)}"))
+                    interrupted += 1
+                elif kind == "nosql":
+                    with connection_registry.lease_mongo_client(db_url) as client:
+                        for operation in client.admin.command({"currentOp": 1, "command.comment": self.tag}).get("inprog", []):
+                            client.admin.command({"killOp": 1, "op": operation["opid"]})
+                            interrupted += 1
+            except Exception as e:
+                log.warning("Could not cancel the query in the database", error=str(e))
+        return interrupted
+
+
+def _track_sql(cancel_scope: CancelScope | None, db_url: str, connection):
+    return cancel_scope.track_sql(db_url, connection) if cancel_scope is not None else nullcontext()
+
+
+def _track_mongo(cancel_scope: CancelScope | None, db_url: str):
+    return cancel_scope.track_mongo(db_url) if cancel_scope is not None else nullcontext()
+
+
+def _mongo_options(cancel_scope: CancelScope | None) -> dict:
+    return cancel_scope.mongo_options() if cancel_scope is not None else {}
+
+
+def _paged_sql(connection, statement: str, max_rows: int, page_state: dict | None) -> tuple[str, dict, dict, int]:
+    # Returns the statement to run, its parameters, the page state and how many leading rows of
+    # its result still have to be skipped.
+    plan = None
+    if page_state is None:
+        page_state = {"mode": "offset", "key": None, "last": None, "offset": 0}
+        # Keyset paging must not override the query's own ordering.
+        plan = None if _has_top_level_order_by(statement) else _keyset_plan(connection, statement)
+        if plan is not None:
+            page_state = {"mode": "keyset", "key": plan["key"], "last": None, "offset": 0}
+    elif page_state["mode"] == "keyset":
+        plan = _keyset_plan(connection, statement)
+
+    if page_state["mode"] == "keyset":
+        if plan is not None and plan["key"] == page_state["key"]:
+            key = connection.dialect.identifier_preparer.quote(page_state["key"])
+            conditions = [f"(\n{plan['where']}\n)"] if plan["where"] else []
+            if page_state["last"] is not None:
+                conditions.append(f"{key} > :last")
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            paged = f"{plan['select']}\n{where} ORDER BY {key} LIMIT {max_rows + 1}"
+            return paged, {"last": page_state["last"]} if page_state["last"] is not None else {}, page_state, 0
+        page_state = dict(page_state, mode="offset", key=None, last=None)
+
+    offset = int(page_state["offset"])
+    limited = limit_statement(statement, max_rows + 1, offset)
+    if limited is not None:
+        return limited, {}, page_state, 0
+    return statement, {}, page_state, offset
+
+
+def execute_sql_query(db_url: str, query: str, max_rows: int = MAX_RESULT_ROWS, page_state: dict | None = None,
+                      cancel_scope: CancelScope | None = None) -> dict:
+    statement = _clean_statement(query)
+    try:
+        with connection_registry.lease_engine(db_url) as engine, engine.connect() as connection, \
+                _track_sql(cancel_scope, db_url, connection):
+            if not _ROW_RETURNING_RE.match(statement):
+                result_proxy = connection.execute(text(statement))
+                rows = convert_sql_rows(result_proxy.keys(), result_proxy) if result_proxy.returns_rows else []
+                return {"rows": rows, "truncated": False, "next_page": None}
+
+            paged, params, page_state, skip = _paged_sql(connection, statement, max_rows, page_state)
+            result_proxy = connection.execution_options(
+                stream_results=True, yield_per=min(max_rows + 1, FETCH_BATCH_SIZE)
+            ).execute(text(paged), params)
+            columns = list(result_proxy.keys())
+            # A statement with its own LIMIT is paged by reading past the earlier pages' rows.
+            while skip > 0:
+                skipped = len(result_proxy.fetchmany(min(skip, FETCH_BATCH_SIZE)))
+                if not skipped:
+                    break
+                skip -= skipped
+            fetched = result_proxy.fetchmany(max_rows + 1)
+            result_proxy.close()
+
+            truncated = len(fetched) > max_rows
+            fetched = fetched[:max_rows]
+            next_page = None
+            if truncated:
+                next_page = dict(page_state, offset=page_state["offset"] + max_rows)
+                if page_state["mode"] == "keyset":
+                    key_index = next(i for i, column in enumerate(columns) if column.lower() == page_state["key"].lower())
+                    next_page["last"] = fetched[-1][key_index]
+            return {"rows": convert_sql_rows(columns, fetched), "truncated": truncated, "next_page": next_page}
+    except Exception as e:
+        raise RuntimeError(f"Error executing SQL query: {e}")
+
+
+def iter_sql_query(db_url: str, query: str, batch_size: int = 500, max_rows: int | None = None,
+                   cancel_scope: CancelScope | None = None):
+    # Yields lists of rows from a server-side cursor, so the full result is never held in memory.
+    # With max_rows, at most max_rows + 1 rows are read so the caller can tell the result was cut.
+    statement = _clean_statement(query)
+    if max_rows is not None and _ROW_RETURNING_RE.match(statement):
+        statement = limit_statement(statement, max_rows + 1) or statement
+    try:
+        with connection_registry.lease_engine(db_url) as engine, engine.connect() as connection, \
+                _track_sql(cancel_scope, db_url, connection):
+            result_proxy = connection.execution_options(stream_results=True, yield_per=batch_size).execute(text(statement))
+            converter = None
+            # A statement with its own LIMIT is not rewritten, so the cap is also applied here.
+            remaining = max_rows + 1 if max_rows is not None else None
+            for partition in result_proxy.partitions(batch_size):
+                partition = [tuple(row) for row in partition[:remaining]]
+                if converter is None:
+                    converter = RowConverter(list(result_proxy.keys()), partition[:50])
+                yield converter.convert_all(partition)
+                if remaining is not None:
+                    remaining -= len(partition)
+                    if remaining <= 0:
+                        break
+    except GeneratorExit:
+        raise
     except Exception as e:
         raise RuntimeError(f"Error executing SQL query: {e}")
 
 
-def execute_nosql_query(db_url: str, collection_name: str, query_filter: dict) -> list[dict]:
+# Read-only stages the generated pipelines may use; $out, $merge and friends never run.
+_MONGO_PIPELINE_STAGES = frozenset({
+    "$match", "$group", "$project", "$addFields", "$set", "$unset", "$sort", "$limit", "$skip", "$count",
+    "$unwind", "$lookup", "$bucket", "$bucketAuto", "$facet", "$sortByCount", "$replaceRoot", "$replaceWith",
+    "$sample", "$unionWith",
+})
+# Server-side JavaScript is never accepted, wherever it appears.
+_MONGO_FORBIDDEN_OPERATORS = frozenset({"$where", "$function", "$accumulator"})
+
+
+def _check_mongo_operators(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in _MONGO_FORBIDDEN_OPERATORS:
+                raise ValueError(f"The '{key}' operator is not allowed.")
+            _check_mongo_operators(item)
+    elif isinstance(value, list):
+        for item in value:
+            _check_mongo_operators(item)
+
+
+def _validate_pipeline(pipeline) -> list:
+    if not isinstance(pipeline, list) or not pipeline:
+        raise ValueError("'pipeline' must be a non-empty list of stages.")
+    for stage in pipeline:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise ValueError("Each pipeline stage must be an object with exactly one stage operator.")
+        name, spec = next(iter(stage.items()))
+        if name not in _MONGO_PIPELINE_STAGES:
+            raise ValueError(f"The pipeline stage '{name}' is not allowed.")
+        if name in ("$lookup", "$unionWith") and isinstance(spec, dict) and "pipeline" in spec:
+            _validate_pipeline(spec["pipeline"])
+        elif name == "$facet" and isinstance(spec, dict):
+            for sub_pipeline in spec.values():
+                _validate_pipeline(sub_pipeline)
+    _check_mongo_operators(pipeline)
+    return pipeline
+
+
+def _normalize_sort(sort) -> list[list] | None:
+    if not sort:
+        return None
+    pairs = sort.items() if isinstance(sort, dict) else sort
+    normalized = []
+    for pair in pairs:
+        if isinstance(pair, str):
+            pair = (pair, 1)
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2 or not isinstance(pair[0], str):
+            raise ValueError("'sort' must map field names to 1 or -1.")
+        field, direction = pair
+        normalized.append([field, -1 if str(direction).lower() in ("-1", "desc", "descending") else 1])
+    return normalized
+
+
+def normalize_nosql_query(generated_query: dict) -> dict:
+    # A generated MongoDB query is either a find ({collection, query, projection, sort, limit}) or
+    # an aggregation ({collection, pipeline}). The result is safe to pass to every function below.
+    if not isinstance(generated_query, dict) or not isinstance(generated_query.get("collection"), str) \
+            or not generated_query["collection"]:
+        raise ValueError("The query must name a collection.")
+    # Extended JSON lets the model write dates and ObjectIds as {"$date": ...} and {"$oid": ...};
+    # already decoded values (from a page token) survive the round trip unchanged.
+    spec = json_util.loads(json_util.dumps(generated_query))
+    if spec.get("pipeline") is not None:
+        return {"collection": spec["collection"], "pipeline": _validate_pipeline(spec["pipeline"])}
+
+    query_filter = spec.get("query") or {}
+    projection = spec.get("projection") or None
+    if not isinstance(query_filter, dict):
+        raise ValueError("'query' must be an object.")
+    if projection is not None and not isinstance(projection, dict):
+        raise ValueError("'projection' must be an object.")
+    _check_mongo_operators([query_filter, projection])
+    limit = spec.get("limit")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 0):
+        raise ValueError("'limit' must be a non-negative integer.")
+    return {
+        "collection": spec["collection"],
+        "query": query_filter,
+        "projection": projection,
+        "sort": _normalize_sort(spec.get("sort")),
+        "limit": limit or None,
+    }
+
+
+def _mongo_pipeline(query: dict) -> list:
+    # The same query as an aggregation pipeline, for grouping and explaining.
+    if "pipeline" in query:
+        return list(query["pipeline"])
+    pipeline = [{"$match": query["query"]}]
+    if query["sort"]:
+        pipeline.append({"$sort": dict(query["sort"])})
+    if query["limit"]:
+        pipeline.append({"$limit": query["limit"]})
+    if query["projection"]:
+        pipeline.append({"$project": query["projection"]})
+    return pipeline
+
+
+def _aggregate_options(cancel_scope: CancelScope | None) -> dict:
+    options = _mongo_options(cancel_scope)
+    if "max_time_ms" in options:
+        options["maxTimeMS"] = options.pop("max_time_ms")
+    return options
+
+
+def _get_path(document: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _pop_path(document: dict, path: str):
+    parent, _, leaf = path.rpartition(".")
+    container = _get_path(document, parent) if parent else document
+    if isinstance(container, dict):
+        container.pop(leaf, None)
+        if parent and not container:
+            _pop_path(document, parent)
+
+
+def _keyset_projection(projection: dict | None, keys: list[str]) -> tuple[dict | None, list[str]] | None:
+    # Keyset paging reads the sort keys from each document, so they are added to the projection
+    # and removed again from the rows. Returns None when that would collide with the projection.
+    if not projection:
+        return projection, []
+    projection = dict(projection)
+    inclusive = any(value not in (0, False) for field, value in projection.items() if field != "_id")
+    hidden = []
+    for key in keys:
+        if key == "_id" or not inclusive:
+            if projection.get(key) in (0, False):
+                del projection[key]
+                hidden.append(key)
+            elif any(field.startswith(key + ".") or key.startswith(field + ".") for field in projection):
+                return None
+            continue
+        if key in projection or any(key.startswith(field + ".") for field in projection):
+            continue
+        if any(field.startswith(key + ".") for field in projection):
+            return None
+        projection[key] = 1
+        hidden.append(key)
+    return projection, hidden
+
+
+def _keyset_filter(query_filter: dict, keys: list[list], last: list) -> dict:
+    # Documents after `last` in sort order: (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+    branches = []
+    for i, (field, direction) in enumerate(keys):
+        branch = {keys[j][0]: last[j] for j in range(i)}
+        if direction == 1:
+            branch[field] = {"$gt": last[i]}
+        else:
+            # Missing and null values sort last in descending order but never match $lt.
+            branch["$or"] = [{field: {"$lt": last[i]}}, {field: None}]
+        branches.append(branch)
+    return {"$and": [query_filter, {"$or": branches}]} if query_filter else {"$or": branches}
+
+
+def _page_fetch_size(query: dict, max_rows: int, offset: int) -> int:
+    # The query's own limit caps the rows across all pages.
+    if query.get("limit"):
+        return max(0, min(max_rows + 1, query["limit"] - offset))
+    return max_rows + 1
+
+
+def execute_nosql_query(db_url: str, query: dict, max_rows: int = MAX_RESULT_ROWS, page_state: dict | None = None,
+                        cancel_scope: CancelScope | None = None) -> dict:
+    try:
+        query = normalize_nosql_query(query)
+        offset = page_state["offset"] if page_state else 0
+        fetch = _page_fetch_size(query, max_rows, offset)
+        hidden = []
+        with _mongo_database(db_url) as db, _track_mongo(cancel_scope, db_url):
+            collection = db[query["collection"]]
+            if "pipeline" in query:
+                # Pipelines page by offset; the projection, grouping and sorting all stay in MongoDB.
+                page_state = {"mode": "offset", "offset": offset}
+                pipeline = query["pipeline"] + ([{"$skip": offset}] if offset else []) + [{"$limit": fetch}]
+                documents = list(collection.aggregate(
+                    pipeline, allowDiskUse=True, batchSize=min(fetch, FETCH_BATCH_SIZE), **_aggregate_options(cancel_scope)
+                ))
+            else:
+                if page_state is None:
+                    # The query's sort with _id as the tie-breaker, so every document has a unique position.
+                    keys = [list(pair) for pair in query["sort"] or []]
+                    if not any(field == "_id" for field, _ in keys):
+                        keys.append(["_id", 1])
+                    page_state = {"mode": "keyset", "keys": keys, "last": None, "offset": offset}
+                projection = query["projection"]
+                effective_filter = query["query"]
+                if page_state["mode"] == "keyset":
+                    keyset = _keyset_projection(projection, [field for field, _ in page_state["keys"]])
+                    if keyset is None:
+                        page_state = {"mode": "offset", "offset": offset}
+                    else:
+                        projection, hidden = keyset
+                        if page_state["last"] is not None:
+                            effective_filter = _keyset_filter(effective_filter, page_state["keys"], page_state["last"])
+                cursor = collection.find(
+                    effective_filter, projection, batch_size=min(max(fetch, 1), FETCH_BATCH_SIZE),
+                    **_mongo_options(cancel_scope)
+                )
+                if page_state["mode"] == "keyset":
+                    cursor = cursor.sort([tuple(pair) for pair in page_state["keys"]])
+                else:
+                    if query["sort"]:
+                        cursor = cursor.sort([tuple(pair) for pair in query["sort"]])
+                    cursor = cursor.skip(offset)
+                documents = list(cursor.limit(fetch)) if fetch else []
+        truncated = len(documents) > max_rows
+        documents = documents[:max_rows]
+        next_page = None
+        if truncated:
+            next_page = dict(page_state, offset=offset + max_rows)
+            if page_state["mode"] == "keyset":
+                last = [_get_path(documents[-1], field) for field, _ in page_state["keys"]]
+                if any(value is None or isinstance(value, (list, dict)) for value in last):
+                    # Missing, null and array keys do not compare with $gt/$lt the way they sort.
+                    next_page = {"mode": "offset", "offset": offset + max_rows}
+                else:
+                    next_page["last"] = last
+        for document in documents:
+            for field in hidden:
+                _pop_path(document, field)
+        return {"rows": [serialize_document(doc) for doc in documents], "truncated": truncated, "next_page": next_page}
+    except Exception as e:
+        raise RuntimeError(f"Error executing NoSQL query: {e}")
+
+
+def iter_nosql_query(db_url: str, query: dict, batch_size: int = 500, max_rows: int | None = None,
+                     cancel_scope: CancelScope | None = None):
+    try:
+        query = normalize_nosql_query(query)
+        limit = _page_fetch_size(query, max_rows, 0) if max_rows is not None else query.get("limit") or 0
+        with _mongo_database(db_url) as db, _track_mongo(cancel_scope, db_url):
+            collection = db[query["collection"]]
+            if "pipeline" in query:
+                pipeline = query["pipeline"] + ([{"$limit": limit}] if limit else [])
+                cursor = collection.aggregate(
+                    pipeline, allowDiskUse=True, batchSize=batch_size, **_aggregate_options(cancel_scope)
+                )
+            else:
+                sort = [tuple(pair) for pair in query["sort"]] if query["sort"] else None
+                cursor = collection.find(
+                    query["query"], query["projection"], sort=sort, batch_size=batch_size, limit=limit,
+                    **_mongo_options(cancel_scope)
+                )
+            with cursor:
+                batch = []
+                for doc in cursor:
+                    batch.append(serialize_document(doc))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error executing NoSQL query: {e}")
+
+
+_SQL_AGGREGATES = {"sum": "SUM", "mean": "AVG", "min": "MIN", "max": "MAX"}
+_MONGO_AGGREGATES = {"sum": "$sum", "mean": "$avg", "min": "$min", "max": "$max"}
+
+
+def _sql_time_bucket(dialect: str, column: str, bucket: str) -> str:
+    if dialect == 'postgresql':
+        return f"date_trunc('{bucket}', {column})"
+    if dialect == 'mysql':
+        return {
+            "day": f"DATE({column})",
+            "week": f"DATE(DATE_SUB({column}, INTERVAL WEEKDAY({column}) DAY))",
+            "month": f"DATE_FORMAT({column}, '%Y-%m-01')",
+            "quarter": f"MAKEDATE(YEAR({column}), 1) + INTERVAL QUARTER({column}) - 1 QUARTER",
+            "year": f"MAKEDATE(YEAR({column}), 1)",
+        }[bucket]
+    if dialect == 'sqlite':
+        return {
+            "day": f"date({column})",
+            "week": f"date({column}, '-' || ((strftime('%w', {column}) + 6) % 7) || ' days')",
+            "month": f"strftime('%Y-%m-01', {column})",
+            "quarter": f"printf('%s-%02d-01', strftime('%Y', {column}), ((strftime('%m', {column}) - 1) / 3) * 3 + 1)",
+            "year": f"strftime('%Y-01-01', {column})",
+        }[bucket]
+    raise NotImplementedError(f"Time bucketing is not supported for the '{dialect}' dialect.")
+
+
+def aggregate_sql_query(db_url: str, query: str, x_field: str, y_fields: list[str], aggregation: str,
+                        time_bucket: str | None = None, limit: int = MAX_RESULT_ROWS,
+                        cancel_scope: CancelScope | None = None) -> list[dict]:
+    # Groups the full result of `query` in the database, so a chart over a truncated result still
+    # covers every row. Rows come back as {x_field, *y_fields, "_rows"}; "count" replaces the
+    # y fields when aggregation is "count".
+    statement = _clean_statement(query)
+    if not _ROW_RETURNING_RE.match(statement):
+        raise NotImplementedError("Only row-returning queries can be aggregated.")
+    with connection_registry.lease_engine(db_url) as engine:
+        quote = engine.dialect.identifier_preparer.quote
+        key = quote(x_field)
+        if time_bucket:
+            key = _sql_time_bucket(engine.dialect.name, key, time_bucket)
+        if aggregation == "count":
+            measures = ["COUNT(*) AS count"]
+        else:
+            function = _SQL_AGGREGATES[aggregation]
+            measures = [f"{function}({quote(field)}) AS {quote(field)}" for field in y_fields]
+        order = "1" if time_bucket else "2 DESC"
+        grouped = (
+            f"SELECT {key} AS {quote(x_field)}, {', '.join(measures)}, COUNT(*) AS _rows "
+            f"FROM ({statement}) AS _chart GROUP BY 1 ORDER BY {order} LIMIT {int(limit)}"
+        )
+        try:
+            with engine.connect() as connection, _track_sql(cancel_scope, db_url, connection):
+                result_proxy = connection.execute(text(grouped))
+                return convert_sql_rows(result_proxy.keys(), result_proxy)
+        except Exception as e:
+            raise RuntimeError(f"Error aggregating SQL query: {e}")
+
+
+def aggregate_nosql_query(db_url: str, query: dict, x_field: str, y_fields: list[str], aggregation: str,
+                          time_bucket: str | None = None, limit: int = MAX_RESULT_ROWS,
+                          cancel_scope: CancelScope | None = None) -> list[dict]:
+    # The MongoDB counterpart of aggregate_sql_query: a $group stage appended to the query's pipeline.
+    key = f"${x_field}"
+    if time_bucket:
+        key = {"$dateTrunc": {"date": key, "unit": time_bucket}}
+    group = {"_id": key, "_rows": {"$sum": 1}}
+    if aggregation == "count":
+        fields = {"count": "count"}
+        group["count"] = {"$sum": 1}
+    else:
+        # Output field names may not contain dots, so measures are renamed on the way back.
+        fields = {f"m{i}": field for i, field in enumerate(y_fields)}
+        for alias, field in fields.items():
+            group[alias] = {_MONGO_AGGREGATES[aggregation]: f"${field}"}
+    sort = {"_id": 1} if time_bucket else {next(iter(fields)): -1}
     try:
-        client = MongoClient(db_url)
-        db_name = urlparse(db_url).path.lstrip('/')
-        db = client[db_name]
-        collection = db[collection_name]
-        results = [json.loads(json.dumps(doc, default=str)) for doc in collection.find(query_filter)]
-        client.close()
-        return results
+        query = normalize_nosql_query(query)
+        pipeline = _mongo_pipeline(query) + [{"$group": group}, {"$sort": sort}, {"$limit": int(limit)}]
+        with _mongo_database(db_url) as db, _track_mongo(cancel_scope, db_url):
+            collection = db[query["collection"]]
+            return [
+                serialize_document({
+                    x_field: doc["_id"],
+                    **{field: doc.get(alias) for alias, field in fields.items()},
+                    "_rows": doc["_rows"],
+                })
+                for doc in collection.aggregate(pipeline, allowDiskUse=True, **_aggregate_options(cancel_scope))
+            ]
     except Exception as e:
-        raise RuntimeError(f"Error executing NoSQL query: {e}")
\ No newline at end of file
+        raise RuntimeError(f"Error aggregating NoSQL query: {e}")
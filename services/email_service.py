@@ -1,13 +1,182 @@
 # services/email_service.py
 
+import itertools
 import os
+import queue
+import re
 import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
+from utils.rate_limiter import TokenBucket
+from utils.telemetry import SMTP_SEND_DURATION
+from utils.lazy import LazyService
 
 load_dotenv()
 
+EMAIL_FIELD_CANDIDATES = ['email', 'Email', 'customer_email']
+
+_PLACEHOLDER_RE = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+
+
+def compile_template(template: str):
+    # Splits the template once into literal text and placeholder names, so personalizing a
+    # message is a single join instead of one str.replace per column per row. Placeholders
+    # without a matching column are left in place, as before.
+    parts = _PLACEHOLDER_RE.split(template)
+    literals, keys = parts[0::2], parts[1::2]
+
+    def render(row: dict) -> str:
+        out = [literals[0]]
+        for key, literal in zip(keys, literals[1:]):
+            out.append(str(row[key]) if key in row else f"{{{{{key}}}}}")
+            out.append(literal)
+        return "".join(out)
+
+    return render
+
+
+def find_email_field(row: dict) -> str | None:
+    return next((field for field in EMAIL_FIELD_CANDIDATES if field in row), None)
+
+
+class EmailJob:
+    def __init__(self, subject: str, failure_report_limit: int):
+        self.id = uuid.uuid4().hex
+        self.subject = subject
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.retries = 0
+        self.error = None
+        self.abort_reason = None
+        self.cancelled = False
+        self.recipients_truncated = False
+        self.failures = []
+        self._consecutive_failures = 0
+        self._failure_report_limit = failure_report_limit
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def record(self, outcome: str, recipient: str = None, error: str = None, attempts: int = 1, abort_after: int = 0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.retries += attempts - 1
+            if outcome == "sent":
+                self._consecutive_failures = 0
+            elif outcome == "failed":
+                if len(self.failures) < self._failure_report_limit:
+                    self.failures.append({"recipient": recipient, "error": error, "attempts": attempts})
+                self._consecutive_failures += 1
+                # A dead server or revoked credentials would otherwise cost every remaining
+                # recipient the full retry schedule.
+                if abort_after and self._consecutive_failures >= abort_after and self.abort_reason is None:
+                    self.abort_reason = f"Aborted after {self._consecutive_failures} consecutive failures: {error}"
+
+    def cancel(self):
+        # Queued messages are dropped by the workers; a message already on the wire still completes.
+        with self._lock:
+            self.cancelled = True
+            if self.abort_reason is None:
+                self.abort_reason = "Cancelled."
+
+    def finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def summary(self) -> str:
+        if self.status == "completed" and not self.queued:
+            return "No valid recipient email addresses found in the data."
+        if self.status == "failed":
+            return f"Email job failed after {self.sent} of {self.queued} messages: {self.error}"
+        if self.status != "completed":
+            return (f"Email job {self.id} is {self.status}: {self.sent} of {self.queued} messages sent so far. "
+                    f"Poll /api/email/jobs/{self.id} for progress.")
+        message = f"Emails sent successfully to {self.sent} users."
+        if self.failed:
+            message += f" {self.failed} recipients failed."
+        if self.duplicates:
+            message += f" {self.duplicates} duplicate addresses were skipped."
+        if self.recipients_truncated:
+            message += f" Recipients were capped at {self.queued}."
+        return message
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            finished = self.finished_at or time.time()
+            elapsed = finished - self.started_at if self.started_at else 0.0
+            done = self.sent + self.failed
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "subject": self.subject,
+                "queued": self.queued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "duplicates": self.duplicates,
+                "skipped": self.skipped,
+                "retries": self.retries,
+                "recipients_truncated": self.recipients_truncated,
+                "progress": round(done / self.queued, 4) if self.queued else 0.0,
+                "messages_per_second": round(done / elapsed, 2) if elapsed else 0.0,
+                "elapsed_seconds": round(elapsed, 3),
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "error": self.error,
+                "failures": list(self.failures),
+            }
+
+
+class _SMTPConnection:
+    # One pooled SMTP session. It connects lazily, reconnects after an error, and is recycled
+    # after a number of messages because many providers cap messages per session.
+    def __init__(self, service: "EmailService"):
+        self.service = service
+        self.server = None
+        self.sent_on_session = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.service.host, self.service.port, timeout=self.service.smtp_timeout)
+        server.ehlo()
+        if self.service.use_tls:
+            server.starttls()
+            # STARTTLS discards the features announced in clear text, AUTH among them.
+            server.ehlo()
+        if self.service.use_auth:
+            server.login(self.service.user, self.service.password)
+        self.server = server
+        self.sent_on_session = 0
+
+    def send(self, recipient: str, message: str):
+        if self.server is None or self.sent_on_session >= self.service.messages_per_connection:
+            self.close()
+            self._connect()
+        self.server.sendmail(self.service.user, recipient, message)
+        self.sent_on_session += 1
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
 
 class EmailService:
     def __init__(self):
@@ -20,54 +189,189 @@ class EmailService:
         if not all([self.host, self.port, self.user, self.password, self.sender_name]):
             raise ValueError("Email configuration is missing from environment variables.")
 
-    def send_emails(self, recipients: list[str], subject: str, html_body_template: str, data: list[dict]):
-        sent_count = 0
-        email_field_candidates = ['email', 'Email', 'customer_email']
-
-        # Determine the email field from the data
-        email_field = None
-        if data:
-            for field in email_field_candidates:
-                if field in data[0]:
-                    email_field = field
-                    break
+        self.use_tls = os.getenv("EMAIL_USE_TLS", "true").lower() == "true"
+        self.use_auth = os.getenv("EMAIL_USE_AUTH", "true").lower() == "true"
+        self.pool_size = int(os.getenv("EMAIL_POOL_SIZE", 4))
+        self.messages_per_connection = int(os.getenv("EMAIL_MESSAGES_PER_CONNECTION", 100))
+        self.smtp_timeout = float(os.getenv("EMAIL_SMTP_TIMEOUT_SECONDS", 30))
+        self.max_retries = int(os.getenv("EMAIL_MAX_RETRIES", 3))
+        self.retry_backoff = float(os.getenv("EMAIL_RETRY_BACKOFF_SECONDS", 1))
+        self.failure_report_limit = int(os.getenv("EMAIL_FAILURE_REPORT_LIMIT", 100))
+        self.abort_after_failures = int(os.getenv("EMAIL_ABORT_AFTER_FAILURES", 50))
+        self.max_recipients = int(os.getenv("EMAIL_MAX_RECIPIENTS", 100000))
+        self.job_retention = int(os.getenv("EMAIL_JOB_RETENTION_SECONDS", 3600))
+        rate = float(os.getenv("EMAIL_RATE_PER_SECOND", 10))
+        # One bucket for every job: the provider's sending quota is per account, not per campaign.
+        self.rate_limiter = TokenBucket(rate, float(os.getenv("EMAIL_RATE_BURST", rate))) if rate > 0 else None
 
-        if not email_field:
-            raise ValueError("Could not find a valid email field in the query result data.")
+        self.sender = f"{self.sender_name} <{self.user}>"
+        self._jobs: dict[str, EmailJob] = {}
+        self._jobs_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("EMAIL_MAX_CONCURRENT_JOBS", 2)), thread_name_prefix="email-job"
+        )
 
-        to_addresses = [row[email_field] for row in data if email_field in row and row[email_field]]
+    def _build_message(self, recipient: str, subject: str, html_body: str) -> str:
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.sender
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(html_body, 'html'))
+        return msg.as_string()
 
-        if not to_addresses:
-            return "No valid recipient email addresses found in the data."
+    def _deliver(self, connection: _SMTPConnection, job: EmailJob, recipient: str, message: str) -> str:
+        for attempt in range(1, self.max_retries + 2):
+            if job.abort_reason is not None:
+                job.record("failed", recipient, job.abort_reason, attempt)
+                return "aborted"
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                connection.send(recipient, message)
+                job.record("sent", attempts=attempt)
+                return "sent"
+            except smtplib.SMTPResponseException as e:
+                # 4xx replies are temporary (greylisting, throttling); 5xx replies will not change.
+                error, transient = f"{e.smtp_code} {e.smtp_error!r}", 400 <= e.smtp_code < 500
+                if e.smtp_code in (421, 451):
+                    connection.close()
+            except smtplib.SMTPServerDisconnected as e:
+                connection.close()
+                error, transient = str(e) or "Server disconnected", True
+            except smtplib.SMTPRecipientsRefused as e:
+                code, reply = e.recipients.get(recipient, (550, b""))
+                error, transient = f"{code} {reply!r}", 400 <= code < 500
+            except smtplib.SMTPException as e:
+                error, transient = str(e), False
+            except OSError as e:
+                # Socket errors and timeouts; SMTPException is an OSError too, hence the order.
+                connection.close()
+                error, transient = str(e) or type(e).__name__, True
+            if not transient or attempt > self.max_retries:
+                job.record("failed", recipient, error, attempt, self.abort_after_failures)
+                return "failed"
+            time.sleep(self.retry_backoff * 2 ** (attempt - 1))
 
+    def _worker(self, job: EmailJob, messages: queue.Queue):
+        connection = _SMTPConnection(self)
         try:
-            with smtplib.SMTP(self.host, self.port) as server:
-                server.starttls()
-                server.login(self.user, self.password)
+            while True:
+                item = messages.get()
+                if item is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    outcome = self._deliver(connection, job, *item)
+                except Exception as e:
+                    # Keep the worker alive; a dead worker would leave the producer blocked on the queue.
+                    connection.close()
+                    job.record("failed", item[0], str(e), abort_after=self.abort_after_failures)
+                    outcome = "failed"
+                SMTP_SEND_DURATION.observe(time.perf_counter() - started, outcome=outcome)
+        finally:
+            connection.close()
 
-                for row_data in data:
-                    recipient_email = row_data.get(email_field)
-                    if not recipient_email:
-                        continue
+    def _run_job(self, job: EmailJob, rows, email_field: str, subject: str, render):
+        job.status = "running"
+        job.started_at = time.time()
+        # Bounded, so rows are read from the source only as fast as they are sent.
+        messages = queue.Queue(maxsize=self.pool_size * 50)
+        workers = [
+            threading.Thread(target=self._worker, args=(job, messages), name=f"email-{job.id[:8]}-{i}", daemon=True)
+            for i in range(self.pool_size)
+        ]
+        for worker in workers:
+            worker.start()
 
-                    msg = MIMEMultipart('alternative')
-                    msg['From'] = f"{self.sender_name} <{self.user}>"
-                    msg['To'] = recipient_email
-                    msg['Subject'] = subject
+        seen = set()
+        error = None
+        try:
+            for row in rows:
+                if job.abort_reason is not None:
+                    break
+                if job.queued >= self.max_recipients:
+                    job.recipients_truncated = True
+                    break
+                recipient = row.get(email_field)
+                if not recipient or not isinstance(recipient, str):
+                    job.record("skipped")
+                    continue
+                address = recipient.strip().lower()
+                if address in seen:
+                    job.record("duplicates")
+                    continue
+                seen.add(address)
+                job.record("queued")
+                messages.put((recipient.strip(), self._build_message(recipient.strip(), subject, render(row))))
+        except Exception as e:
+            # The row source failed (e.g. the database went away); deliver what was already queued.
+            error = f"Failed to read recipients: {e}"
+        finally:
+            for _ in workers:
+                messages.put(None)
+            for worker in workers:
+                worker.join()
 
-                    # Personalize content
-                    html_body = html_body_template
-                    for key, value in row_data.items():
-                        html_body = html_body.replace(f"{{{{{key}}}}}", str(value))
+        if job.cancelled:
+            job.finish("cancelled", job.abort_reason)
+            return
+        error = error or job.abort_reason
+        if error is None and job.queued and not job.sent:
+            error = job.failures[0]["error"] if job.failures else "No message could be delivered."
+        job.finish("failed" if error else "completed", error)
 
-                    msg.attach(MIMEText(html_body, 'html'))
-                    server.sendmail(self.user, recipient_email, msg.as_string())
-                    sent_count += 1
+    def _prune_jobs(self):
+        cutoff = time.time() - self.job_retention
+        with self._jobs_lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+                del self._jobs[job_id]
 
-            return f"Emails sent successfully to {sent_count} users."
+    def submit_job(self, recipients: list[str], subject: str, html_body_template: str, data) -> EmailJob:
+        # `data` may be a list or any iterable of rows, e.g. a cursor over the full query result;
+        # it is consumed on the job's thread.
+        rows = iter(data)
+        first = next(rows, None)
+        email_field = find_email_field(first) if first else None
+        if recipients:
+            email_field = email_field or EMAIL_FIELD_CANDIDATES[0]
+        if not email_field:
+            raise ValueError("Could not find a valid email field in the query result data.")
+        rows = itertools.chain(
+            ({email_field: recipient} for recipient in recipients),
+            [first] if first else [],
+            rows,
+        )
 
-        except Exception as e:
-            raise RuntimeError(f"Failed to send emails: {e}")
+        self._prune_jobs()
+        job = EmailJob(subject, self.failure_report_limit)
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run_job, job, rows, email_field, subject, compile_template(html_body_template))
+        return job
+
+    def get_job(self, job_id: str) -> EmailJob | None:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def wait_for_job(self, job: EmailJob, timeout: float | None = None) -> str:
+        # Returns the job summary once it finishes, or its progress if it is still running at the timeout.
+        job.wait(timeout)
+        if job.status == "failed" and not job.sent:
+            raise RuntimeError(f"Failed to send emails: {job.error}")
+        return job.summary()
+
+    def send_emails(self, recipients: list[str], subject: str, html_body_template: str, data: list[dict]):
+        return self.wait_for_job(self.submit_job(recipients, subject, html_body_template, data))
+
+    def stats(self) -> dict:
+        with self._jobs_lock:
+            jobs = list(self._jobs.values())
+        return {
+            "pool_size": self.pool_size,
+            "jobs": {status: sum(job.status == status for job in jobs) for status in ("queued", "running", "completed", "failed", "cancelled")},
+            "rate_limiter": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+        }
 
 
-email_service = EmailService()
\ No newline at end of file
+# Built on first use, so a deployment without email settings still starts.
+get_email_service = LazyService(EmailService)
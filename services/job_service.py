@@ -0,0 +1,224 @@
+# services/job_service.py
+
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+from services.connection_registry import normalize_db_url
+from services.query_pipeline import QueryPipeline
+from services.llm_scheduler import llm_priority, BACKGROUND
+from utils.concurrency import run_blocking
+from utils.models import QueryRequest
+from utils.serialization import dumps
+
+load_dotenv()
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class QueryJob:
+    def __init__(self, request: QueryRequest):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.pipeline = None
+        self.task = None
+        # The encoded response lives either in memory or in a spill file, never both.
+        self.result_bytes = None
+        self.spill_path = None
+        self.result_size = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.pipeline.stage if self.pipeline is not None and not self.finished else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "run_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+            "error": self.error,
+            "result_bytes": self.result_size if self.status == "completed" else None,
+            "result_location": ("disk" if self.spill_path else "memory") if self.status == "completed" else None,
+        }
+
+
+class JobService:
+    def __init__(self):
+        self.max_workers = int(os.getenv("JOB_WORKERS", 4))
+        self.max_per_database = int(os.getenv("JOB_MAX_PER_DATABASE", 2))
+        self.max_queued = int(os.getenv("JOB_MAX_QUEUED", 100))
+        self.retention = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+        self.max_retained = int(os.getenv("JOB_MAX_RETAINED", 1000))
+        self.memory_budget = int(os.getenv("JOB_RESULT_MEMORY_BYTES", 64 * 1024 * 1024))
+        self.spill_dir = os.getenv("JOB_SPILL_DIR") or os.path.join(tempfile.gettempdir(), f"db_automation_jobs_{os.getpid()}")
+
+        self._jobs: OrderedDict[str, QueryJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self._workers = None
+        self._database_limits: dict[str, asyncio.Semaphore] = {}
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0, "spilled": 0}
+
+    def _database_limit(self, db_url: str) -> asyncio.Semaphore:
+        key = normalize_db_url(db_url)
+        if key not in self._database_limits:
+            self._database_limits[key] = asyncio.Semaphore(self.max_per_database)
+        return self._database_limits[key]
+
+    def submit(self, request: QueryRequest) -> QueryJob:
+        self._expire()
+        with self._lock:
+            pending = sum(not job.finished for job in self._jobs.values())
+            if pending >= self.max_queued:
+                self._counters["rejected"] += 1
+                raise JobQueueFullError(f"Too many pending jobs ({pending}). Try again later.")
+            job = QueryJob(request)
+            self._jobs[job.id] = job
+            self._counters["submitted"] += 1
+        if self._workers is None:
+            self._workers = asyncio.Semaphore(self.max_workers)
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: QueryJob):
+        try:
+            # The database slot is taken first, so a job waiting on a busy database does not
+            # hold one of the workers that jobs for other databases could use.
+            async with self._database_limit(job.request.database_url), self._workers:
+                job.status = "running"
+                job.started_at = time.time()
+                job.pipeline = QueryPipeline(job.request)
+                # Nobody is waiting on the response, so interactive queries go first for Gemini capacity.
+                with llm_priority(BACKGROUND):
+                    response = await job.pipeline.run()
+            # Encoding and spilling a large result is blocking work; keep it off the event loop.
+            await run_blocking(self._store_result, job, response)
+            self._finish(job, "completed")
+        except asyncio.CancelledError:
+            self._finish(job, "cancelled", "The job was cancelled.")
+        except Exception as e:
+            self._finish(job, "failed", str(e))
+        finally:
+            job.pipeline = None
+
+    def _finish(self, job: QueryJob, status: str, error: str | None = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.request = None
+        with self._lock:
+            self._counters[status] += 1
+
+    def _store_result(self, job: QueryJob, response: dict):
+        payload = dumps(response)
+        job.result_size = len(payload)
+        with self._lock:
+            job.result_bytes = payload
+            self._memory_bytes += len(payload)
+            # Oldest results go to disk first; a result larger than the whole budget goes straight there.
+            while self._memory_bytes > self.memory_budget:
+                victim = next((other for other in self._jobs.values() if other.result_bytes is not None), None)
+                if victim is None:
+                    break
+                self._spill_locked(victim)
+
+    def _spill_locked(self, job: QueryJob):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{job.id}.json.gz")
+        with gzip.open(path, "wb", compresslevel=1) as spill_file:
+            spill_file.write(job.result_bytes)
+        self._memory_bytes -= len(job.result_bytes)
+        job.result_bytes = None
+        job.spill_path = path
+        self._counters["spilled"] += 1
+
+    def _discard_locked(self, job: QueryJob):
+        if job.result_bytes is not None:
+            self._memory_bytes -= len(job.result_bytes)
+            job.result_bytes = None
+        if job.spill_path:
+            try:
+                os.remove(job.spill_path)
+            except FileNotFoundError:
+                pass
+            job.spill_path = None
+        self._jobs.pop(job.id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished]
+            overflow = max(0, len(self._jobs) - self.max_retained)
+            for i, job in enumerate(finished):
+                if i < overflow or job.finished_at < cutoff:
+                    self._discard_locked(job)
+
+    def get(self, job_id: str) -> QueryJob | None:
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> QueryJob | None:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.pipeline is not None:
+            job.pipeline.interrupt_database_work()
+        job.task.cancel()
+        return job
+
+    def result(self, job: QueryJob) -> bytes:
+        with self._lock:
+            if job.result_bytes is not None:
+                return job.result_bytes
+            spill_path = job.spill_path
+        if spill_path is None:
+            raise FileNotFoundError("The job result is no longer available.")
+        with gzip.open(spill_path, "rb") as spill_file:
+            return spill_file.read()
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            return {
+                **self._counters,
+                "queued": sum(job.status == "queued" for job in jobs),
+                "running": sum(job.status == "running" for job in jobs),
+                "retained": len(jobs),
+                "results_in_memory_bytes": self._memory_bytes,
+                "results_on_disk": sum(job.spill_path is not None for job in jobs),
+                "memory_budget_bytes": self.memory_budget,
+                "max_workers": self.max_workers,
+                "max_per_database": self.max_per_database,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if not job.finished and job.task is not None:
+                if job.pipeline is not None:
+                    job.pipeline.interrupt_database_work()
+                job.task.cancel()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+job_service = JobService()
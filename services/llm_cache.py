@@ -0,0 +1,236 @@
+# services/llm_cache.py
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Only whitespace is collapsed: case and punctuation can be part of a literal ('ACME' vs 'acme').
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+
+class _LeaderGone(Exception):
+    # The call that was computing a response was cancelled or timed out. Its followers belong to
+    # other requests, so they compute the response themselves instead of failing with it.
+    pass
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LLMResponseCache:
+    def __init__(self):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 512))
+        self.ttl = int(os.getenv("LLM_CACHE_TTL_SECONDS", 3600))
+        self.persist_path = os.getenv("LLM_CACHE_PATH")
+
+        # key -> (response, created_at, latency_ms of the call that produced it)
+        self._entries: OrderedDict[str, tuple[str, float, float]] = OrderedDict()
+        self._in_flight: dict[str, _InFlight] = {}
+        self._async_in_flight: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+        self._saved_ms = 0.0
+
+        self._db = None
+        if self.enabled and self.persist_path:
+            self._db = sqlite3.connect(self.persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, response TEXT, created_at REAL, latency_ms REAL)"
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(prompt_template: str, kwargs: dict) -> str:
+        # The template text identifies the call site; every other argument (schema,
+        # dialect, result data) is hashed verbatim, so a schema change yields a new key.
+        parts = {
+            "template": hashlib.sha256(prompt_template.encode()).hexdigest(),
+            "kwargs": {
+                name: normalize_prompt(value) if name == "prompt" else value
+                for name, value in sorted(kwargs.items())
+            },
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_or_compute(self, key: str, compute) -> str:
+        if not self.enabled:
+            return compute()
+
+        while True:
+            with self._lock:
+                cached = self._lookup_locked(key)
+                if cached is not None:
+                    return cached
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    in_flight = self._in_flight[key] = _InFlight()
+                    self._counters["misses"] += 1
+                    break
+                self._counters["coalesced"] += 1
+
+            in_flight.done.wait()
+            if isinstance(in_flight.error, _LeaderGone):
+                continue
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        started = time.perf_counter()
+        try:
+            value = compute()
+        except Exception as e:
+            in_flight.error = e
+            raise
+        except BaseException:
+            in_flight.error = _LeaderGone()
+            raise
+        else:
+            in_flight.value = value
+            self._store(key, value, (time.perf_counter() - started) * 1000)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    async def aget_or_compute(self, key: str, compute) -> str:
+        # Same contract as get_or_compute, but `compute` returns an awaitable and waiting
+        # callers park on a future instead of blocking the event loop.
+        if not self.enabled:
+            return await compute()
+
+        while True:
+            with self._lock:
+                cached = self._lookup_locked(key)
+                if cached is not None:
+                    return cached
+                future = self._async_in_flight.get(key)
+                if future is None:
+                    future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+                    self._counters["misses"] += 1
+                    break
+                self._counters["coalesced"] += 1
+
+            try:
+                return await asyncio.shield(future)
+            except _LeaderGone:
+                continue
+
+        started = time.perf_counter()
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            # Not future.cancel(): a CancelledError would escape the followers' error handling.
+            future.set_exception(_LeaderGone())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value, (time.perf_counter() - started) * 1000)
+            return value
+        finally:
+            with self._lock:
+                self._async_in_flight.pop(key, None)
+
+    def _lookup_locked(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[1] >= self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            self._saved_ms += entry[2]
+            return entry[0]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT response, created_at, latency_ms FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+            if row is not None:
+                self._remember_locked(key, row)
+                self._counters["disk_hits"] += 1
+                self._saved_ms += row[2]
+                return row[0]
+        return None
+
+    def _remember_locked(self, key: str, entry: tuple[str, float, float]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store(self, key: str, value: str, latency_ms: float):
+        entry = (value, time.time(), latency_ms)
+        with self._lock:
+            self._remember_locked(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, *entry))
+                self._db.commit()
+
+    def get(self, key: str) -> str | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._lookup_locked(key)
+            if value is None:
+                self._counters["misses"] += 1
+            return value
+
+    def put(self, key: str, value: str, latency_ms: float):
+        if self.enabled:
+            self._store(key, value, latency_ms)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+            saved_ms = self._saved_ms
+        served = counters["hits"] + counters["disk_hits"]
+        lookups = served + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hit_ratio": round(served / lookups, 3) if lookups else 0.0,
+            "saved_latency_ms": round(saved_ms, 1),
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self._db is not None,
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,422 @@
+# services/llm_scheduler.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+from utils.rate_limiter import TokenBucket
+from utils.telemetry import (
+    get_logger, current_span, LLM_QUEUE_DEPTH, LLM_IN_FLIGHT, LLM_QUEUE_WAIT, LLM_RETRIES, LLM_REJECTED,
+    LLM_PROMPT_TRUNCATIONS,
+)
+from utils.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+load_dotenv()
+
+log = get_logger("llm_scheduler")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+_PRIORITY_RANK = {INTERACTIVE: 0, BACKGROUND: 1}
+# Reports and email copy are not on the path to the query result, so they yield to generation.
+BACKGROUND_TEMPLATES = {"report_generation", "email_generation"}
+
+# Identify quota, overload and timeout errors in exceptions whose types we cannot import without
+# pulling in the Gemini client. A status code only counts where it reads as one: leading the
+# message ("429 Resource has been exhausted") or after "status"/"code"/"HTTP", never a bare
+# number such as a row count.
+_TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+_TRANSIENT_MESSAGE_RE = re.compile(
+    r"^\W*(?:429|500|502|503|504)\b|\b(?:status|code|http(?:/[\d.]+)?)\W{0,3}(?:429|500|502|503|504)\b"
+    r"|resource.exhausted|quota|rate limit|unavailable|overloaded|deadline exceeded|timed out|timeout|internal error",
+    re.IGNORECASE
+)
+_TRANSIENT_TYPES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded",
+    "GatewayTimeout", "BadGateway", "Aborted",
+}
+
+TRUNCATION_MARKER = "\n... [truncated to fit the prompt budget]"
+# Prompt arguments that hold reference data and can lose their tail. The question, the batch
+# requests, a previous query and its feedback are always sent whole.
+TRUNCATABLE_ARGUMENTS = ("schema", "result_digest", "query_result")
+
+_priority = contextvars.ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def llm_priority(priority: str):
+    # Every LLM call made inside the block, including from tasks it starts, uses this priority.
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMOverloadedError(RuntimeError):
+    pass
+
+
+class LLMUnavailableError(RuntimeError):
+    pass
+
+
+class PromptTooLargeError(ValueError):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in _TRANSIENT_TYPES:
+        return True
+    # google-api-core errors carry the HTTP status as `code`, HTTP clients as `status_code` on the
+    # error or its response.
+    response = getattr(error, "response", None)
+    for code in (getattr(error, "code", None), getattr(error, "status_code", None),
+                 getattr(response, "status_code", None)):
+        if isinstance(code, int) and not isinstance(code, bool):
+            return code in _TRANSIENT_STATUSES
+    return bool(_TRANSIENT_MESSAGE_RE.search(str(error)))
+
+
+class _Ticket:
+    __slots__ = ("priority", "wake", "granted", "abandoned")
+
+    def __init__(self, priority: str, wake):
+        self.priority = priority
+        self.wake = wake
+        self.granted = False
+        self.abandoned = False
+
+
+class _Call:
+    __slots__ = ("template", "priority", "queued_at", "deadline", "attempts")
+
+    def __init__(self, template: str, priority: str, deadline_seconds: float):
+        self.template = template
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.deadline = self.queued_at + deadline_seconds
+        self.attempts = 0
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class LLMScheduler:
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+        self.max_queue = int(os.getenv("LLM_MAX_QUEUE", 200))
+        self.call_timeout = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", 60))
+        self.deadlines = {
+            INTERACTIVE: float(os.getenv("LLM_DEADLINE_INTERACTIVE_SECONDS", 90)),
+            BACKGROUND: float(os.getenv("LLM_DEADLINE_BACKGROUND_SECONDS", 300)),
+        }
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 3))
+        self.retry_base = float(os.getenv("LLM_RETRY_BASE_SECONDS", 1))
+        self.retry_max = float(os.getenv("LLM_RETRY_MAX_SECONDS", 20))
+        self.max_prompt_tokens = int(os.getenv("LLM_MAX_PROMPT_TOKENS", 100000))
+        self.oversized_prompts = os.getenv("LLM_OVERSIZED_PROMPTS", "truncate").lower()
+        # Output tokens count against the per-minute token quota too, but are only known afterwards.
+        self.expected_output_tokens = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 1000))
+
+        # Both quotas are per API key, so one pair of buckets covers every call of the process.
+        rpm = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 60))
+        tpm = float(os.getenv("LLM_TOKENS_PER_MINUTE", 1000000))
+        burst = float(os.getenv("LLM_REQUEST_BURST", max(1.0, rpm / 6)))
+        self.request_bucket = TokenBucket(rpm / 60, burst) if rpm > 0 else None
+        self.token_bucket = TokenBucket(tpm / 60, tpm) if tpm > 0 else None
+
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "scheduled": 0, "completed": 0, "failed": 0, "retries": 0, "rejected_queue_full": 0,
+            "deadline_exceeded": 0, "prompts_truncated": 0, "prompts_rejected": 0,
+        }
+        self._admissions = 0
+        self._waited_total = 0.0
+        self._waited_max = 0.0
+
+    def priority_for(self, template: str) -> str:
+        return _priority.get() or (BACKGROUND if template in BACKGROUND_TEMPLATES else INTERACTIVE)
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    # --- Prompt budget -------------------------------------------------------------------
+
+    def fit_prompt(self, prompt_template: str, kwargs: dict, template: str) -> str:
+        # Formats the prompt and keeps it within LLM_MAX_PROMPT_TOKENS. Truncation shortens the
+        # largest of the TRUNCATABLE_ARGUMENTS, largest first.
+        prompt = prompt_template.format(**kwargs)
+        tokens = estimate_tokens(prompt)
+        if self.max_prompt_tokens <= 0 or tokens <= self.max_prompt_tokens:
+            return prompt
+
+        if self.oversized_prompts == "truncate":
+            excess = (tokens - self.max_prompt_tokens) * CHARS_PER_TOKEN
+            fitted = dict(kwargs)
+            candidates = sorted(
+                (name for name in TRUNCATABLE_ARGUMENTS if isinstance(kwargs.get(name), str)),
+                key=lambda name: -len(kwargs[name])
+            )
+            for name in candidates:
+                value = fitted[name]
+                cut = min(len(value), excess + len(TRUNCATION_MARKER))
+                fitted[name] = value[:len(value) - cut] + TRUNCATION_MARKER
+                excess -= cut - len(TRUNCATION_MARKER)
+                if excess <= 0:
+                    break
+            truncated = prompt_template.format(**fitted)
+            if estimate_tokens(truncated) <= self.max_prompt_tokens:
+                self._count("prompts_truncated")
+                LLM_PROMPT_TRUNCATIONS.inc(template=template)
+                log.warning("Prompt truncated to fit the token budget", template=template, tokens=tokens,
+                            max_tokens=self.max_prompt_tokens)
+                return truncated
+
+        self._count("prompts_rejected")
+        LLM_REJECTED.inc(reason="prompt_too_large")
+        raise PromptTooLargeError(
+            f"The {template} prompt is about {tokens} tokens, over the limit of {self.max_prompt_tokens}. "
+            "Narrow the request or the database schema."
+        )
+
+    # --- Slots ---------------------------------------------------------------------------
+
+    def _enqueue(self, priority: str, wake) -> _Ticket:
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self._counters["rejected_queue_full"] += 1
+                LLM_REJECTED.inc(reason="queue_full")
+                raise LLMOverloadedError(
+                    f"Too many Gemini calls are waiting ({len(self._queue)}); try again shortly."
+                )
+            ticket = _Ticket(priority, wake)
+            self._counters["scheduled"] += 1
+            heapq.heappush(self._queue, (_PRIORITY_RANK[priority], next(self._sequence), ticket))
+            LLM_QUEUE_DEPTH.inc(priority=priority)
+            self._dispatch_locked()
+        return ticket
+
+    def _dispatch_locked(self):
+        # Slots go to the highest priority first and in arrival order within a priority.
+        while self._queue and self._active < self.max_concurrency:
+            _, _, ticket = heapq.heappop(self._queue)
+            LLM_QUEUE_DEPTH.dec(priority=ticket.priority)
+            if ticket.abandoned:
+                continue
+            ticket.granted = True
+            self._active += 1
+            LLM_IN_FLIGHT.inc()
+            ticket.wake()
+
+    def _release(self, ticket: _Ticket):
+        # Frees the slot of a granted ticket, or takes a waiting one out of the queue.
+        with self._lock:
+            if ticket.granted:
+                ticket.granted = False
+                self._active -= 1
+                LLM_IN_FLIGHT.dec()
+                self._dispatch_locked()
+            elif not ticket.abandoned:
+                ticket.abandoned = True
+                self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+                heapq.heapify(self._queue)
+                LLM_QUEUE_DEPTH.dec(priority=ticket.priority)
+
+    def _new_call(self, template: str) -> _Call:
+        priority = self.priority_for(template)
+        return _Call(template, priority, self.deadlines[priority])
+
+    def _started(self, call: _Call):
+        # The wait covers the queue and the first rate-limit delay, i.e. everything before Gemini is asked.
+        waited = time.monotonic() - call.queued_at
+        with self._lock:
+            self._admissions += 1
+            self._waited_total += waited
+            self._waited_max = max(self._waited_max, waited)
+        LLM_QUEUE_WAIT.observe(waited, priority=call.priority)
+        current = current_span()
+        if current is not None:
+            current.set(priority=call.priority, queue_wait_ms=round(waited * 1000, 1))
+
+    def _deadline_exceeded(self, call: _Call) -> TimeoutError:
+        self._count("deadline_exceeded")
+        LLM_REJECTED.inc(reason="deadline")
+        return TimeoutError(
+            f"The {call.template} call to Gemini did not finish within its "
+            f"{self.deadlines[call.priority]:g} second deadline."
+        )
+
+    @contextmanager
+    def _slot(self, template: str):
+        call = self._new_call(template)
+        granted = threading.Event()
+        ticket = self._enqueue(call.priority, granted.set)
+        try:
+            if not granted.wait(timeout=call.remaining):
+                raise self._deadline_exceeded(call)
+            yield call
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def _aslot(self, template: str):
+        call = self._new_call(template)
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        # Slots can be freed from worker threads, so the event is set on its own loop.
+        ticket = self._enqueue(call.priority, lambda: loop.call_soon_threadsafe(granted.set))
+        try:
+            try:
+                await asyncio.wait_for(granted.wait(), timeout=call.remaining)
+            except asyncio.TimeoutError:
+                raise self._deadline_exceeded(call)
+            yield call
+        finally:
+            self._release(ticket)
+
+    # --- Rate limits and retries -----------------------------------------------------------
+
+    def _throttle(self, call: _Call, prompt_tokens: int) -> float:
+        # Reserves one request and the call's tokens, and returns how long to wait for them.
+        # A wait past the deadline takes nothing and fails the call right away: a request already
+        # reserved is given back, so failed calls do not push the bucket into debt.
+        call.attempts += 1
+        remaining = call.remaining
+        request_wait = token_wait = 0.0
+        if self.request_bucket is not None:
+            request_wait = self.request_bucket.reserve(1, remaining)
+            if request_wait is None:
+                raise self._deadline_exceeded(call)
+        if self.token_bucket is not None:
+            token_wait = self.token_bucket.reserve(prompt_tokens + self.expected_output_tokens, remaining)
+            if token_wait is None:
+                if self.request_bucket is not None:
+                    self.request_bucket.refund(1, request_wait)
+                raise self._deadline_exceeded(call)
+        return max(request_wait, token_wait)
+
+    async def _await_turn(self, call: _Call, prompt_tokens: int):
+        wait = self._throttle(call, prompt_tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        if call.attempts == 1:
+            self._started(call)
+
+    def _wait_turn(self, call: _Call, prompt_tokens: int):
+        wait = self._throttle(call, prompt_tokens)
+        if wait:
+            time.sleep(wait)
+        if call.attempts == 1:
+            self._started(call)
+
+    def _retry_delay(self, call: _Call, error: BaseException) -> float:
+        # Full jitter: a uniform delay up to the exponential backoff, so callers that failed
+        # together do not retry together.
+        if not is_transient(error):
+            self._count("failed")
+            raise error
+        if call.attempts > self.max_retries:
+            self._count("failed")
+            detail = str(error) or type(error).__name__
+            raise LLMUnavailableError(
+                f"Gemini is unavailable or over quota after {call.attempts} attempts: {detail}"
+            ) from error
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** (call.attempts - 1)))
+        if delay >= call.remaining:
+            raise self._deadline_exceeded(call) from error
+        self._count("retries")
+        reason = "timeout" if isinstance(error, TimeoutError) else type(error).__name__
+        LLM_RETRIES.inc(template=call.template, reason=reason)
+        log.warning("Retrying Gemini call", template=call.template, attempt=call.attempts, delay_s=round(delay, 2),
+                    error=str(error) or type(error).__name__)
+        return delay
+
+    def _finished(self, call: _Call):
+        self._count("completed")
+        current = current_span()
+        if current is not None:
+            current.set(attempts=call.attempts)
+
+    def run(self, invoke, template: str, prompt_tokens: int):
+        # Blocking variant. A call already in flight cannot be interrupted from here; the client's
+        # own request timeout bounds it.
+        with self._slot(template) as call:
+            while True:
+                self._wait_turn(call, prompt_tokens)
+                try:
+                    result = invoke()
+                except Exception as e:
+                    time.sleep(self._retry_delay(call, e))
+                    continue
+                self._finished(call)
+                return result
+
+    async def arun(self, invoke, template: str, prompt_tokens: int):
+        # `invoke` returns a new awaitable for every attempt.
+        async with self._aslot(template) as call:
+            while True:
+                await self._await_turn(call, prompt_tokens)
+                try:
+                    result = await asyncio.wait_for(invoke(), timeout=min(self.call_timeout, call.remaining))
+                except Exception as e:
+                    await asyncio.sleep(self._retry_delay(call, e))
+                    continue
+                self._finished(call)
+                return result
+
+    async def astream(self, open_stream, template: str, prompt_tokens: int):
+        # Streams hold their slot until the last chunk. Only a failure before the first chunk is
+        # retried; after that the consumer has already received part of the answer.
+        async with self._aslot(template) as call:
+            while True:
+                await self._await_turn(call, prompt_tokens)
+                streaming = False
+                try:
+                    async for chunk in open_stream():
+                        streaming = True
+                        yield chunk
+                except Exception as e:
+                    if streaming:
+                        self._count("failed")
+                        raise
+                    await asyncio.sleep(self._retry_delay(call, e))
+                    continue
+                self._finished(call)
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {priority: 0 for priority in _PRIORITY_RANK}
+            for _, _, ticket in self._queue:
+                if not ticket.abandoned:
+                    queued[ticket.priority] += 1
+            return {
+                **self._counters,
+                "queued": queued,
+                "in_flight": self._active,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "avg_wait_ms": round(self._waited_total / self._admissions * 1000, 1) if self._admissions else 0.0,
+                "max_wait_ms": round(self._waited_max * 1000, 1),
+                "requests_per_minute": self.request_bucket.stats() if self.request_bucket else None,
+                "tokens_per_minute": self.token_bucket.stats() if self.token_bucket else None,
+            }
+
+
+llm_scheduler = LLMScheduler()
@@ -2,13 +2,38 @@
 
 import os
 import json
+import time
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import HumanMessage
+from prompts import prompt_templates
 from utils.models import InitialAnalysisResponse
+from utils.telemetry import span, LLM_REQUEST_DURATION, LLM_TOKENS, LLM_PROMPT_TOKENS
+from utils.tokens import estimate_tokens
+from utils.lazy import LazyService
+from services.llm_cache import llm_cache
+from services.llm_scheduler import llm_scheduler, LLMUnavailableError
 
 load_dotenv()
 
+# Metric label for each prompt template, e.g. "sql_generation".
+_TEMPLATE_NAMES = {
+    value: name.removesuffix("_PROMPT").lower()
+    for name, value in vars(prompt_templates).items() if name.endswith("_PROMPT") and isinstance(value, str)
+}
+
+
+def _template_name(prompt_template: str) -> str:
+    return _TEMPLATE_NAMES.get(prompt_template, "other")
+
+
+def _record_call(template: str, prompt: str, response: str | None, seconds: float) -> dict:
+    # Token counts are estimates; Gemini's own counts are not exposed through langchain here.
+    tokens = {"tokens_in": estimate_tokens(prompt), "tokens_out": estimate_tokens(response or "")}
+    LLM_TOKENS.inc(tokens["tokens_in"], template=template, direction="in")
+    LLM_TOKENS.inc(tokens["tokens_out"], template=template, direction="out")
+    LLM_PROMPT_TOKENS.observe(tokens["tokens_in"], template=template)
+    LLM_REQUEST_DURATION.observe(seconds, template=template, status="ok" if response is not None else "error")
+    return tokens
+
 
 class LLMService:
     def __init__(self):
@@ -16,45 +41,157 @@ class LLMService:
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
+        # langchain and the Gemini client take a while to import; they load with the first LLM call.
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from langchain.schema import HumanMessage
+
+        self._message = HumanMessage
         self.model = ChatGoogleGenerativeAI(
             model="gemini-1.5-flash",
             google_api_key=self.api_key,
             temperature=0.1,
-            convert_system_message_to_human=True
+            convert_system_message_to_human=True,
+            # Retries, backoff and deadlines are handled by the LLM scheduler.
+            max_retries=1,
+            timeout=llm_scheduler.call_timeout
         )
 
-    def _invoke_model(self, prompt: str) -> str:
-        try:
-            response = self.model([HumanMessage(content=prompt)])
-            return response.content.strip()
-        except Exception as e:
-            raise RuntimeError(f"Error invoking Gemini API: {e}")
+    def _invoke_model(self, prompt: str, template: str = "other") -> str:
+        with span("llm", template=template) as current:
+            content = None
+            try:
+                response = llm_scheduler.run(
+                    lambda: self.model([self._message(content=prompt)]), template, estimate_tokens(prompt)
+                )
+                content = response.content.strip()
+                return content
+            except (TimeoutError, LLMUnavailableError):
+                raise
+            except Exception as e:
+                raise RuntimeError(f"Error invoking Gemini API: {e}")
+            finally:
+                current.set(**_record_call(template, prompt, content, current.elapsed_ms / 1000))
 
-    def get_initial_analysis(self, prompt_template: str, user_prompt: str, db_url: str) -> InitialAnalysisResponse:
-        formatted_prompt = prompt_template.format(prompt=user_prompt, database_url=db_url)
-        response_str = self._invoke_model(formatted_prompt)
+    async def _ainvoke_model(self, prompt: str, template: str = "other") -> str:
+        with span("llm", template=template) as current:
+            content = None
+            try:
+                response = await llm_scheduler.arun(
+                    lambda: self.model.ainvoke([self._message(content=prompt)]), template, estimate_tokens(prompt)
+                )
+                content = response.content.strip()
+                return content
+            except (TimeoutError, LLMUnavailableError):
+                raise
+            except Exception as e:
+                raise RuntimeError(f"Error invoking Gemini API: {e}")
+            finally:
+                current.set(**_record_call(template, prompt, content, current.elapsed_ms / 1000))
+
+    def _invoke_cached(self, cache_key: str | None, formatted_prompt: str, template: str = "other") -> str:
+        if cache_key is None:
+            return self._invoke_model(formatted_prompt, template)
+        return llm_cache.get_or_compute(cache_key, lambda: self._invoke_model(formatted_prompt, template))
+
+    async def _ainvoke_cached(self, cache_key: str | None, formatted_prompt: str, template: str = "other") -> str:
+        if cache_key is None:
+            return await self._ainvoke_model(formatted_prompt, template)
+        return await llm_cache.aget_or_compute(cache_key, lambda: self._ainvoke_model(formatted_prompt, template))
+
+    @staticmethod
+    def _format(prompt_template: str, kwargs: dict) -> str:
+        return llm_scheduler.fit_prompt(prompt_template, kwargs, _template_name(prompt_template))
+
+    @staticmethod
+    def _parse_initial_analysis(response_str: str, cache_key: str) -> InitialAnalysisResponse:
         try:
             cleaned_response = response_str.strip().replace("```json", "").replace("```", "")
             response_json = json.loads(cleaned_response)
             return InitialAnalysisResponse(**response_json)
         except (json.JSONDecodeError, TypeError) as e:
+            # Don't keep serving a response we could not parse.
+            llm_cache.discard(cache_key)
             raise ValueError(f"Failed to parse initial analysis from LLM: {e}. Response: {response_str}")
 
-    def generate_json_response(self, prompt_template: str, **kwargs) -> dict:
-        formatted_prompt = prompt_template.format(**kwargs)
-        response_str = self._invoke_model(formatted_prompt)
+    @staticmethod
+    def _parse_json(response_str: str, cache_key: str | None) -> dict:
         try:
             cleaned_response = response_str.strip().replace("```json", "").replace("```", "")
             return json.loads(cleaned_response)
         except (json.JSONDecodeError, TypeError) as e:
+            if cache_key:
+                llm_cache.discard(cache_key)
             raise ValueError(f"Failed to parse JSON from LLM: {e}. Response: {response_str}")
 
-    def generate_text_response(self, prompt_template: str, **kwargs) -> str:
-        formatted_prompt = prompt_template.format(**kwargs)
-        response_str = self._invoke_model(formatted_prompt)
+    @staticmethod
+    def clean_text(response_str: str) -> str:
         # Clean potential markdown code blocks for SQL and reports
-        cleaned_response = response_str.strip().replace("```sql", "").replace("```markdown", "").replace("```", "")
-        return cleaned_response
+        return response_str.strip().replace("```sql", "").replace("```markdown", "").replace("```", "")
+
+    def get_initial_analysis(self, prompt_template: str, user_prompt: str, db_url: str) -> InitialAnalysisResponse:
+        kwargs = {"prompt": user_prompt, "database_url": db_url}
+        cache_key = llm_cache.make_key(prompt_template, kwargs)
+        response_str = self._invoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self._parse_initial_analysis(response_str, cache_key)
+
+    async def aget_initial_analysis(self, prompt_template: str, user_prompt: str, db_url: str) -> InitialAnalysisResponse:
+        kwargs = {"prompt": user_prompt, "database_url": db_url}
+        cache_key = llm_cache.make_key(prompt_template, kwargs)
+        response_str = await self._ainvoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self._parse_initial_analysis(response_str, cache_key)
+
+    def generate_json_response(self, prompt_template: str, use_cache: bool = True, **kwargs) -> dict:
+        cache_key = llm_cache.make_key(prompt_template, kwargs) if use_cache else None
+        response_str = self._invoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self._parse_json(response_str, cache_key)
+
+    async def agenerate_json_response(self, prompt_template: str, use_cache: bool = True, **kwargs) -> dict:
+        cache_key = llm_cache.make_key(prompt_template, kwargs) if use_cache else None
+        response_str = await self._ainvoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self._parse_json(response_str, cache_key)
+
+    def generate_text_response(self, prompt_template: str, use_cache: bool = True, **kwargs) -> str:
+        cache_key = llm_cache.make_key(prompt_template, kwargs) if use_cache else None
+        response_str = self._invoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self.clean_text(response_str)
+
+    async def agenerate_text_response(self, prompt_template: str, use_cache: bool = True, **kwargs) -> str:
+        cache_key = llm_cache.make_key(prompt_template, kwargs) if use_cache else None
+        response_str = await self._ainvoke_cached(cache_key, self._format(prompt_template, kwargs), _template_name(prompt_template))
+        return self.clean_text(response_str)
+
+    async def astream_text_response(self, prompt_template: str, use_cache: bool = True, **kwargs):
+        # Yields the response as Gemini produces it. A cached response is yielded in one piece,
+        # and a fully streamed one is cached for the next caller.
+        cache_key = llm_cache.make_key(prompt_template, kwargs) if use_cache else None
+        cached = llm_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            yield self.clean_text(cached)
+            return
+
+        started = time.perf_counter()
+        template = _template_name(prompt_template)
+        prompt = self._format(prompt_template, kwargs)
+        chunks = []
+        status = "error"
+        try:
+            async for chunk in llm_scheduler.astream(
+                lambda: self.model.astream([self._message(content=prompt)]), template, estimate_tokens(prompt)
+            ):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content.replace("```markdown", "").replace("```", "")
+            status = "ok"
+        except (TimeoutError, LLMUnavailableError):
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error invoking Gemini API: {e}")
+        finally:
+            # No span here: a generator is resumed by its consumer, so it cannot own the current span.
+            _record_call(template, prompt, "".join(chunks) if status == "ok" else None, time.perf_counter() - started)
+        if cache_key:
+            llm_cache.put(cache_key, "".join(chunks).strip(), (time.perf_counter() - started) * 1000)
 
 
-llm_service = LLMService()
\ No newline at end of file
+# Built on first use; see utils/lazy.py.
+get_llm_service = LazyService(LLMService)
\ No newline at end of file
@@ -0,0 +1,252 @@
+# services/query_guard.py
+
+import json
+import os
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from services import db_service
+from services.connection_registry import connection_registry
+from utils.telemetry import get_logger, QUERY_GUARD_FAILURES
+
+load_dotenv()
+
+log = get_logger("query_guard")
+
+_JOIN_NODES = ("Nested Loop", "Hash Join", "Merge Join")
+
+
+def _pg_plan(connection, statement: str) -> dict:
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    scans, joins = [], []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan":
+            scans.append({"table": node.get("Relation Name"), "filtered": "Filter" in node})
+        elif node.get("Node Type") in _JOIN_NODES:
+            joins.append({"type": node["Node Type"], "rows": node.get("Plan Rows", 0)})
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(root)
+    if scans:
+        # Plan Rows of a filtered scan is its output; the table size is what the scan reads.
+        sizes = dict(connection.execute(
+            text("SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(:names)"),
+            {"names": list({scan["table"] for scan in scans})}
+        ).all())
+        for scan in scans:
+            scan["rows"] = max(int(sizes.get(scan["table"], 0)), 0)
+    return {
+        "engine": "postgresql",
+        "total_cost": root.get("Total Cost"),
+        "estimated_rows": root.get("Plan Rows"),
+        "full_scans": scans,
+        "joins": joins,
+    }
+
+
+def _mysql_plan(connection, statement: str) -> dict:
+    plan = json.loads(connection.execute(text(f"EXPLAIN FORMAT=JSON {statement}")).scalar())
+    block = plan.get("query_block", {})
+    scans, joins = [], []
+
+    def walk(value):
+        if isinstance(value, dict):
+            table = value.get("table")
+            if isinstance(table, dict) and "table_name" in table:
+                produced = int(table.get("rows_produced_per_join") or 0)
+                if table.get("access_type") == "ALL":
+                    scans.append({
+                        "table": table["table_name"],
+                        "rows": int(table.get("rows_examined_per_scan") or 0),
+                        "filtered": "attached_condition" in table,
+                    })
+                joins.append({"type": "join", "table": table["table_name"], "rows": produced})
+            for child in value.values():
+                walk(child)
+        elif isinstance(value, list):
+            for child in value:
+                walk(child)
+
+    walk(block)
+    return {
+        "engine": "mysql",
+        "total_cost": float(block.get("cost_info", {}).get("query_cost", 0) or 0),
+        "estimated_rows": max((join["rows"] for join in joins), default=None),
+        "full_scans": scans,
+        # A single-table plan is not a join; only report the joined tables.
+        "joins": joins if len(joins) > 1 else [],
+    }
+
+
+def _generic_plan(connection, statement: str) -> dict:
+    # SQLite and others: no cost model, but the plan still shows which tables are scanned.
+    details = [row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {statement}")).all()]
+    scans = []
+    for detail in details:
+        # "SCAN b" on current SQLite, "SCAN TABLE b" on older versions.
+        words = [word for word in detail.split() if word != "TABLE"]
+        if words[0] == "SCAN" and len(words) > 1:
+            scans.append({"table": words[1], "rows": None, "filtered": None})
+    return {"engine": connection.dialect.name, "total_cost": None, "estimated_rows": None,
+            "full_scans": scans, "joins": [], "steps": details}
+
+
+_PLANNERS = {"postgresql": _pg_plan, "mysql": _mysql_plan}
+
+
+class QueryGuard:
+    def __init__(self):
+        self.enabled = os.getenv("QUERY_GUARD_ENABLED", "true").lower() == "true"
+        # "enforce" rejects expensive queries; "report" only attaches the plan to the response.
+        self.mode = os.getenv("QUERY_GUARD_MODE", "enforce").lower()
+        self.max_cost = float(os.getenv("QUERY_GUARD_MAX_COST", 1_000_000))
+        self.max_join_rows = int(os.getenv("QUERY_GUARD_MAX_JOIN_ROWS", 10_000_000))
+        # Filtering a table larger than this without an index is rejected.
+        self.full_scan_rows = int(os.getenv("QUERY_GUARD_FULL_SCAN_ROWS", 1_000_000))
+        self.statement_timeout = float(os.getenv("QUERY_GUARD_STATEMENT_TIMEOUT_SECONDS", 30))
+
+    def _violations(self, plan: dict) -> list[str]:
+        violations = []
+        if plan.get("total_cost") is not None and plan["total_cost"] > self.max_cost:
+            violations.append(f"estimated cost {plan['total_cost']:,.0f} exceeds the limit of {self.max_cost:,.0f}")
+        for join in plan.get("joins", []):
+            if join["rows"] > self.max_join_rows:
+                violations.append(
+                    f"a join produces about {join['rows']:,} rows (limit {self.max_join_rows:,}); "
+                    f"this usually means a missing join condition"
+                )
+                break
+        for scan in plan.get("full_scans", []):
+            if scan.get("filtered") and (scan.get("rows") or 0) > self.full_scan_rows:
+                violations.append(
+                    f"'{scan['table']}' (about {scan['rows']:,} rows) is filtered without an index; "
+                    f"filter on an indexed column instead"
+                )
+        return violations
+
+    def _sql_indexes(self, engine, tables: list[str]) -> dict:
+        inspector = inspect(engine)
+        indexes = {}
+        for table in tables:
+            try:
+                columns = [column for index in inspector.get_indexes(table) for column in index["column_names"] if column]
+                primary = inspector.get_pk_constraint(table).get("constrained_columns", [])
+                indexes[table] = sorted(set(primary + columns))
+            except Exception:
+                continue
+        return indexes
+
+    def check_sql(self, db_url: str, query: str, row_limit: int) -> dict:
+        statement = db_service._clean_statement(query)
+        # Plan the statement the way it will run: row-returning queries get the same LIMIT that
+        # execution appends, so the estimate reflects the capped query.
+        limited = None
+        if db_service._ROW_RETURNING_RE.match(statement):
+            limited = db_service.limit_statement(statement, int(row_limit) + 1)
+        if limited is not None:
+            statement = limited
+        with connection_registry.lease_engine(db_url) as engine:
+            planner = _PLANNERS.get(engine.dialect.name, _generic_plan)
+            with engine.connect() as connection:
+                plan = planner(connection, statement)
+            plan["limit_applied"] = int(row_limit) if limited is not None else None
+            violations = self._violations(plan)
+            tables = sorted({scan["table"] for scan in plan["full_scans"]})
+            return self._verdict(plan, violations, lambda: self._sql_indexes(engine, tables))
+
+    def check_nosql(self, db_url: str, query: dict, row_limit: int) -> dict:
+        query = db_service.normalize_nosql_query(query)
+        with db_service._mongo_database(db_url) as database:
+            return self._check_collection(database[query["collection"]], query, row_limit)
+
+    def _check_collection(self, collection, query: dict, row_limit: int) -> dict:
+        name = query["collection"]
+        if "pipeline" in query:
+            command = {"aggregate": name, "pipeline": query["pipeline"] + [{"$limit": int(row_limit) + 1}], "cursor": {}}
+        else:
+            command = {"find": name, "filter": query["query"], "limit": min(int(row_limit) + 1, query["limit"] or row_limit + 1)}
+            if query["projection"]:
+                command["projection"] = query["projection"]
+            if query["sort"]:
+                command["sort"] = dict(query["sort"])
+        explained = collection.database.command({"explain": command, "verbosity": "queryPlanner"})
+        stages = []
+
+        def walk(stage):
+            stages.append(stage)
+            for child in [stage.get("inputStage"), *stage.get("inputStages", [])]:
+                if child:
+                    walk(child)
+
+        def find_plans(value):
+            # Aggregations nest the planner output under their $cursor stage; finds have it at the top.
+            if isinstance(value, dict):
+                if "winningPlan" in value:
+                    winning = value["winningPlan"]
+                    walk(winning.get("queryPlan", winning))
+                for item in value.values():
+                    find_plans(item)
+            elif isinstance(value, list):
+                for item in value:
+                    find_plans(item)
+
+        find_plans(explained)
+        scans = []
+        if any(stage.get("stage") == "COLLSCAN" for stage in stages):
+            scans.append({
+                "table": name,
+                "rows": collection.estimated_document_count(),
+                "filtered": any(stage.get("stage") == "COLLSCAN" and stage.get("filter") for stage in stages),
+            })
+        plan = {
+            "engine": "mongodb",
+            "total_cost": None,
+            "estimated_rows": None,
+            "stages": [stage.get("stage") for stage in stages],
+            "full_scans": scans,
+            "joins": [],
+            "limit_applied": int(row_limit),
+        }
+        indexes = lambda: {
+            name: sorted({key for index in collection.index_information().values() for key, _ in index["key"]})
+        }
+        return self._verdict(plan, self._violations(plan), indexes)
+
+    def _verdict(self, plan: dict, violations: list[str], indexes) -> dict:
+        rejected = bool(violations) and self.mode == "enforce"
+        feedback = None
+        if violations:
+            plan["violations"] = violations
+            hints = indexes()
+            feedback = "The previous query was rejected as too expensive: " + "; ".join(violations) + "."
+            if hints:
+                feedback += " Indexed columns: " + "; ".join(
+                    f"{table}({', '.join(columns)})" for table, columns in hints.items() if columns
+                ) + "."
+        return {"allowed": not rejected, "plan": plan, "feedback": feedback}
+
+    def check(self, db_url: str, db_type: str, generated_query, row_limit: int) -> dict | None:
+        # Returns None when the guard is off. A query that cannot be explained is let through, since
+        # it will usually fail at execution with the database's own error message, but the plan
+        # reports why it went unchecked.
+        if not self.enabled:
+            return None
+        try:
+            if db_type == 'sql':
+                return self.check_sql(db_url, generated_query, row_limit)
+            return self.check_nosql(db_url, generated_query, row_limit)
+        except Exception as e:
+            QUERY_GUARD_FAILURES.inc(db_type=db_type, reason="error")
+            log.warning("Query guard could not explain the query; executing it unchecked", error=str(e))
+            return self.unchecked(f"The query could not be explained: {e}")
+
+    @staticmethod
+    def unchecked(reason: str) -> dict:
+        return {"allowed": True, "plan": {"checked": False, "error": reason}, "feedback": None}
+
+
+query_guard = QueryGuard()
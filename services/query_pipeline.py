@@ -0,0 +1,678 @@
+# services/query_pipeline.py
+
+import asyncio
+import functools
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dotenv import load_dotenv
+from services.llm_service import get_llm_service
+from services.llm_cache import llm_cache
+from services import db_service
+from services.schema_cache import schema_cache
+from services.analysis_service import analysis_service
+from services.schema_index import prune_schema
+from services.email_service import get_email_service
+from services.connection_registry import normalize_db_url
+from services.query_guard import query_guard
+from services.result_cache import result_cache
+from prompts import prompt_templates
+from utils.concurrency import run_blocking, with_timeout
+from utils.models import QueryRequest, PageRequest
+from utils.serialization import dumps_text, format_result
+from utils.pagination import encode_page_token, decode_page_token, database_fingerprint
+from utils.telemetry import get_logger, span, current_span, observe_stage, RESULT_ROWS, QUERY_GUARD_FAILURES
+
+load_dotenv()
+
+log = get_logger("query_pipeline")
+
+# Per-stage deadlines in seconds. Post-query tools time out individually, so a slow report
+# does not discard a finished visualization.
+STAGE_TIMEOUTS = {
+    "analysis": float(os.getenv("STAGE_TIMEOUT_ANALYSIS_SECONDS", 30)),
+    "schema": float(os.getenv("STAGE_TIMEOUT_SCHEMA_SECONDS", 60)),
+    "generation": float(os.getenv("STAGE_TIMEOUT_GENERATION_SECONDS", 60)),
+    "execution": float(os.getenv("STAGE_TIMEOUT_EXECUTION_SECONDS", 120)),
+    "email": float(os.getenv("STAGE_TIMEOUT_EMAIL_SECONDS", 300)),
+    "report": float(os.getenv("STAGE_TIMEOUT_REPORT_SECONDS", 90)),
+    "visualization": float(os.getenv("STAGE_TIMEOUT_VISUALIZATION_SECONDS", 60)),
+}
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", 100000))
+# Streaming never holds the full result; post-query tools see at most this many rows.
+STREAM_TOOL_ROW_LIMIT = int(os.getenv("STREAM_TOOL_ROW_LIMIT", 1000))
+# How long the email tool waits for its background job before returning the job id instead.
+EMAIL_SYNC_WAIT_SECONDS = float(os.getenv("EMAIL_SYNC_WAIT_SECONDS", 10))
+
+# Span names of the stages run through _run_stages. Generation is timed inside generate_query
+# instead, so the plan check it triggers is reported as its own "guard" stage.
+_STAGE_NAMES = {"analyze": "analysis", "fetch_schema": "schema", "execute_query": "execution"}
+
+_NOTICE_KEYS = (
+    'database_connection_error', 'schema_fetching_error', 'query_execution_error', 'query_result_message',
+)
+
+
+def _event(name: str, **data) -> dict:
+    return {"event": name, "data": data}
+
+
+class QueryPipeline:
+    def __init__(self, request: QueryRequest, generated_query=None):
+        self.request = request
+        # A query generated ahead of time (e.g. by a batch) skips the generation call.
+        self.preset_query = generated_query
+        self.response = {"metadata": {}}
+        self.analysis = None
+        self.db_type = ""
+        self.schema_entry = None
+        self.schema = None
+        self.generated_query = None
+        # LLM cache keys of the generated queries, dropped when a query turns out not to work.
+        self._generation_keys = []
+        self.query_result = []
+        self.result_digest = None
+        self._digest_lock = asyncio.Lock()
+        self.stage = None
+        self.streaming = False
+        # Shared by every database call of this request so all of them can be interrupted at once.
+        # Its deadline doubles as the statement timeout set on each database session.
+        self.cancel_scope = db_service.CancelScope(query_guard.statement_timeout or STAGE_TIMEOUTS["execution"])
+
+    async def run(self) -> dict:
+        if await self.prepare():
+            await self.complete()
+        return self.response
+
+    async def _run_stages(self, stages) -> bool:
+        for stage in stages:
+            self.stage = stage.__name__
+            name = _STAGE_NAMES.get(stage.__name__)
+            with self._timed(name) if name else nullcontext():
+                completed = await stage()
+            if not completed:
+                return False
+        return True
+
+    @contextmanager
+    def _timed(self, stage: str):
+        # A span for the stage, plus its duration in the response's metadata.timings_ms.
+        with span(stage, stage=stage) as current:
+            try:
+                yield current
+            finally:
+                self._add_timing(stage, current.elapsed_ms)
+
+    def _add_timing(self, stage: str, elapsed_ms: float):
+        # Stages that run twice (a regenerated query) report their total.
+        timings = self.response['metadata'].setdefault('timings_ms', {})
+        timings[stage] = round(timings.get(stage, 0) + elapsed_ms, 1)
+
+    @staticmethod
+    def _stage_failed(message: str):
+        # For stages that report a failure in the response instead of raising.
+        current = current_span()
+        if current is not None:
+            current.fail(message)
+
+    async def prepare(self) -> bool:
+        # Analysis and schema: everything needed before a query can be generated.
+        return await self._run_stages((self.analyze, self.fetch_schema))
+
+    async def complete(self) -> dict:
+        if await self._run_stages((self.generate_query, self.execute_query)):
+            self.stage = "run_tools"
+            await self.run_tools()
+        return self.response
+
+    def interrupt_database_work(self):
+        # Runs on its own thread: the blocking pool may be saturated by the very queries being stopped.
+        threading.Thread(target=self.cancel_scope.cancel, name="cancel-query", daemon=True).start()
+
+    async def stream(self):
+        # Same stages as run(), but each result is yielded as an event as soon as it exists.
+        self.streaming = True
+        try:
+            await self._run_stages((self.analyze,))
+            yield _event("analysis", analysis=self.response['analysis'], metadata=self.response['metadata'])
+            if not await self._run_stages((self.fetch_schema,)):
+                for event in self._notice_events():
+                    yield event
+                yield _event("done", metadata=self.response['metadata'])
+                return
+            yield _event("schema", metadata=self.response['metadata'])
+            generated = await self._run_stages((self.generate_query,))
+            yield _event("generated_query", generated_query=self.generated_query,
+                         query_plan=self.response.get('query_plan'))
+            if not generated:
+                for event in self._notice_events():
+                    yield event
+                yield _event("done", metadata=self.response['metadata'])
+                return
+            async for event in self.stream_rows():
+                yield event
+            async for event in self.stream_tools():
+                yield event
+            yield _event("done", metadata=self.response['metadata'])
+        except Exception as e:
+            error = {"detail": str(e)}
+            if self.generated_query:
+                error['generated_query_that_failed'] = self.generated_query
+            yield _event("error", **error)
+
+    def _notice_events(self):
+        for key in _NOTICE_KEYS:
+            if key in self.response:
+                yield _event("notice", **{key: self.response[key]})
+
+    async def analyze(self) -> bool:
+        log.info("Query request received", prompt_chars=len(self.request.prompt))
+        self.analysis, analysis_meta = await with_timeout(
+            analysis_service.aanalyze(self.request.prompt, self.request.database_url),
+            STAGE_TIMEOUTS["analysis"], "analysis"
+        )
+        self.response['analysis'] = self.analysis.model_dump()
+        self.response['metadata']['analysis'] = analysis_meta
+        # Normalize the database_type to be lowercase and stripped of whitespace for robust matching.
+        self.db_type = (self.analysis.database_type or "").lower().strip()
+        log.info("Initial analysis complete", source=analysis_meta['source'],
+                 database_type=self.analysis.database_type)
+        return True
+
+    async def fetch_schema(self) -> bool:
+        if self.db_type not in ('sql', 'nosql'):
+            error_msg = f"Could not determine schema. The initial analysis identified an unsupported or empty database type: '{self.analysis.database_type}'"
+            self.response['schema_fetching_error'] = error_msg
+            self._stage_failed(error_msg)
+            log.warning("Schema fetching failed", error=error_msg)
+            return False
+
+        try:
+            self.schema_entry, cache_status = await with_timeout(
+                run_blocking(schema_cache.get, self.request.database_url, self.db_type),
+                STAGE_TIMEOUTS["schema"], "schema"
+            )
+        except ConnectionError as e:
+            # If connection fails, add the specific error to the response and return.
+            self.response['database_connection_error'] = str(e)
+            self._stage_failed(str(e))
+            log.warning("Database connection failed", error=str(e))
+            return False
+
+        self.response['metadata']['schema_cache'] = {
+            "status": cache_status,
+            "reflection_ms": round(self.schema_entry.reflection_ms, 1),
+            "age_seconds": round(time.time() - self.schema_entry.fetched_at, 1),
+        }
+        log.info("Schema fetched", cache=cache_status, reflection_ms=round(self.schema_entry.reflection_ms, 1))
+
+        self.schema, pruning_stats = await run_blocking(prune_schema, self.schema_entry, self.request.prompt)
+        self.response['metadata']['schema_pruning'] = pruning_stats
+        log.debug("Schema pruned", **pruning_stats)
+
+        # Handle case where database is empty (no tables/collections)
+        if not self.schema.strip():
+            self.response['query_execution_error'] = "Database schema is empty. The database might not have any tables or collections."
+            self._stage_failed(self.response['query_execution_error'])
+            log.warning("Schema is empty; no query can be generated")
+            return False
+        return True
+
+    async def _generate(self, feedback: str | None = None):
+        if self.db_type == 'sql':
+            template = prompt_templates.SQL_GENERATION_PROMPT
+            arguments = {"dialect": self.analysis.database_name}
+            generate = get_llm_service().agenerate_text_response
+        else:
+            template = prompt_templates.NOSQL_GENERATION_PROMPT
+            arguments = {}
+            generate = get_llm_service().agenerate_json_response
+        if feedback:
+            template = (prompt_templates.SQL_REGENERATION_PROMPT if self.db_type == 'sql'
+                        else prompt_templates.NOSQL_REGENERATION_PROMPT)
+            arguments.update(previous_query=dumps_text(self.generated_query), feedback=feedback)
+        arguments.update(schema=self.schema, prompt=self.request.prompt)
+        if self.request.use_cache:
+            self._generation_keys.append(llm_cache.make_key(template, arguments))
+        with self._timed("generation"):
+            return await with_timeout(
+                generate(template, use_cache=self.request.use_cache, **arguments),
+                STAGE_TIMEOUTS["generation"], "generation"
+            )
+
+    def _forget_generated_query(self):
+        # A query that was rejected or failed would otherwise be served from the LLM cache to
+        # every retry of the same request until the entry expires.
+        for key in self._generation_keys:
+            llm_cache.discard(key)
+        self._generation_keys.clear()
+
+    async def generate_query(self) -> bool:
+        self.generated_query = self.preset_query if self.preset_query is not None else await self._generate()
+        log.info("Query generated", preset=self.preset_query is not None)
+        self.response['generated_query'] = self.generated_query
+        return await self.guard_query()
+
+    async def guard_query(self) -> bool:
+        # EXPLAIN the generated query before it runs. An expensive plan gets one regeneration
+        # with the plan's complaints as feedback; if that is still too expensive, nothing runs.
+        verdict = await self._check_query()
+        if verdict is not None and not verdict['allowed']:
+            log.warning("Query rejected by the guard; regenerating", feedback=verdict['feedback'])
+            self.response['rejected_query'] = self.generated_query
+            self._forget_generated_query()
+            self.generated_query = await self._generate(verdict['feedback'])
+            self.response['generated_query'] = self.generated_query
+            verdict = await self._check_query()
+            if verdict is not None and not verdict['allowed']:
+                self._forget_generated_query()
+                self.response['query_plan'] = verdict['plan']
+                self.response['query_execution_error'] = (
+                    "The generated query was not executed because its plan is too expensive: "
+                    + "; ".join(verdict['plan']['violations']) + "."
+                )
+                log.warning("Regenerated query was also rejected", violations=verdict['plan']['violations'])
+                return False
+        if verdict is not None:
+            self.response['query_plan'] = verdict['plan']
+        return True
+
+    async def _check_query(self) -> dict | None:
+        if self.db_type == 'nosql' and self.nosql_query_error() is not None:
+            # Reported by execute_query with its usual message.
+            return None
+        row_limit = STREAM_MAX_ROWS if self.streaming else self.max_rows
+        with self._timed("guard") as current:
+            try:
+                verdict = await with_timeout(
+                    run_blocking(query_guard.check, self.request.database_url, self.db_type, self.generated_query, row_limit),
+                    STAGE_TIMEOUTS["generation"], "generation"
+                )
+            except TimeoutError:
+                # A plan that takes this long to produce is not worth blocking the request on.
+                QUERY_GUARD_FAILURES.inc(db_type=self.db_type, reason="timeout")
+                log.warning("Query guard timed out; executing without a plan check")
+                return query_guard.unchecked("The plan check timed out.")
+            if verdict is not None:
+                current.set(allowed=verdict['allowed'])
+            return verdict
+
+    def nosql_query_error(self) -> str | None:
+        try:
+            db_service.normalize_nosql_query(self.generated_query)
+        except ValueError as e:
+            return f"LLM failed to generate a valid NoSQL query: {e}"
+        return None
+
+    @property
+    def max_rows(self) -> int:
+        requested = self.request.max_rows or db_service.MAX_RESULT_ROWS
+        return max(1, min(requested, db_service.MAX_RESULT_ROWS))
+
+    async def execute_query(self) -> bool:
+        result = None
+        if self.db_type == 'sql':
+            log.info("Executing SQL query", query=self.generated_query)
+            try:
+                result = await with_timeout(
+                    run_blocking(self._execute_cached, functools.partial(
+                        db_service.execute_sql_query, self.request.database_url, self.generated_query,
+                        self.max_rows, cancel_scope=self.cancel_scope
+                    )),
+                    STAGE_TIMEOUTS["execution"], "execution"
+                )
+            except Exception as e:
+                if isinstance(e, TimeoutError):
+                    self.interrupt_database_work()
+                self.response['query_execution_error'] = f"Failed to execute SQL query: {e}"
+        else:
+            log.info("Executing NoSQL query", query=dumps_text(self.generated_query))
+            query_error = self.nosql_query_error()
+            if query_error is not None:
+                self.response['query_execution_error'] = query_error
+            else:
+                try:
+                    result = await with_timeout(
+                        run_blocking(self._execute_cached, functools.partial(
+                            db_service.execute_nosql_query, self.request.database_url, self.generated_query,
+                            self.max_rows, cancel_scope=self.cancel_scope
+                        )),
+                        STAGE_TIMEOUTS["execution"], "execution"
+                    )
+                except Exception as e:
+                    if isinstance(e, TimeoutError):
+                        self.interrupt_database_work()
+                    self.response['query_execution_error'] = f"Failed to execute NoSQL query: {e}"
+
+        if result is not None:
+            self.query_result = result['rows']
+            self.response['result_truncated'] = result['truncated']
+            RESULT_ROWS.observe(len(self.query_result), db_type=self.db_type)
+            log.info("Query executed", rows=len(self.query_result), truncated=result['truncated'],
+                     result_cache=self.response['metadata'].get('result_cache', {}).get('status'))
+            if result['next_page']:
+                self.response['next_page_token'] = encode_page_token({
+                    "db": database_fingerprint(normalize_db_url(self.request.database_url)),
+                    "db_type": self.db_type,
+                    "query": self.generated_query,
+                    "page": result['next_page'],
+                    "page_size": self.max_rows,
+                })
+        elif 'query_execution_error' in self.response:
+            self._forget_generated_query()
+            self._stage_failed(self.response['query_execution_error'])
+            log.warning("Query execution failed", error=self.response['query_execution_error'])
+        self.response['query_result'] = format_result(self.query_result, self.request.result_format)
+        if not self.query_result and 'query_execution_error' not in self.response:
+            self.response['query_result_message'] = "Query executed successfully but returned no results. The generated query might be logically incorrect for the data."
+        return True
+
+    def _execute_cached(self, execute) -> dict:
+        result, cache_meta = result_cache.get_or_execute(
+            self.request.database_url, self.db_type, self.generated_query, self.schema_entry.fingerprint, execute,
+            self.max_rows, use_cache=self.request.use_cache
+        )
+        self.response['metadata']['result_cache'] = cache_meta
+        return result
+
+    async def stream_rows(self):
+        if self.db_type == 'sql':
+            log.info("Streaming SQL query", query=self.generated_query)
+            rows = db_service.iter_sql_query(
+                self.request.database_url, self.generated_query, STREAM_BATCH_SIZE, STREAM_MAX_ROWS,
+                cancel_scope=self.cancel_scope
+            )
+            error_prefix = "Failed to execute SQL query"
+        else:
+            log.info("Streaming NoSQL query", query=dumps_text(self.generated_query))
+            query_error = self.nosql_query_error()
+            if query_error is not None:
+                self.response['query_execution_error'] = query_error
+                self._forget_generated_query()
+                for event in self._notice_events():
+                    yield event
+                return
+            rows = db_service.iter_nosql_query(
+                self.request.database_url, self.generated_query, STREAM_BATCH_SIZE, STREAM_MAX_ROWS,
+                cancel_scope=self.cancel_scope
+            )
+            error_prefix = "Failed to execute NoSQL query"
+
+        row_count = 0
+        truncated = False
+        finished = False
+        # Timed by hand: a generator is resumed by its consumer, so it cannot hold a span open.
+        started = time.perf_counter()
+        try:
+            while True:
+                batch = await with_timeout(run_blocking(next, rows, None), STAGE_TIMEOUTS["execution"], "execution")
+                if batch is None:
+                    break
+                if row_count + len(batch) > STREAM_MAX_ROWS:
+                    # The cursor was asked for one extra row to detect truncation; drop it.
+                    batch = batch[:STREAM_MAX_ROWS - row_count]
+                    truncated = True
+                room = STREAM_TOOL_ROW_LIMIT - len(self.query_result)
+                if room > 0:
+                    self.query_result.extend(batch[:room])
+                yield _event("rows", offset=row_count, rows=batch)
+                row_count += len(batch)
+            finished = True
+            log.info("Query streamed", rows=row_count, truncated=truncated)
+        except Exception as e:
+            self.response['query_execution_error'] = f"{error_prefix}: {e}"
+            self._forget_generated_query()
+            log.warning("Query execution failed", error=self.response['query_execution_error'])
+        finally:
+            elapsed = time.perf_counter() - started
+            observe_stage("execution", elapsed, "ok" if finished else "error")
+            self._add_timing("execution", elapsed * 1000)
+            RESULT_ROWS.observe(row_count, db_type=self.db_type)
+            if not finished:
+                # Timed out, failed or the client went away: stop the cursor in the database too.
+                self.interrupt_database_work()
+            try:
+                await run_blocking(rows.close)
+            except ValueError:
+                # The worker thread is still inside next() after a cancellation; the generator
+                # is closed when it is garbage collected instead.
+                pass
+
+        self.response['metadata']['row_count'] = row_count
+        self.response['result_truncated'] = truncated
+        if not row_count and 'query_execution_error' not in self.response:
+            self.response['query_result_message'] = "Query executed successfully but returned no results. The generated query might be logically incorrect for the data."
+        for event in self._notice_events():
+            yield event
+        yield _event("query_complete", row_count=row_count, result_truncated=truncated)
+
+    async def stream_tools(self):
+        tools = self.requested_tools()
+        if not tools:
+            return
+        queue = asyncio.Queue()
+        if "report" in tools:
+            tools["report"] = lambda: self.stream_report(queue)
+
+        async def run_tool(name, tool):
+            try:
+                outcome = await self._run_tool(name, tool)
+                self.response.update(outcome)
+                await queue.put(_event(name, **outcome))
+            except Exception as e:
+                self.response[f"{name}_error"] = str(e)
+                await queue.put(_event("notice", **{f"{name}_error": str(e)}))
+            finally:
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(run_tool(name, tool)) for name, tool in tools.items()]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                if event is None:
+                    remaining -= 1
+                else:
+                    yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream_report(self, queue: asyncio.Queue) -> dict:
+        digest = await self.compute_digest()
+        chunks = []
+        async for chunk in get_llm_service().astream_text_response(
+            prompt_templates.REPORT_GENERATION_PROMPT,
+            prompt=self.request.prompt,
+            result_digest=dumps_text(digest),
+            result_scope=self._result_scope(digest)
+        ):
+            chunks.append(chunk)
+            await queue.put(_event("report_token", text=chunk))
+        # The tokens have already been sent, so the closing event only carries the status.
+        self.response['report'] = "".join(chunks).strip()
+        return {'report_status': "Report generated successfully."}
+
+    def requested_tools(self) -> dict:
+        if not self.query_result:
+            return {}
+        tools = {
+            "email": self.send_email,
+            "report": self.generate_report,
+            "visualization": self.generate_visual,
+        }
+        flags = {
+            "email": self.analysis.isEmailRequired,
+            "report": self.analysis.isReportGenerationRequired,
+            "visualization": self.analysis.isVisualizationRequired,
+        }
+        return {name: tool for name, tool in tools.items() if flags[name]}
+
+    async def compute_digest(self):
+        # Report and visualization share one profile of the result, computed off the event loop.
+        async with self._digest_lock:
+            if self.result_digest is None and self.query_result:
+                # pandas is imported with the first digest rather than at startup.
+                from services.result_profiler import profile_result
+                self.result_digest = await run_blocking(
+                    profile_result,
+                    self.query_result,
+                    self.response['metadata'].get('row_count'),
+                    self.response.get('result_truncated', False)
+                )
+                self.response['metadata']['result_digest_chars'] = len(dumps_text(self.result_digest))
+        return self.result_digest
+
+    def _result_scope(self, digest: dict) -> str:
+        # The report must not present figures computed over a prefix of the rows as totals.
+        if not self.result_is_partial:
+            return "The digest covers the full query result."
+        profiled = digest.get('profiled_rows', len(self.query_result))
+        covered = f"its first {profiled} rows" if self.response.get('result_truncated') \
+            else f"the first {profiled} of {digest['row_count']} rows"
+        return (f"The query result was truncated and the digest covers only {covered}. State in the report "
+                f"that its figures are computed over the first {profiled} rows, not the full result.")
+
+    async def run_tools(self):
+        # Phase 3: Post-Query Tools. They are independent, so they run concurrently and the
+        # phase takes as long as the slowest one instead of the sum of all of them.
+        tools = self.requested_tools()
+        if not tools:
+            return
+        outcomes = await asyncio.gather(
+            *(self._run_tool(name, tool) for name, tool in tools.items()),
+            return_exceptions=True
+        )
+        for name, outcome in zip(tools, outcomes):
+            if isinstance(outcome, BaseException):
+                self.response[f"{name}_error"] = str(outcome)
+                log.warning("Post-query tool failed", tool=name, error=str(outcome))
+            else:
+                self.response.update(outcome)
+
+    async def _run_tool(self, name: str, tool) -> dict:
+        with self._timed(name):
+            return await with_timeout(tool(), STAGE_TIMEOUTS[name], name)
+
+    async def send_email(self) -> dict:
+        email_json = await get_llm_service().agenerate_json_response(
+            prompt_templates.EMAIL_GENERATION_PROMPT,
+            prompt=self.request.prompt,
+            query_result=dumps_text(self.query_result[:5])
+        )
+        subject = email_json.get('subject', 'Important Update')
+        body_template = email_json.get('body', '<p>Hello!</p>')
+        # Sending runs as a background job; a large campaign returns its job id for polling
+        # instead of holding the request open until the last message is out.
+        email_service = get_email_service()
+        job = await run_blocking(
+            email_service.submit_job,
+            recipients=[],
+            subject=subject,
+            html_body_template=body_template,
+            data=self._email_rows()
+        )
+        try:
+            email_status = await run_blocking(email_service.wait_for_job, job, EMAIL_SYNC_WAIT_SECONDS)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        return {'email_status': email_status, 'email_job_id': job.id}
+
+    def _email_rows(self):
+        # Every matching row is a recipient, so a truncated result is re-read in full on the job's thread.
+        if not self.result_is_partial:
+            return self.query_result
+        limit = get_email_service().max_recipients
+        if self.db_type == 'sql':
+            batches = db_service.iter_sql_query(
+                self.request.database_url, self.generated_query, STREAM_BATCH_SIZE, limit, cancel_scope=self.cancel_scope
+            )
+        else:
+            batches = db_service.iter_nosql_query(
+                self.request.database_url, self.generated_query, STREAM_BATCH_SIZE, limit, cancel_scope=self.cancel_scope
+            )
+        return itertools.chain.from_iterable(batches)
+
+    async def generate_report(self) -> dict:
+        digest = await self.compute_digest()
+        report_markdown = await get_llm_service().agenerate_text_response(
+            prompt_templates.REPORT_GENERATION_PROMPT,
+            prompt=self.request.prompt,
+            result_digest=dumps_text(digest),
+            result_scope=self._result_scope(digest)
+        )
+        return {'report_status': "Report generated successfully.", 'report': report_markdown}
+
+    async def generate_visual(self) -> dict:
+        # The model only picks the chart; the data points are computed here, so the response
+        # size no longer depends on the LLM writing out every value.
+        from services import chart_service
+        digest = await self.compute_digest()
+        chart_spec = await get_llm_service().agenerate_json_response(
+            prompt_templates.VISUALIZATION_SPEC_PROMPT,
+            prompt=self.request.prompt,
+            columns=dumps_text(chart_service.describe_columns(digest))
+        )
+        visual_json, chart_meta = await run_blocking(
+            chart_service.build_chart, chart_spec, self.query_result, digest['columns'], self._chart_aggregate()
+        )
+        self.response['metadata']['chart'] = chart_meta
+        return {'visual_status': "Visualization generated successfully.", 'visual': visual_json}
+
+    @property
+    def result_is_partial(self) -> bool:
+        # True when the rows held in memory are only a prefix of the query's result.
+        row_count = self.response['metadata'].get('row_count', len(self.query_result))
+        return bool(self.response.get('result_truncated')) or row_count > len(self.query_result)
+
+    def _chart_aggregate(self):
+        # A partial result is grouped in the database instead; complete results are grouped in
+        # memory without another query.
+        if not self.result_is_partial:
+            return None
+        if self.db_type == 'sql':
+            return functools.partial(
+                db_service.aggregate_sql_query, self.request.database_url, self.generated_query,
+                cancel_scope=self.cancel_scope
+            )
+        return functools.partial(
+            db_service.aggregate_nosql_query, self.request.database_url, self.generated_query,
+            cancel_scope=self.cancel_scope
+        )
+
+
+async def fetch_page(request: PageRequest) -> dict:
+    # Continues a truncated result from its page token without involving the LLM again.
+    token = decode_page_token(request.page_token)
+    if token["db"] != database_fingerprint(normalize_db_url(request.database_url)):
+        raise ValueError("The page token was issued for a different database.")
+    page_size = max(1, min(request.page_size or token["page_size"], db_service.MAX_RESULT_ROWS))
+
+    execute = db_service.execute_sql_query if token["db_type"] == 'sql' else db_service.execute_nosql_query
+    schema_entry, _ = await with_timeout(
+        run_blocking(schema_cache.get, request.database_url, token["db_type"]), STAGE_TIMEOUTS["schema"], "schema"
+    )
+    with span("page", stage="execution", page_size=page_size):
+        result, cache_meta = await with_timeout(
+            run_blocking(
+                result_cache.get_or_execute, request.database_url, token["db_type"], token["query"],
+                schema_entry.fingerprint, functools.partial(execute, request.database_url, token["query"], page_size, token["page"]),
+                page_size, token["page"], request.use_cache
+            ),
+            STAGE_TIMEOUTS["execution"], "execution"
+        )
+    RESULT_ROWS.observe(len(result['rows']), db_type=token["db_type"])
+
+    response = {
+        "query_result": format_result(result['rows'], request.result_format),
+        "result_truncated": result['truncated'],
+        "metadata": {"result_cache": cache_meta},
+    }
+    if result['next_page']:
+        response['next_page_token'] = encode_page_token(dict(token, page=result['next_page'], page_size=page_size))
+    return response
@@ -0,0 +1,272 @@
+# services/result_cache.py
+
+import gzip
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from bson import json_util
+from dotenv import load_dotenv
+from services import db_service
+from services.connection_registry import normalize_db_url, redact_db_url
+
+load_dotenv()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Clock, random and sampling functions: the same text returns different rows on every run.
+_NONDETERMINISTIC_SQL_RE = re.compile(
+    r"\b(?:current_(?:date|time|timestamp)|localtime(?:stamp)?|sysdate|systimestamp|utc_(?:date|time|timestamp)"
+    r"|tablesample)\b"
+    r"|\b(?:now|random|rand|uuid|gen_random_uuid|newid|getdate|getutcdate|sysdatetime|unix_timestamp"
+    r"|clock_timestamp|statement_timestamp|timeofday|dbms_random\.\w+)\s*\(",
+    re.IGNORECASE,
+)
+# SQLite reads the clock through date('now'), datetime('now', 'localtime') and friends.
+_SQLITE_NOW_RE = re.compile(r"'now'", re.IGNORECASE)
+_NONDETERMINISTIC_MONGO_KEYS = frozenset({"$sample", "$rand"})
+_NONDETERMINISTIC_MONGO_VARIABLES = frozenset({"$$NOW", "$$CLUSTER_TIME"})
+
+
+def _normalize_sql(query: str) -> str:
+    # Whitespace is collapsed outside string literals only; identifiers keep their case because
+    # MySQL table names can be case-sensitive.
+    statement = db_service._clean_statement(query)
+    parts, position = [], 0
+    for match in db_service._QUOTED_RE.finditer(statement):
+        parts.append(_WHITESPACE_RE.sub(" ", statement[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(_WHITESPACE_RE.sub(" ", statement[position:]))
+    return "".join(parts).strip()
+
+
+def _is_nondeterministic_sql(statement: str) -> bool:
+    masked = db_service._QUOTED_RE.sub("''", statement)
+    return bool(_NONDETERMINISTIC_SQL_RE.search(masked) or _SQLITE_NOW_RE.search(statement))
+
+
+def _is_nondeterministic_nosql(value) -> bool:
+    if isinstance(value, dict):
+        return any(key in _NONDETERMINISTIC_MONGO_KEYS or _is_nondeterministic_nosql(item)
+                   for key, item in value.items())
+    if isinstance(value, list):
+        return any(_is_nondeterministic_nosql(item) for item in value)
+    return isinstance(value, str) and value.split(".")[0] in _NONDETERMINISTIC_MONGO_VARIABLES
+
+
+class _CacheEntry:
+    def __init__(self, db_url: str, fingerprint: str | None, payload: bytes):
+        self.db_url = db_url
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+        self.size = len(payload)
+        # Pickled result in memory, or the path of its compressed copy on disk.
+        self.payload = payload
+        self.spill_path = None
+
+
+class ResultCache:
+    def __init__(self):
+        self.enabled = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 300))
+        self.memory_budget = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+        # 0 disables the disk tier: entries evicted from memory are simply dropped.
+        self.disk_budget = int(os.getenv("RESULT_CACHE_DISK_BYTES", 0))
+        self.spill_dir = os.getenv("RESULT_CACHE_SPILL_DIR") or os.path.join(
+            tempfile.gettempdir(), f"db_automation_result_cache_{os.getpid()}"
+        )
+        # One result may not take more than this share of the memory budget.
+        self.max_entry_bytes = self.memory_budget // 4
+
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._counters = {
+            "hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "spilled": 0,
+            "expired": 0, "stale": 0, "evicted": 0, "invalidations": 0, "write_invalidations": 0,
+        }
+
+    @staticmethod
+    def make_key(db_url: str, db_type: str, query, max_rows: int, page_state: dict | None) -> str | None:
+        # None means the query must not be cached: it may write, or its result depends on more
+        # than its text.
+        if db_type == 'sql':
+            if not db_service.is_read_only_sql(query):
+                return None
+            normalized = _normalize_sql(query)
+            if _is_nondeterministic_sql(normalized):
+                return None
+        else:
+            normalized = db_service.normalize_nosql_query(query)
+            if _is_nondeterministic_nosql(normalized):
+                return None
+        parts = {"db": normalize_db_url(db_url), "query": normalized, "max_rows": max_rows, "page": page_state}
+        # json_util keeps ObjectId and datetime values in the key distinct from their string forms.
+        return hashlib.sha256(json_util.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get_or_execute(self, db_url: str, db_type: str, query, fingerprint: str | None, execute,
+                       max_rows: int, page_state: dict | None = None, use_cache: bool = True) -> tuple[dict, dict]:
+        # Returns the result of `execute()` or a cached copy of it, and the cache status for the response.
+        try:
+            key = self.make_key(db_url, db_type, query, max_rows, page_state) if self.enabled and use_cache else None
+        except ValueError:
+            key = None
+        if key is None:
+            result = execute()
+            if db_type == 'sql' and not db_service.is_read_only_sql(query):
+                # The statement may have changed data that cached results were read from.
+                invalidated = self.invalidate(db_url, counter="write_invalidations")
+                return result, {"status": "bypass", "invalidated": invalidated}
+            self._count("bypassed")
+            return result, {"status": "bypass"}
+
+        cached = self._lookup(key, fingerprint)
+        if cached is not None:
+            result, created_at, tier = cached
+            return result, {"status": "hit", "tier": tier, "age_seconds": round(time.time() - created_at, 1)}
+
+        result = execute()
+        self._store(key, db_url, fingerprint, result)
+        return result, {"status": "miss", "age_seconds": 0.0}
+
+    def _lookup(self, key: str, fingerprint: str | None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if time.time() - entry.created_at >= self.ttl:
+                self._drop_locked(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            if fingerprint is not None and entry.fingerprint is not None and fingerprint != entry.fingerprint:
+                # The schema changed since the result was stored.
+                self._drop_locked(key)
+                self._counters["stale"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            payload, spill_path = entry.payload, entry.spill_path
+            self._counters["hits" if payload is not None else "disk_hits"] += 1
+        if payload is None:
+            try:
+                with gzip.open(spill_path, "rb") as spill_file:
+                    payload = spill_file.read()
+            except OSError:
+                with self._lock:
+                    self._drop_locked(key)
+                return None
+        # Unpickled per hit, so callers never share (and mutate) one cached object.
+        return pickle.loads(payload), entry.created_at, "memory" if spill_path is None else "disk"
+
+    def _store(self, key: str, db_url: str, fingerprint: str | None, result: dict):
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        entry = _CacheEntry(normalize_db_url(db_url), fingerprint, payload)
+        with self._lock:
+            self._drop_locked(key)
+            self._entries[key] = entry
+            self._memory_bytes += entry.size
+            self._counters["stored"] += 1
+            if entry.size > self.max_entry_bytes:
+                self._evict_locked(key)
+            self._enforce_budgets_locked()
+
+    def _enforce_budgets_locked(self):
+        # Least recently used first: to disk while the disk tier has room, otherwise dropped.
+        for key in list(self._entries):
+            if self._memory_bytes <= self.memory_budget:
+                break
+            if self._entries[key].payload is not None:
+                self._evict_locked(key)
+        for key in list(self._entries):
+            if self._disk_bytes <= self.disk_budget:
+                break
+            if self._entries[key].spill_path is not None:
+                self._drop_locked(key)
+                self._counters["evicted"] += 1
+
+    def _evict_locked(self, key: str):
+        entry = self._entries[key]
+        if self.disk_budget <= 0 or entry.size > self.disk_budget:
+            self._drop_locked(key)
+            self._counters["evicted"] += 1
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{key}.pkl.gz")
+        with gzip.open(path, "wb", compresslevel=1) as spill_file:
+            spill_file.write(entry.payload)
+        self._memory_bytes -= entry.size
+        self._disk_bytes += entry.size
+        entry.payload = None
+        entry.spill_path = path
+        self._counters["spilled"] += 1
+
+    def _drop_locked(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.payload is not None:
+            self._memory_bytes -= entry.size
+        if entry.spill_path is not None:
+            self._disk_bytes -= entry.size
+            try:
+                os.remove(entry.spill_path)
+            except FileNotFoundError:
+                pass
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def invalidate(self, db_url: str | None = None, counter: str = "invalidations") -> int:
+        # The write-detection hook: called after a write through the pipeline, or by anything
+        # else that changes the data (see POST /api/result-cache/invalidate).
+        with self._lock:
+            if db_url is None:
+                keys = list(self._entries)
+            else:
+                normalized = normalize_db_url(db_url)
+                keys = [key for key, entry in self._entries.items() if entry.db_url == normalized]
+            for key in keys:
+                self._drop_locked(key)
+            self._counters[counter] += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            databases = {}
+            for entry in self._entries.values():
+                databases[entry.db_url] = databases.get(entry.db_url, 0) + 1
+            entries = len(self._entries)
+            memory_bytes, disk_bytes = self._memory_bytes, self._disk_bytes
+        served = counters["hits"] + counters["disk_hits"]
+        lookups = served + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hit_ratio": round(served / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "memory_bytes": memory_bytes,
+            "memory_budget_bytes": self.memory_budget,
+            "disk_bytes": disk_bytes,
+            "disk_budget_bytes": self.disk_budget,
+            "ttl_seconds": self.ttl,
+            "databases": {redact_db_url(db_url): count for db_url, count in databases.items()},
+        }
+
+    def shutdown(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = self._disk_bytes = 0
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+result_cache = ResultCache()
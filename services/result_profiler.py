@@ -0,0 +1,193 @@
+# services/result_profiler.py
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from utils.serialization import dumps_text
+
+load_dotenv()
+
+DIGEST_SAMPLE_ROWS = int(os.getenv("DIGEST_SAMPLE_ROWS", 20))
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", 5))
+DIGEST_MAX_COLUMNS = int(os.getenv("DIGEST_MAX_COLUMNS", 40))
+DIGEST_MAX_GROUPS = int(os.getenv("DIGEST_MAX_GROUPS", 12))
+DIGEST_MAX_CHARS = int(os.getenv("DIGEST_MAX_CHARS", 12000))
+
+_MAX_VALUE_CHARS = 120
+# Columns with more distinct values than this are described, not grouped by.
+_MAX_GROUP_CARDINALITY = 50
+_TIME_BUCKETS = 24
+_IDENTIFIER_RE = re.compile(r"(^|_)id$", re.IGNORECASE)
+
+
+def _clip(value):
+    if isinstance(value, str) and len(value) > _MAX_VALUE_CHARS:
+        return value[:_MAX_VALUE_CHARS] + "…"
+    return value
+
+
+def _scalar(value):
+    if isinstance(value, (np.generic,)):
+        value = value.item()
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, 4)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return _clip(value)
+
+
+def prepare_frame(rows: list[dict]) -> pd.DataFrame:
+    frame = pd.DataFrame.from_records(rows)
+    for column in frame.columns:
+        series = frame[column]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        # Nested Mongo values are unhashable; describe them by their JSON text instead.
+        nested = series.map(lambda value: isinstance(value, (dict, list)))
+        if nested.any():
+            frame[column] = series.where(~nested, series[nested].map(dumps_text))
+            continue
+        sample = series.dropna().head(50)
+        if len(sample) and sample.map(lambda value: isinstance(value, str)).all():
+            parsed = pd.to_datetime(sample, errors='coerce', format='ISO8601')
+            if parsed.notna().mean() > 0.9 and sample.str.len().min() >= 8:
+                frame[column] = pd.to_datetime(series, errors='coerce', format='ISO8601')
+    return frame
+
+
+def _describe_column(series: pd.Series) -> dict:
+    total = len(series)
+    non_null = series.dropna()
+    description = {"null_rate": round(1 - len(non_null) / total, 4) if total else 0.0}
+
+    if pd.api.types.is_bool_dtype(series) or not len(non_null):
+        kind = "boolean" if pd.api.types.is_bool_dtype(series) else "empty"
+    elif pd.api.types.is_numeric_dtype(series):
+        kind = "numeric"
+        quantiles = non_null.quantile([0.05, 0.25, 0.5, 0.75, 0.95]).to_numpy()
+        description.update({
+            "min": _scalar(non_null.min()),
+            "max": _scalar(non_null.max()),
+            "mean": _scalar(non_null.mean()),
+            "std": _scalar(non_null.std()) if len(non_null) > 1 else None,
+            "sum": _scalar(non_null.sum()),
+            "quantiles": {
+                label: _scalar(value) for label, value in zip(("p05", "p25", "p50", "p75", "p95"), quantiles)
+            },
+        })
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        kind = "datetime"
+        description.update({"min": _scalar(non_null.min()), "max": _scalar(non_null.max())})
+    else:
+        kind = "categorical"
+        description["avg_length"] = _scalar(non_null.astype(str).str.len().mean())
+
+    if kind in ("categorical", "boolean") or (kind == "numeric" and non_null.nunique() <= DIGEST_TOP_K):
+        counts = non_null.value_counts().head(DIGEST_TOP_K)
+        description["top_values"] = [
+            {"value": _scalar(value), "count": int(count)} for value, count in counts.items()
+        ]
+    description["distinct"] = int(non_null.nunique())
+    description["type"] = kind
+    return description
+
+
+def _group_by_aggregates(frame: pd.DataFrame, group_columns: list[str], numeric_columns: list[str]) -> dict:
+    aggregates = {}
+    for group_column in group_columns[:2]:
+        grouped = frame.groupby(group_column, dropna=False, sort=False)
+        table = grouped.size().rename("count").to_frame()
+        for column in numeric_columns[:3]:
+            table[f"{column}_sum"] = grouped[column].sum()
+            table[f"{column}_mean"] = grouped[column].mean()
+        table = table.sort_values("count", ascending=False).head(DIGEST_MAX_GROUPS)
+        aggregates[group_column] = [
+            {"group": _scalar(group), **{key: _scalar(value) for key, value in row.items()}}
+            for group, row in zip(table.index, table.to_dict(orient="records"))
+        ]
+    return aggregates
+
+
+def _time_series(frame: pd.DataFrame, datetime_columns: list[str], numeric_columns: list[str]) -> dict | None:
+    if not datetime_columns:
+        return None
+    column = datetime_columns[0]
+    series = frame.dropna(subset=[column]).set_index(column).sort_index()
+    if series.empty:
+        return None
+    span_days = (series.index.max() - series.index.min()).days
+    frequency = "YS" if span_days > 3 * 365 else "MS" if span_days > 60 else "D"
+    resampled = series.resample(frequency)
+    table = resampled.size().rename("count").to_frame()
+    if numeric_columns:
+        table[f"{numeric_columns[0]}_sum"] = resampled[numeric_columns[0]].sum()
+    table = table.tail(_TIME_BUCKETS)
+    return {
+        "column": column,
+        "bucket": {"YS": "year", "MS": "month", "D": "day"}[frequency],
+        "points": [
+            {"period": period.date().isoformat(), **{key: _scalar(value) for key, value in row.items()}}
+            for period, row in zip(table.index, table.to_dict(orient="records"))
+        ],
+    }
+
+
+def _stratified_sample(frame: pd.DataFrame, group_columns: list[str], size: int) -> list[dict]:
+    if len(frame) <= size:
+        sample = frame
+    elif group_columns:
+        # A few rows from every group of the lowest-cardinality column, so rare groups are visible.
+        column = min(group_columns, key=lambda name: frame[name].nunique())
+        per_group = max(1, size // max(1, frame[column].nunique()))
+        sample = frame.groupby(column, dropna=False, sort=False).head(per_group).head(size)
+    else:
+        positions = np.unique(np.linspace(0, len(frame) - 1, size).astype(int))
+        sample = frame.iloc[positions]
+    return [
+        {key: _scalar(value) for key, value in record.items()}
+        for record in sample.astype(object).where(sample.notna(), None).to_dict(orient="records")
+    ]
+
+
+def profile_result(rows: list[dict], total_rows: int | None = None, truncated: bool = False) -> dict:
+    if not rows:
+        return {"row_count": 0, "columns": {}}
+
+    frame = prepare_frame(rows)
+    omitted_columns = max(0, len(frame.columns) - DIGEST_MAX_COLUMNS)
+    frame = frame.iloc[:, :DIGEST_MAX_COLUMNS]
+    columns = {str(column): _describe_column(frame[column]) for column in frame.columns}
+
+    # Summing or averaging surrogate keys says nothing, so they are left out of the aggregates.
+    numeric_columns = [
+        name for name, info in columns.items()
+        if info["type"] == "numeric" and not _IDENTIFIER_RE.search(name)
+    ]
+    datetime_columns = [name for name, info in columns.items() if info["type"] == "datetime"]
+    group_columns = [
+        name for name, info in columns.items()
+        if info["type"] in ("categorical", "boolean") and 1 < info["distinct"] <= _MAX_GROUP_CARDINALITY
+    ]
+
+    digest = {
+        "row_count": total_rows if total_rows is not None else len(rows),
+        "profiled_rows": len(rows),
+        "result_truncated": truncated,
+        "column_count": len(columns) + omitted_columns,
+        "columns": columns,
+        "group_by": _group_by_aggregates(frame, group_columns, numeric_columns),
+        "time_series": _time_series(frame, datetime_columns, numeric_columns),
+        "sample": _stratified_sample(frame, group_columns, DIGEST_SAMPLE_ROWS),
+    }
+    if omitted_columns:
+        digest["omitted_columns"] = omitted_columns
+
+    # Keep the prompt bounded: shrink the sample first, then drop the aggregates.
+    while len(dumps_text(digest)) > DIGEST_MAX_CHARS and digest["sample"]:
+        digest["sample"] = digest["sample"][: len(digest["sample"]) // 2]
+    for optional in ("time_series", "group_by"):
+        if len(dumps_text(digest)) > DIGEST_MAX_CHARS:
+            digest.pop(optional)
+    return digest
@@ -0,0 +1,142 @@
+# services/schema_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from services import db_service
+from services.connection_registry import normalize_db_url, redact_db_url
+from services.schema_index import SchemaIndex
+
+load_dotenv()
+
+
+class SchemaCacheEntry:
+    def __init__(self, db_type: str, tables: list[dict], fingerprint: str | None, reflection_ms: float):
+        self.db_type = db_type
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self.reflection_ms = reflection_ms
+        self.fetched_at = time.time()
+        self.validated_at = self.fetched_at
+        if db_type == 'sql':
+            self.schema = db_service.format_sql_schema(tables)
+        else:
+            self.schema = db_service.format_nosql_schema(tables)
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> SchemaIndex:
+        # Built on first use and then shared by every request served from this entry.
+        with self._index_lock:
+            if self._index is None:
+                self._index = SchemaIndex(self.tables)
+            return self._index
+
+
+class SchemaCache:
+    def __init__(self):
+        self.ttl = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", 300))
+        self.max_entries = int(os.getenv("SCHEMA_CACHE_MAX_ENTRIES", 32))
+
+        self._entries: OrderedDict[tuple[str, str], SchemaCacheEntry] = OrderedDict()
+        self._key_locks: dict[tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "revalidations": 0, "misses": 0, "refreshes": 0, "invalidations": 0}
+        self._reflection_ms_total = 0.0
+
+    def get(self, db_url: str, db_type: str) -> tuple[SchemaCacheEntry, str]:
+        key = (normalize_db_url(db_url), db_type)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One reflection per database at a time; concurrent requests wait for it and then hit.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry:
+                    self._entries.move_to_end(key)
+
+            if entry and time.time() - entry.validated_at < self.ttl:
+                self._count("hits")
+                return entry, "hit"
+
+            fingerprint = self._fingerprint(db_url, db_type)
+            if entry and fingerprint is not None and fingerprint == entry.fingerprint:
+                entry.validated_at = time.time()
+                self._count("revalidations")
+                return entry, "revalidated"
+
+            new_entry = self._reflect(db_url, db_type, fingerprint)
+            with self._lock:
+                self._entries[key] = new_entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted_key, None)
+            status = "refreshed" if entry else "miss"
+            self._count("refreshes" if entry else "misses")
+            return new_entry, status
+
+    def _fingerprint(self, db_url: str, db_type: str) -> str | None:
+        if db_type == 'sql':
+            return db_service.get_sql_schema_fingerprint(db_url)
+        return db_service.get_nosql_schema_fingerprint(db_url)
+
+    def _reflect(self, db_url: str, db_type: str, fingerprint: str | None) -> SchemaCacheEntry:
+        started = time.perf_counter()
+        if db_type == 'sql':
+            tables = db_service.reflect_sql_schema(db_url)
+        else:
+            tables = db_service.reflect_nosql_schema(db_url)
+        reflection_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._reflection_ms_total += reflection_ms
+        return SchemaCacheEntry(db_type, tables, fingerprint, reflection_ms)
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def invalidate(self, db_url: str | None = None) -> int:
+        with self._lock:
+            if db_url is None:
+                keys = list(self._entries)
+            else:
+                normalized = normalize_db_url(db_url)
+                keys = [key for key in self._entries if key[0] == normalized]
+            for key in keys:
+                del self._entries[key]
+            self._counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            reflections = counters["misses"] + counters["refreshes"]
+            lookups = reflections + counters["hits"] + counters["revalidations"]
+            entries = [
+                {
+                    "database_url": redact_db_url(key[0]),
+                    "db_type": entry.db_type,
+                    "objects": len(entry.tables),
+                    "schema_chars": len(entry.schema),
+                    "reflection_ms": round(entry.reflection_ms, 1),
+                    "age_seconds": round(time.time() - entry.fetched_at, 1),
+                }
+                for key, entry in self._entries.items()
+            ]
+            avg_reflection_ms = self._reflection_ms_total / reflections if reflections else 0.0
+        return {
+            **counters,
+            "hit_ratio": round((counters["hits"] + counters["revalidations"]) / lookups, 3) if lookups else 0.0,
+            "avg_reflection_ms": round(avg_reflection_ms, 1),
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries,
+            "entries": entries,
+        }
+
+
+schema_cache = SchemaCache()
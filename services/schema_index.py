@@ -0,0 +1,150 @@
+# services/schema_index.py
+
+import math
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+from services import db_service
+from utils.tokens import estimate_tokens
+
+load_dotenv()
+
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_PRUNING_TOP_K", 8))
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_PROMPT_TOKEN_BUDGET", 6000))
+
+_WORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+# Field weights: a match on a table name says more than a match on one of its columns.
+_NAME_WEIGHT = 3
+_COLUMN_WEIGHT = 1
+_COMMENT_WEIGHT = 1
+_REFERENCE_WEIGHT = 1
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for word in _WORD_RE.findall(text or ""):
+        word = word.lower()
+        # Crude plural folding so "customers" in a prompt matches a "customer" table.
+        if len(word) > 3 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class SchemaIndex:
+    def __init__(self, tables: list[dict], k1: float = 1.2, b: float = 0.75):
+        self.tables = tables
+        self.k1 = k1
+        self.b = b
+
+        self._term_freqs = [self._document_terms(table) for table in tables]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        document_freqs = Counter(term for freqs in self._term_freqs for term in freqs)
+        total = len(tables)
+        self._idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_freqs.items()
+        }
+
+        positions = {table['name']: i for i, table in enumerate(tables)}
+        self._neighbours = [set() for _ in tables]
+        for i, table in enumerate(tables):
+            for fk in table.get('foreign_keys', []):
+                j = positions.get(fk['referred_table'])
+                if j is not None and j != i:
+                    self._neighbours[i].add(j)
+                    self._neighbours[j].add(i)
+
+    @staticmethod
+    def _document_terms(table: dict) -> Counter:
+        terms = Counter()
+        for token in tokenize(table['name']):
+            terms[token] += _NAME_WEIGHT
+        for token in tokenize(table.get('comment') or ""):
+            terms[token] += _COMMENT_WEIGHT
+        for column in table.get('columns', []):
+            for token in tokenize(column['name']):
+                terms[token] += _COLUMN_WEIGHT
+            for token in tokenize(column.get('comment') or ""):
+                terms[token] += _COMMENT_WEIGHT
+        for fk in table.get('foreign_keys', []):
+            for token in tokenize(fk['referred_table']):
+                terms[token] += _REFERENCE_WEIGHT
+        return terms
+
+    def rank(self, query: str) -> list[tuple[float, int]]:
+        query_terms = set(tokenize(query)) & self._idf.keys()
+        scored = []
+        for i, freqs in enumerate(self._term_freqs):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / self._avg_length) if self._avg_length else self.k1
+            for term in query_terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored
+
+    def select(self, query: str, top_k: int, token_budget: int, render) -> list[dict]:
+        ranked = [i for _, i in self.rank(query)]
+        top = ranked[:top_k]
+        neighbours = [j for i in top for j in sorted(self._neighbours[i]) if j not in top]
+        # Tables the query never mentions are still better than an empty schema.
+        candidates = list(dict.fromkeys(top + neighbours)) or list(range(len(self.tables)))
+
+        selected = []
+        used_tokens = 0
+        for i in candidates:
+            cost = estimate_tokens(render([self.tables[i]])) + 1
+            if selected and used_tokens + cost > token_budget:
+                continue
+            selected.append(i)
+            used_tokens += cost
+        # Keep the original catalog order so related tables stay next to each other.
+        return [self.tables[i] for i in sorted(selected)]
+
+
+def prune_schema(schema_entry, user_prompt: str, top_k: int = SCHEMA_TOP_K,
+                 token_budget: int = SCHEMA_TOKEN_BUDGET) -> tuple[str, dict]:
+    full_schema = schema_entry.schema
+    full_tokens = estimate_tokens(full_schema)
+    render = db_service.format_sql_schema if schema_entry.db_type == 'sql' else db_service.format_nosql_schema
+
+    if full_tokens <= token_budget:
+        schema = full_schema
+        selected_count = len(schema_entry.tables)
+    else:
+        selected = schema_entry.index.select(user_prompt, top_k, token_budget, render)
+        schema = render(selected)
+        selected_count = len(selected)
+
+    pruned_tokens = estimate_tokens(schema)
+    stats = {
+        "objects_total": len(schema_entry.tables),
+        "objects_selected": selected_count,
+        "full_chars": len(full_schema),
+        "pruned_chars": len(schema),
+        "full_tokens_est": full_tokens,
+        "pruned_tokens_est": pruned_tokens,
+        "reduction_pct": round(100 * (1 - len(schema) / len(full_schema)), 1) if full_schema else 0.0,
+    }
+    return schema, stats
+
+
+def prune_schema_for_prompts(schema_entry, user_prompts: list[str], top_k: int = SCHEMA_TOP_K,
+                             token_budget: int = SCHEMA_TOKEN_BUDGET) -> str:
+    # For one generation call that answers several prompts: the union of the tables prune_schema
+    # selects for each prompt on its own, so no prompt sees less of the schema than it would alone.
+    if estimate_tokens(schema_entry.schema) <= token_budget:
+        return schema_entry.schema
+    render = db_service.format_sql_schema if schema_entry.db_type == 'sql' else db_service.format_nosql_schema
+    index = schema_entry.index
+    chosen = {id(table) for prompt in user_prompts for table in index.select(prompt, top_k, token_budget, render)}
+    return render([table for table in index.tables if id(table) in chosen])
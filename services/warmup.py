@@ -0,0 +1,111 @@
+# services/warmup.py
+
+import asyncio
+import importlib
+import os
+import time
+from dotenv import load_dotenv
+from services import db_service
+from services.connection_registry import connection_registry, redact_db_url
+from services.llm_service import get_llm_service
+from services.schema_cache import schema_cache
+from utils.concurrency import run_blocking, with_timeout
+from utils.telemetry import get_logger
+
+load_dotenv()
+
+log = get_logger("warmup")
+
+# Modules the request path imports on first use. Loading them here moves that cost off the first
+# report or visualization without putting it back on startup.
+DEFERRED_MODULES = ("services.result_profiler", "services.chart_service")
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+class WarmUp:
+    def __init__(self):
+        self.database_urls = [url.strip() for url in os.getenv("WARMUP_DATABASE_URLS", "").split(",") if url.strip()]
+        self.pool_connections = int(os.getenv("WARMUP_POOL_CONNECTIONS", 2))
+        self.warm_llm = _env_flag("WARMUP_LLM", "true")
+        self.warm_imports = _env_flag("WARMUP_IMPORTS", "true")
+        self.wait = _env_flag("WARMUP_WAIT", "false")
+        self.timeout = float(os.getenv("WARMUP_TIMEOUT_SECONDS", 60))
+
+        self.status = "pending"
+        self.started_at = None
+        self.duration_ms = None
+        self.steps: dict[str, dict] = {}
+
+    def _plan(self) -> list[tuple]:
+        steps = []
+        if self.warm_imports:
+            steps.append(("imports", self._import_deferred))
+        if self.warm_llm:
+            steps.append(("llm", get_llm_service))
+        for db_url in self.database_urls:
+            steps.append((f"database:{redact_db_url(db_url)}", lambda db_url=db_url: self._warm_database(db_url)))
+        return steps
+
+    @staticmethod
+    def _import_deferred():
+        for module in DEFERRED_MODULES:
+            importlib.import_module(module)
+
+    def _warm_database(self, db_url: str):
+        # Fills the pool and the schema cache, so the first query against a configured database
+        # neither connects nor reflects.
+        db_type, _ = db_service.get_db_details(db_url)
+        if db_type == 'sql':
+            with connection_registry.lease_engine(db_url) as engine:
+                opened = []
+                try:
+                    for _ in range(min(self.pool_connections, connection_registry.pool_size)):
+                        opened.append(engine.connect())
+                finally:
+                    for connection in opened:
+                        connection.close()
+        else:
+            with connection_registry.lease_mongo_client(db_url) as client:
+                client.admin.command('ping')
+        schema_cache.get(db_url, db_type)
+
+    async def _run_step(self, name: str, func):
+        started = time.perf_counter()
+        step = {"status": "running"}
+        self.steps[name] = step
+        try:
+            await with_timeout(run_blocking(func), self.timeout, "warm-up")
+            step["status"] = "ok"
+        except Exception as e:
+            # A database that is down or a missing API key must not keep the server from starting.
+            step.update(status="failed", error=str(e))
+            log.warning("Warm-up step failed", step=name, error=str(e))
+        step["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, func) for name, func in self._plan()))
+        self.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.status = "done"
+        log.info("Warm-up finished", duration_ms=self.duration_ms,
+                 failed=sum(step["status"] == "failed" for step in self.steps.values()))
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "done"
+
+    def stats(self) -> dict:
+        return {
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "steps": self.steps,
+        }
+
+
+warm_up = WarmUp()
@@ -0,0 +1,31 @@
+# utils/concurrency.py
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Blocking work (SQLAlchemy, pymongo, smtplib, schema pruning) runs here instead of on the
+# event loop. The pool is bounded so a burst of slow databases cannot spawn unbounded threads.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", 16))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def with_timeout(awaitable, seconds: float | None, stage: str):
+    try:
+        return await asyncio.wait_for(awaitable, timeout=seconds)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Stage '{stage}' timed out after {seconds} seconds.")
+
+
+def shutdown_blocking_pool():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,36 @@
+# utils/lazy.py
+
+import threading
+
+
+class LazyService:
+    # Builds a service on first use instead of at import time, so importing the app neither pays
+    # for the service's dependencies nor fails on its missing configuration. Calling the provider
+    # returns the instance, which makes it usable directly as a FastAPI dependency. A failed
+    # construction is not remembered; the next call tries again.
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def peek(self):
+        # The instance if it has been built, without building it.
+        return self._instance
+
+    def override(self, instance):
+        # Replaces the instance, e.g. with a fake in benchmarks.
+        with self._lock:
+            self._instance = instance
@@ -1,13 +1,38 @@
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 
 class QueryRequest(BaseModel):
     database_url: str
     prompt: str
+    max_rows: Optional[int] = None
+    # "rows" (list of objects), "columnar" (one array per column) or "arrow" (base64 Arrow IPC stream)
+    result_format: Literal["rows", "columnar", "arrow"] = "rows"
+    # False always runs the query against the database instead of serving a cached result.
+    use_cache: bool = True
+
+class BatchQueryRequest(BaseModel):
+    database_url: str
+    prompts: List[str]
+    max_rows: Optional[int] = None
+    result_format: Literal["rows", "columnar", "arrow"] = "rows"
+    use_cache: bool = True
+
+class PageRequest(BaseModel):
+    database_url: str
+    page_token: str
+    page_size: Optional[int] = None
+    result_format: Literal["rows", "columnar", "arrow"] = "rows"
+    use_cache: bool = True
 
 class InitialAnalysisResponse(BaseModel):
     database_type: str
     database_name: str
     isEmailRequired: bool
     isReportGenerationRequired: bool
-    isVisualizationRequired: bool
\ No newline at end of file
+    isVisualizationRequired: bool
+
+class SchemaCacheInvalidateRequest(BaseModel):
+    database_url: Optional[str] = None
+
+class ResultCacheInvalidateRequest(BaseModel):
+    database_url: Optional[str] = None
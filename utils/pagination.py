@@ -0,0 +1,37 @@
+# utils/pagination.py
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from bson import json_util
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tokens carry the generated query, so they are signed to stop clients from paging through
+# statements the pipeline never produced. Set PAGE_TOKEN_SECRET to share tokens across workers.
+_SECRET = (os.getenv("PAGE_TOKEN_SECRET") or secrets.token_hex(32)).encode()
+
+
+def database_fingerprint(normalized_db_url: str) -> str:
+    return hashlib.sha256(normalized_db_url.encode()).hexdigest()[:16]
+
+
+def encode_page_token(state: dict) -> str:
+    # json_util keeps ObjectId and datetime keyset values intact across the round trip.
+    payload = json_util.dumps(state, sort_keys=True).encode()
+    signature = hmac.new(_SECRET, payload, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(signature + payload).decode().rstrip("=")
+
+
+def decode_page_token(token: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed page token.")
+    signature, payload = raw[:16], raw[16:]
+    if not hmac.compare_digest(signature, hmac.new(_SECRET, payload, hashlib.sha256).digest()[:16]):
+        raise ValueError("Invalid or expired page token.")
+    return json_util.loads(payload)
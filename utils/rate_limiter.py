@@ -0,0 +1,66 @@
+# utils/rate_limiter.py
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    # Refills `rate` tokens per second up to `capacity`. A single bucket is shared by everything
+    # that draws on the same upstream quota, from threads and coroutines alike.
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("TokenBucket rate must be positive.")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._waited = 0.0
+
+    def reserve(self, tokens: float = 1.0, max_wait: float | None = None) -> float | None:
+        # Takes the tokens immediately, going into debt when the bucket is short, and returns how
+        # long the caller has to wait. Callers are therefore served in the order they arrived.
+        # When the wait would exceed max_wait nothing is taken and None is returned.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (tokens - self._tokens) / self.rate if self._tokens < tokens else 0.0
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= tokens
+            self._acquired += 1
+            self._waited += wait
+            return wait
+
+    def refund(self, tokens: float, wait: float = 0.0):
+        # Returns a reservation that will not be used; `wait` is what reserve() returned for it.
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+            self._acquired -= 1
+            self._waited -= wait
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, tokens: float = 1.0) -> float:
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "available": round(tokens, 2),
+                "acquired": self._acquired,
+                "waited_seconds": round(self._waited, 3),
+            }
@@ -0,0 +1,16 @@
+# utils/responses.py
+
+from fastapi.responses import JSONResponse
+from utils.serialization import dumps
+from utils.telemetry import span, RESPONSE_BYTES
+
+
+class FastJSONResponse(JSONResponse):
+    # Serializes with orjson when it is installed. Routes that return this class directly
+    # also skip FastAPI's jsonable_encoder pass over large result sets.
+    def render(self, content) -> bytes:
+        with span("serialization", stage="serialization") as current:
+            body = dumps(content)
+            current.set(bytes=len(body))
+        RESPONSE_BYTES.observe(len(body))
+        return body
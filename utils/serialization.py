@@ -0,0 +1,160 @@
+# utils/serialization.py
+
+import base64
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder produces the same JSON, just slower.
+    orjson = None
+
+_PASSTHROUGH_TYPES = (str, int, float, bool)
+
+
+def _to_isoformat(value):
+    return value.isoformat()
+
+
+def _to_text(value):
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    try:
+        # Try to decode bytes into a UTF-8 string
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        # If it's not text (e.g., an image), use a safe placeholder
+        return '<Binary Data>'
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_any(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return _to_text(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+_CONVERTERS = {
+    datetime.datetime: _to_isoformat,
+    datetime.date: _to_isoformat,
+    datetime.time: _to_isoformat,
+    bytes: _to_text,
+    memoryview: _to_text,
+    decimal.Decimal: _to_float,
+}
+
+
+class RowConverter:
+    # Picks one converter per column from the first non-null value of each column, so rows
+    # are converted with a single pass over the few columns that need it instead of an
+    # isinstance chain on every cell.
+    def __init__(self, columns: list[str], sample_rows: list[tuple]):
+        self.columns = list(columns)
+        self._converters = []
+        for i in range(len(self.columns)):
+            sample = next((row[i] for row in sample_rows if row[i] is not None), None)
+            if sample is None:
+                converter = _to_any
+            elif isinstance(sample, _PASSTHROUGH_TYPES):
+                continue
+            else:
+                converter = _CONVERTERS.get(type(sample), _to_any)
+            self._converters.append((i, converter))
+
+    def convert(self, row: tuple) -> dict:
+        if not self._converters:
+            return dict(zip(self.columns, row))
+        values = list(row)
+        for i, converter in self._converters:
+            value = values[i]
+            if value is not None:
+                values[i] = converter(value)
+        return dict(zip(self.columns, values))
+
+    def convert_all(self, rows: list[tuple]) -> list[dict]:
+        return [self.convert(row) for row in rows]
+
+
+def convert_sql_rows(columns, rows) -> list[dict]:
+    rows = [tuple(row) for row in rows]
+    return RowConverter(list(columns), rows[:50]).convert_all(rows)
+
+
+def serialize_document(value):
+    # Equivalent to json.loads(json.dumps(doc, default=str)) without the string round trip:
+    # JSON-native values pass through and anything else (ObjectId, datetime, ...) becomes str().
+    value_type = type(value)
+    if value_type is dict:
+        return {key: serialize_document(item) for key, item in value.items()}
+    if value_type is list or value_type is tuple:
+        return [serialize_document(item) for item in value]
+    if value is None or value_type in _PASSTHROUGH_TYPES:
+        return value
+    if isinstance(value, dict):
+        return {key: serialize_document(item) for key, item in value.items()}
+    return str(value)
+
+
+def _default(value):
+    converted = _to_any(value)
+    if converted is value:
+        return str(value)
+    return converted
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+
+def dumps_text(obj) -> str:
+    # Compact JSON for LLM prompts; indentation only costs tokens.
+    return dumps(obj).decode()
+
+
+def to_columnar(rows: list[dict]) -> dict:
+    columns = list(dict.fromkeys(key for row in rows[:1000] for key in row))
+    return {
+        "columns": columns,
+        "data": {column: [row.get(column) for row in rows] for column in columns},
+        "row_count": len(rows),
+    }
+
+
+def to_arrow_ipc(rows: list[dict]) -> dict:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("The 'arrow' result format requires the optional pyarrow package.")
+    table = pa.Table.from_pylist(rows)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return {
+        "encoding": "arrow-ipc-stream+base64",
+        "data": base64.b64encode(sink.getvalue().to_pybytes()).decode(),
+        "row_count": len(rows),
+    }
+
+
+RESULT_FORMATS = {
+    "rows": lambda rows: rows,
+    "columnar": to_columnar,
+    "arrow": to_arrow_ipc,
+}
+
+
+def format_result(rows: list[dict], result_format: str):
+    formatter = RESULT_FORMATS.get(result_format)
+    if formatter is None:
+        raise ValueError(f"Unsupported result_format '{result_format}'. Use one of: {', '.join(RESULT_FORMATS)}.")
+    return formatter(rows)
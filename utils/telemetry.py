@@ -0,0 +1,389 @@
+# utils/telemetry.py
+
+import asyncio
+import bisect
+import contextvars
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" writes one object per line for log shippers; "text" is easier to read in a terminal.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Spans are exported through OpenTelemetry when this is on and the opentelemetry packages are installed.
+OTEL_TRACES_ENABLED = os.getenv("OTEL_TRACES_ENABLED", "false").lower() == "true"
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "db-automation-helper")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+# --- Logging -------------------------------------------------------------------------------
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        current = _current_span.get()
+        if current is not None:
+            entry["trace_id"] = current.trace_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", {})
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    # log.info("Query executed", rows=20) attaches rows=20 as a field instead of formatting it in.
+    _RESERVED = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self._RESERVED}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        return msg, kwargs
+
+
+_logging_lock = threading.Lock()
+_logging_configured = False
+
+
+def _configure_logging():
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        # Only the application's own loggers are configured; uvicorn keeps its own output.
+        root = logging.getLogger("db_automation")
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _logging_configured = True
+
+
+def get_logger(name: str) -> StructuredLogger:
+    _configure_logging()
+    return StructuredLogger(logging.getLogger(f"db_automation.{name}"), {})
+
+
+log = get_logger("telemetry")
+
+
+# --- Metrics -------------------------------------------------------------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+TOKEN_BUCKETS = (10, 100, 500, 1_000, 2_000, 5_000, 10_000, 50_000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = {key: self._copy(value) for key, value in self._series.items()}
+        for key, value in sorted(series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_label_text(self.labels, key)} {value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _render_series(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_label_text(self.labels, key)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _render_series(self, key: tuple, value) -> list[str]:
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % bound
+            lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+        lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple = ()) -> Gauge:
+        return self._metrics.setdefault(name, Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format, version 0.0.4.
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_DURATION = metrics.histogram(
+    "dbhelper_stage_duration_seconds", "Duration of each pipeline stage.", ("stage", "status"))
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "dbhelper_http_request_duration_seconds", "Duration of HTTP requests.", ("method", "route", "status"))
+LLM_REQUEST_DURATION = metrics.histogram(
+    "dbhelper_llm_request_duration_seconds", "Duration of Gemini calls that were not served from the cache.",
+    ("template", "status"))
+LLM_TOKENS = metrics.counter(
+    "dbhelper_llm_tokens_total", "Estimated tokens sent to and received from Gemini.", ("template", "direction"))
+LLM_PROMPT_TOKENS = metrics.histogram(
+    "dbhelper_llm_prompt_tokens", "Estimated prompt size of Gemini calls.", ("template",), TOKEN_BUCKETS)
+LLM_QUEUE_DEPTH = metrics.gauge(
+    "dbhelper_llm_queue_depth", "Gemini calls waiting for a slot in the LLM scheduler.", ("priority",))
+LLM_IN_FLIGHT = metrics.gauge(
+    "dbhelper_llm_in_flight", "Gemini calls holding a slot in the LLM scheduler.")
+LLM_QUEUE_WAIT = metrics.histogram(
+    "dbhelper_llm_queue_wait_seconds", "Time Gemini calls waited for a slot and for the rate limits.", ("priority",))
+LLM_RETRIES = metrics.counter(
+    "dbhelper_llm_retries_total", "Gemini calls retried after a transient error.", ("template", "reason"))
+LLM_REJECTED = metrics.counter(
+    "dbhelper_llm_rejected_total", "Gemini calls refused or abandoned by the LLM scheduler.", ("reason",))
+LLM_PROMPT_TRUNCATIONS = metrics.counter(
+    "dbhelper_llm_prompt_truncations_total", "Prompts shortened to fit LLM_MAX_PROMPT_TOKENS.", ("template",))
+QUERY_GUARD_FAILURES = metrics.counter(
+    "dbhelper_query_guard_failures_total", "Generated queries executed without a plan check.", ("db_type", "reason"))
+RESULT_ROWS = metrics.histogram(
+    "dbhelper_result_rows", "Rows returned by executed queries.", ("db_type",), ROW_BUCKETS)
+RESPONSE_BYTES = metrics.histogram(
+    "dbhelper_response_bytes", "Size of serialized JSON responses.", (), BYTE_BUCKETS)
+SMTP_SEND_DURATION = metrics.histogram(
+    "dbhelper_smtp_send_duration_seconds", "Duration of single SMTP deliveries, retries included.", ("outcome",))
+
+
+def observe_stage(stage: str, seconds: float, status: str = "ok"):
+    STAGE_DURATION.observe(seconds, stage=stage, status=status)
+
+
+# --- Tracing -------------------------------------------------------------------------------
+
+_otel_lock = threading.Lock()
+_otel_checked = False
+_otel_tracer = None
+
+
+def _get_otel_tracer():
+    global _otel_checked, _otel_tracer
+    if not OTEL_TRACES_ENABLED:
+        return None
+    with _otel_lock:
+        if _otel_checked:
+            return _otel_tracer
+        _otel_checked = True
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            log.warning("OTEL_TRACES_ENABLED is set but opentelemetry-api is not installed; traces are not exported.")
+            return None
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT and friends from the environment.
+            provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+        except ImportError:
+            # Without the SDK and OTLP exporter, spans go to whatever provider the host process set up.
+            pass
+        _otel_tracer = trace.get_tracer("db_automation_helper")
+        return _otel_tracer
+
+
+_span_processors = []
+
+
+def add_span_processor(processor):
+    # `processor(span)` is called with every finished span, e.g. by the benchmarks to collect
+    # per-stage timings.
+    _span_processors.append(processor)
+
+
+def _otel_value(value):
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+class Span:
+    def __init__(self, name: str, parent: "Span | None", attributes: dict, stage: str | None = None):
+        self.name = name
+        self.stage = stage
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.started = time.perf_counter()
+        self.duration = None
+        self._otel = None
+        tracer = _get_otel_tracer()
+        if tracer is not None:
+            from opentelemetry import trace
+            context = trace.set_span_in_context(parent._otel) if parent is not None and parent._otel is not None else None
+            self._otel = tracer.start_span(name, context=context,
+                                           attributes={key: _otel_value(value) for key, value in attributes.items()})
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        if self._otel is not None:
+            for key, value in attributes.items():
+                self._otel.set_attribute(key, _otel_value(value))
+
+    def fail(self, message: str):
+        # For work that reports its failure in the response instead of raising.
+        self.status = "error"
+        self.set(error=message)
+
+    def _end(self, error: BaseException | None):
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+            self.attributes["error"] = str(error) or type(error).__name__
+        if self._otel is not None:
+            if self.status != "ok":
+                from opentelemetry.trace import Status, StatusCode
+                self._otel.set_status(Status(StatusCode.ERROR, self.attributes["error"]))
+            self._otel.end()
+
+
+@contextmanager
+def span(name: str, stage: str | None = None, **attributes):
+    # Times a block of work, in sync and async code alike. With `stage`, the duration is also
+    # recorded in dbhelper_stage_duration_seconds. Nested spans share the trace id of the outermost one.
+    parent = _current_span.get()
+    current = Span(name, parent, attributes, stage)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        current._end(error)
+        if stage is not None:
+            observe_stage(stage, current.duration, current.status)
+        for processor in _span_processors:
+            processor(current)
+        log.debug("Span finished", span=name, trace_id=current.trace_id, status=current.status,
+                  duration_ms=round(current.duration * 1000, 1), **current.attributes)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
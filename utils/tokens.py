@@ -0,0 +1,8 @@
+# utils/tokens.py
+
+# Gemini does not expose a local tokenizer; ~4 characters per token is close enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN